@@ -1,55 +1,230 @@
 from __future__ import annotations
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel, Field
+from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
 from api.db.history import init_db
-from api.graphs.graph import build_rag_graph
+from api.graphs.graph import build_rag_graph, build_rag_stream_graph
+from api.graphs.streaming import astream_answer, apersist_turn
+from api.graphs.retrieval import retrieval_stats
+from api.graphs.prompt_budget import prompt_stats
+from api.graphs.compression import compression_stats
+from api.graphs.resources import get_embeddings, get_answer_cache, get_vectorstore_stats, get_collection_registry
+from api.graphs.collection_registry import UnknownCollection, DEFAULT_COLLECTION, format_versions
+from api.graphs.config import INDEX_WATCH_INTERVAL
+from api.graphs.followup_classifier import decision_stats
+from api.graphs.background import get_task_queue
+from api.db.writer import get_turn_writer
+from api.monitoring.metrics import render_metrics
 from api.evaluation.run_ragas import run_eval as run_ragas_eval
 from langserve import add_routes
+import asyncio
 import uvicorn
 import traceback
+import json
 
 load_dotenv()
 #init_db()
 
-app = FastAPI(title="RAG Chatbot")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # cada worker recarga el índice cuando build_vectorstore publica una versión nueva
+    get_collection_registry().start_watcher(INDEX_WATCH_INTERVAL)
+    yield
+    get_collection_registry().stop_watcher()
+    # termina los resúmenes encolados y escribe los turnos pendientes antes de salir
+    get_task_queue().shutdown(wait=True)
+    get_turn_writer().shutdown()
+
+app = FastAPI(title="RAG Chatbot", lifespan=lifespan)
 
 graph_app = build_rag_graph()
+stream_graph_app = build_rag_stream_graph()
 add_routes(app, graph_app, path="/graph")
 
 class ChatRequest(BaseModel):
     session_id: str
     question: str
+    # una colección, una lista o "*" para buscar en todas (por defecto "default")
+    collection: str | list[str] | None = None
 
 class EvalRequest(BaseModel):
     limit: int | None = None
     dry_run: bool = False
+    # run_eval lo recorta a EVAL_MAX_CONCURRENCY: cada respuesta en vuelo son varias llamadas pagas
+    concurrency: int | None = Field(default=None, ge=1)
+
+def _resolve_collections(req):
+    try:
+        return get_collection_registry().resolve(req.collection)
+    except UnknownCollection as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
+    collections = _resolve_collections(req)
+    registry = get_collection_registry()
+    try:
+        # la carga perezosa de un shard lee disco: se hace fuera del event loop
+        indexes = await asyncio.to_thread(registry.acquire, collections)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
     try:
-        app = build_rag_graph()
-        result = app.invoke({"session_id": req.session_id, "question": req.question})
+        # el request completo usa la misma versión de cada índice aunque haya un swap en el medio
+        with registry.use(indexes):
+            result = await graph_app.ainvoke({
+                "session_id": req.session_id,
+                "question": req.question,
+                "collections": collections,
+            })
         return {
             "answer": result.get("answer", ""),
             "question_rewritten": result.get("question_rewritten", req.question),
             "followup": result.get("followup", False),
             "skip_rag": result.get("skip_rag", False),
             "sources": result.get("sources", []),
-            "history_used": bool(result.get("history_used"))
+            "history_used": bool(result.get("history_used")),
+            "cache_hit": bool(result.get("cache_hit")),
+            "prompt_tokens": result.get("prompt_tokens"),
+            "compression": result.get("compression"),
+            "collections": collections,
+            "index_version": format_versions(indexes),
         }
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        registry.release(indexes)
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    collections = _resolve_collections(req)
+    registry = get_collection_registry()
+    try:
+        indexes = await asyncio.to_thread(registry.acquire, collections)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        with registry.use(indexes):
+            state = await stream_graph_app.ainvoke({
+                "session_id": req.session_id,
+                "question": req.question,
+                "collections": collections,
+            })
+    except Exception as e:
+        registry.release(indexes)
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    state.setdefault("question_rewritten", req.question)
+    state.setdefault("sources", [])
+    state.setdefault("history_used", False)
+    completed = {"ok": False}
+
+    async def events():
+        yield {
+            "event": "context",
+            "data": json.dumps({
+                "question_rewritten": state["question_rewritten"],
+                "followup": state.get("followup", False),
+                "skip_rag": state.get("skip_rag", False),
+                "sources": state["sources"],
+                "history_used": bool(state["history_used"]),
+                "cache_hit": bool(state.get("cache_hit")),
+                "prompt_tokens": state.get("prompt_tokens"),
+                "compression": state.get("compression"),
+                "collections": collections,
+                "index_version": format_versions(indexes),
+            }, ensure_ascii=False),
+        }
+
+        parts = []
+        try:
+            async for token in astream_answer(state):
+                parts.append(token)
+                yield {"event": "token", "data": json.dumps({"token": token}, ensure_ascii=False)}
+        except Exception as e:
+            traceback.print_exc()
+            yield {"event": "error", "data": json.dumps({"detail": str(e)}, ensure_ascii=False)}
+            return
+
+        state["answer"] = "".join(parts).strip()
+        completed["ok"] = True
+        yield {"event": "done", "data": json.dumps({"answer": state["answer"]}, ensure_ascii=False)}
+
+    async def persist():
+        # Solo se guardan turnos completos; corre después de cerrar el stream.
+        # Recién acá se libera la versión del índice fijada para este request.
+        try:
+            if completed["ok"]:
+                with registry.use(indexes):
+                    await apersist_turn(state)
+        finally:
+            registry.release(indexes)
+
+    return EventSourceResponse(events(), background=BackgroundTask(persist))
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    registry = get_collection_registry()
+    return {
+        "status": "ok",
+        "index_version": registry.manager(DEFAULT_COLLECTION).version(),
+        "collections_loaded": {name: registry.manager(name).version() for name in registry.loaded()},
+    }
+
+@app.get("/collections")
+async def list_collections():
+    registry = get_collection_registry()
+    loaded = set(registry.loaded())
+    return [
+        {"name": name, "loaded": name in loaded, "index_version": registry.manager(name).version()}
+        for name in registry.names()
+    ]
+
+@app.post("/admin/reload-index")
+async def reload_index(collection: str = DEFAULT_COLLECTION, force: bool = False):
+    """Carga la versión publicada en CURRENT de una colección sin reiniciar (solo en este worker)."""
+    registry = get_collection_registry()
+    try:
+        registry.resolve([collection])
+    except UnknownCollection as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        reloaded = await asyncio.to_thread(registry.reload, collection, force)
+        return {"collection": collection, "reloaded": reloaded, "index_version": registry.manager(collection).version()}
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/stats")
+async def stats():
+    return {
+        "embedding_cache": get_embeddings().stats(),
+        "answer_cache": get_answer_cache().stats(),
+        "vectorstore": get_vectorstore_stats(),
+        "retrieval": retrieval_stats(),
+        "prompt": prompt_stats(),
+        "compression": compression_stats(),
+        "followup_classifier": decision_stats(),
+        "background_sessions_pending": get_task_queue().pending(),
+        "history_writer": get_turn_writer().stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato Prometheus (latencia por nodo, llamadas y tokens del LLM, recuperación, SQLite)."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.post("/rag/evaluate")
 async def evaluate_rag(req: EvalRequest):
     try:
-        return await run_ragas_eval(limit=req.limit, dry_run=req.dry_run)
+        return await run_ragas_eval(limit=req.limit, dry_run=req.dry_run, concurrency=req.concurrency)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
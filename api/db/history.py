@@ -1,20 +1,34 @@
 from __future__ import annotations
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 import json
+from api.monitoring.metrics import timed_db
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DB_PATH = PROJECT_ROOT / "db" / "chat_history.sqlite"
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-def get_conn():
-    return sqlite3.connect(DB_PATH)
+DB_POOL_SIZE = 8
 
-def init_db():
-    with get_conn() as con:
-        cur = con.cursor()
-        cur.execute("""
+# Pragmas por conexión: WAL permite lecturas concurrentes con un escritor y
+# synchronous=NORMAL evita un fsync por commit (seguro con WAL).
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+)
+
+# Cada migración se aplica una sola vez; PRAGMA user_version guarda la última.
+MIGRATIONS = [
+    (
+        """
         CREATE TABLE IF NOT EXISTS chat_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id TEXT NOT NULL,
@@ -23,15 +37,15 @@ def init_db():
             message TEXT NOT NULL,
             created_at TEXT NOT NULL
         );
-        """)
-        cur.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS session_summary (
             session_id TEXT PRIMARY KEY,
             summary TEXT,
             updated_at TEXT NOT NULL
         );
-        """)
-        cur.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS rag_answers_meta (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id TEXT NOT NULL,
@@ -41,9 +55,8 @@ def init_db():
             created_at TEXT NOT NULL,
             UNIQUE(session_id, turn)
         );
-        """)
-
-        cur.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS rag_evals (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id TEXT NOT NULL,
@@ -55,9 +68,98 @@ def init_db():
             created_at TEXT NOT NULL,
             UNIQUE(session_id, turn)
         );
-        """)
-        con.commit()
+        """,
+    ),
+    (
+        # load_history: WHERE session_id = ? ORDER BY id DESC
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_session_id ON chat_history(session_id, id);",
+        # subconsultas por (session_id, turn, role) en fetch_answers_pending_eval y el export
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_session_turn_role ON chat_history(session_id, turn, role);",
+    ),
+]
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones SQLite reutilizables y seguro entre hilos: cada
+    conexión la usa un solo hilo a la vez. connection() hace commit al salir
+    o rollback si hubo una excepción.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            con.execute(pragma)
+        return con
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        con = self._acquire()
+        try:
+            yield con
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+        finally:
+            self._idle.put(con)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                pool = ConnectionPool(DB_PATH)
+                migrate(pool)
+                _POOL = pool
+    return _POOL
+
+def get_conn():
+    return get_pool().connection()
+
+def migrate(pool):
+    with pool.connection() as con:
+        (version,) = con.execute("PRAGMA user_version").fetchone()
+        for i, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for sql in statements:
+                con.execute(sql)
+            con.execute(f"PRAGMA user_version = {i}")
+
+def init_db():
+    get_pool()
 
+@timed_db("load_history")
 def load_history(session_id, last_n=8):
     with get_conn() as con:
         cur = con.cursor()
@@ -70,6 +172,27 @@ def load_history(session_id, last_n=8):
         rows = cur.fetchall()
     return [{"role": r, "message": m} for (r, m) in rows[::-1]]
 
+@timed_db("load_history_with_summary")
+def load_history_with_summary(session_id, last_n=8):
+    """Últimos turnos y resumen de la sesión en una sola consulta."""
+    with get_conn() as con:
+        rows = con.execute("""
+            SELECT 0 AS kind, NULL AS role, summary AS message
+            FROM session_summary WHERE session_id = ?
+            UNION ALL
+            SELECT * FROM (
+                SELECT 1, role, message FROM chat_history
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            )
+        """, (session_id, session_id, last_n)).fetchall()
+
+    summary = next((m for k, _, m in rows if k == 0), None)
+    turns = [{"role": r, "message": m} for (k, r, m) in rows if k == 1]
+    return turns[::-1], summary
+
+@timed_db("save_turn")
 def save_turn(session_id, role, message, turn=None):
     with get_conn() as con:
         cur = con.cursor()
@@ -83,9 +206,42 @@ def save_turn(session_id, role, message, turn=None):
             INSERT INTO chat_history (session_id, turn, role, message, created_at)
             VALUES (?, ?, ?, ?, ?)
         """, (session_id, turn, role, message, datetime.utcnow().isoformat()))
-        con.commit()
     return turn
 
+@timed_db("insert_turn")
+def insert_completed_turn(con, session_id, question, answer, sources, contexts):
+    """
+    Inserta pregunta, respuesta y metadatos de un turno usando la conexión
+    dada, sin hacer commit. El número de turno se asigna dentro de la misma
+    transacción, así que es atómico si el llamador abrió BEGIN IMMEDIATE.
+    """
+    now = datetime.utcnow().isoformat()
+    (turn,) = con.execute("""
+        SELECT COALESCE(MAX(turn), -1) + 1
+        FROM chat_history WHERE session_id = ?
+    """, (session_id,)).fetchone()
+    con.executemany("""
+        INSERT INTO chat_history (session_id, turn, role, message, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [
+        (session_id, turn, "user", question, now),
+        (session_id, turn, "assistant", answer, now),
+    ])
+    if sources or contexts:
+        con.execute("""
+            INSERT OR REPLACE INTO rag_answers_meta
+            (session_id, turn, sources_json, contexts_json, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            session_id,
+            turn,
+            json.dumps(sources, ensure_ascii=False),
+            json.dumps(contexts, ensure_ascii=False),
+            now
+        ))
+    return turn
+
+@timed_db("get_summary")
 def get_summary(session_id):
     with get_conn() as con:
         cur = con.cursor()
@@ -93,6 +249,7 @@ def get_summary(session_id):
         row = cur.fetchone()
     return row[0] if row else None
 
+@timed_db("upsert_summary")
 def upsert_summary(session_id, summary):
     with get_conn() as con:
         cur = con.cursor()
@@ -103,8 +260,8 @@ def upsert_summary(session_id, summary):
                 summary = excluded.summary,
                 updated_at = excluded.updated_at
         """, (session_id, summary, datetime.utcnow().isoformat()))
-        con.commit()
 
+@timed_db("save_answer_meta")
 def save_answer_meta(session_id, turn, sources, contexts):
     with get_conn() as con:
         cur = con.cursor()
@@ -119,8 +276,8 @@ def save_answer_meta(session_id, turn, sources, contexts):
             json.dumps(contexts, ensure_ascii=False),
             datetime.utcnow().isoformat()
         ))
-        con.commit()
 
+@timed_db("fetch_pending_eval")
 def fetch_answers_pending_eval(limit = None):
     """
     Devuelve filas con: session_id, turn, question, answer, sources_json, contexts_json
@@ -164,6 +321,13 @@ def fetch_answers_pending_eval(limit = None):
     ]
 
 
+_EVAL_INSERT = """
+    INSERT OR REPLACE INTO rag_evals
+    (session_id, turn, faithfulness, answer_relevancy, context_precision, context_recall, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+@timed_db("save_eval_result")
 def save_eval_result(
     session_id,
     turn,
@@ -176,11 +340,7 @@ def save_eval_result(
     """Guarda resultados de RAGAS en tabla rag_evals."""
     with get_conn() as con:
         cur = con.cursor()
-        cur.execute("""
-            INSERT OR REPLACE INTO rag_evals
-            (session_id, turn, faithfulness, answer_relevancy, context_precision, context_recall, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+        cur.execute(_EVAL_INSERT, (
             session_id, turn,
             faithfulness,
             answer_relevancy,
@@ -188,4 +348,23 @@ def save_eval_result(
             context_recall,
             datetime.utcnow().isoformat()
         ))
-        con.commit()
\ No newline at end of file
+
+@timed_db("save_eval_results")
+def save_eval_results(results):
+    """
+    Guarda varios resultados de RAGAS en una sola transacción. Cada elemento
+    es un dict con session_id, turn y las cuatro métricas.
+    """
+    now = datetime.utcnow().isoformat()
+    with get_conn() as con:
+        con.executemany(_EVAL_INSERT, [
+            (
+                r["session_id"], r["turn"],
+                r.get("faithfulness"),
+                r.get("answer_relevancy"),
+                r.get("context_precision"),
+                r.get("context_recall"),
+                now,
+            )
+            for r in results
+        ])
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import atexit
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from api.graphs.config import WRITE_MODE, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL
+from api.monitoring.metrics import timed_db_block
+from .history import get_pool, insert_completed_turn
+
+_STOP = object()
+
+
+class _PendingTurn:
+    __slots__ = ("session_id", "question", "answer", "sources", "contexts", "future")
+
+    def __init__(self, session_id, question, answer, sources, contexts):
+        self.session_id = session_id
+        self.question = question
+        self.answer = answer
+        self.sources = sources
+        self.contexts = contexts
+        self.future = Future()
+
+
+class TurnWriter:
+    """
+    Escritor write-behind de turnos completos. Un hilo dedicado junta los
+    turnos que llegan de todos los requests y los escribe en lotes, cada uno
+    en una sola transacción BEGIN IMMEDIATE; el número de turno se asigna
+    dentro de esa transacción, así que dos requests de la misma sesión nunca
+    comparten turno. Si el lote falla se reintenta turno por turno, así que
+    solo falla el Future del turno problemático.
+    """
+
+    def __init__(self, mode=WRITE_MODE, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        if mode not in ("batched", "sync"):
+            raise ValueError(f"Modo de escritura desconocido: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches = 0
+        self.turns = 0
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="turn-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, session_id, question, answer, sources, contexts):
+        """Encola el turno; devuelve un Future con el número de turno asignado."""
+        item = _PendingTurn(session_id, question, answer, sources, contexts)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("El escritor de historial ya fue cerrado.")
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put(item)
+        return item.future
+
+    def wait_session(self, session_id, timeout):
+        """Espera a que los turnos encolados de la sesión estén en la base."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending.get(session_id), timeout)
+
+    def flush(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    @staticmethod
+    def _insert(batch):
+        # la conexión del pool hace rollback si algo falla dentro de la transacción
+        turns = []
+        with timed_db_block("write_batch"), get_pool().connection() as con:
+            con.execute("BEGIN IMMEDIATE")
+            for t in batch:
+                turns.append(insert_completed_turn(
+                    con, t.session_id, t.question, t.answer, t.sources, t.contexts
+                ))
+        return turns
+
+    def _write(self, batch):
+        try:
+            try:
+                results = list(zip(batch, self._insert(batch)))
+                self.batches += 1
+            except Exception as e:
+                traceback.print_exc()
+                if len(batch) == 1:
+                    batch[0].future.set_exception(e)
+                    return
+                # el lote se deshizo entero: se reintenta de a un turno, en orden,
+                # para que un turno inválido no haga fallar a los demás
+                results = []
+                for t in batch:
+                    try:
+                        results.append((t, self._insert([t])[0]))
+                        self.batches += 1
+                    except Exception as row_error:
+                        t.future.set_exception(row_error)
+            self.turns += len(results)
+            for t, turn in results:
+                t.future.set_result(turn)
+        finally:
+            with self._cond:
+                for t in batch:
+                    left = self._pending[t.session_id] - 1
+                    if left:
+                        self._pending[t.session_id] = left
+                    else:
+                        del self._pending[t.session_id]
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            self._write(self._collect(first))
+
+    def shutdown(self, timeout=None):
+        """Escribe lo pendiente y detiene el hilo (también se llama en atexit)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            pending = sum(self._pending.values())
+        return {"mode": self.mode, "pending": pending, "batches": self.batches, "turns": self.turns}
+
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+def get_turn_writer():
+    global _WRITER
+    if _WRITER is None:
+        with _WRITER_LOCK:
+            if _WRITER is None:
+                _WRITER = TurnWriter()
+                atexit.register(_WRITER.shutdown)
+    return _WRITER
@@ -0,0 +1,472 @@
+"""
+Benchmark de carga offline del chat.
+
+Levanta la app FastAPI real (con build_rag_graph y los nodos de siempre) sobre
+un índice construido en un directorio temporal, con el LLM y los embeddings
+del backend local (api/graphs/local_models.py) y latencia simulada. Reproduce
+sesiones multi-turno con la concurrencia y la tasa de llegada pedidas y guarda
+un JSON con percentiles de latencia, throughput y el desglose por nodo (tomado
+de las métricas Prometheus de api/monitoring/metrics.py).
+
+    python -m api.evaluation.benchmark.run_benchmark --sessions 200 --concurrency 16
+    python -m api.evaluation.benchmark.run_benchmark --rate 5 --endpoint stream --compare results/anterior.json
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import httpx
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from api.db import history
+from api.graphs import config
+from api.graphs import resources
+from api.graphs.answer_cache import SemanticAnswerCache
+from api.graphs.bm25 import BM25Index, BM25_FILE
+from api.graphs.collection_registry import CollectionRegistry
+from api.graphs.compression import SentenceIndex, SENTENCES_FILE
+from api.graphs.embedding_cache import CachedEmbeddings
+from api.graphs.faiss_index import create_index
+from api.graphs.index_manager import new_version_dir, publish_version
+from api.graphs.index_store import save_index_store
+from api.graphs.local_models import CannedChatModel, HashingEmbeddings, LatencyModel
+from api.monitoring.metrics import NODE_SECONDS, LLM_SECONDS, LLM_TOKENS, RETRIEVAL_SECONDS, DB_SECONDS, llm_callbacks
+from api.scripts.build_vectorstore import load_chunks, chunk_to_document
+from .sessions import build_sessions, load_sessions
+
+BENCH_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCH_DIR / "results"
+DEFAULT_CHUNKS = config.PROJECT_ROOT / "api" / "data" / "processed" / "clean_chunks.json"
+
+# configuración que cambia el costo de un request; se guarda con cada resultado
+CONFIG_KEYS = (
+    "TOP_K", "HYBRID_RETRIEVAL", "MMR_ENABLED", "COMPRESSION_ENABLED", "SPECULATIVE_RETRIEVAL",
+    "FOLLOWUP_FASTPATH_ENABLED", "ANSWER_CACHE_ENABLED", "PROMPT_TOKEN_BUDGET",
+)
+# métricas comparadas con --compare: (clave, mayor es mejor)
+COMPARED = (
+    ("latency_ms.p50", False), ("latency_ms.p95", False), ("latency_ms.p99", False),
+    ("ttft_ms.p50", False), ("ttft_ms.p95", False), ("queue_wait_ms.p95", False),
+    ("throughput_rps", True), ("errors", False),
+)
+
+def synthetic_chunks(n, seed=0):
+    """Corpus de relleno (cuando no hay clean_chunks.json) con el vocabulario de las preguntas de prueba."""
+    from api.evaluation.test_client.test_questions import test_questions
+
+    rng = random.Random(seed)
+    words = sorted({w.strip("¿?,.()").lower() for q in test_questions for w in q.split() if len(w) > 3})
+    chunks = []
+    for i in range(n):
+        topic = test_questions[i % len(test_questions)].strip("¿?")
+        sentences = [f"{topic}."] + [
+            " ".join(rng.choice(words) for _ in range(rng.randint(8, 16))).capitalize() + "."
+            for _ in range(rng.randint(4, 10))
+        ]
+        chunks.append({
+            "id": f"page_{i + 1}_chunk_1", "page": i + 1, "chapter": f"{i % 10 + 1} Capítulo sintético",
+            "section": None, "subsection": None, "text": " ".join(sentences),
+        })
+    return chunks
+
+def build_index(root, chunks_path, synthetic, embeddings):
+    """Publica en root una versión del índice (FAISS + BM25 + oraciones) armada con embeddings locales."""
+    if chunks_path.exists():
+        docs = load_chunks(chunks_path)
+    else:
+        print(f"No se encontró {chunks_path}: se usa un corpus sintético de {synthetic} chunks.")
+        docs = [d for d in map(chunk_to_document, synthetic_chunks(synthetic)) if d is not None]
+
+    vectors = embeddings.embed_documents([d.page_content for d in docs])
+    matrix = np.array(vectors, dtype="float32")
+    index, _ = create_index("flat", matrix.shape[1], matrix, {})
+    vectorstore = FAISS(embeddings, index, InMemoryDocstore(), {})
+    vectorstore.add_embeddings(
+        [(d.page_content, v) for d, v in zip(docs, vectors)],
+        metadatas=[d.metadata for d in docs],
+        ids=[d.metadata["id"] for d in docs],
+    )
+
+    version, path = new_version_dir(root)
+    save_index_store(vectorstore, path)
+    BM25Index.from_vectorstore(vectorstore).save(path / BM25_FILE)
+    SentenceIndex.build(
+        ((d.metadata["id"], d.page_content) for d in docs),
+        embeddings.embed_documents,
+        config.SENTENCE_VECTOR_DIMS,
+    ).save(path / SENTENCES_FILE)
+    publish_version(root, version)
+    return len(docs)
+
+def install_local_backends(work_dir, args):
+    """
+    Inicializa los singletons de resources y del historial con los modelos
+    locales y bases SQLite en work_dir, antes de que la app los pida.
+    """
+    def latency(base, per_input, per_output, seed):
+        return LatencyModel(base, per_input, per_output, jitter=args.jitter, seed=seed)
+
+    index_root = work_dir / "vector_store"
+    index_root.mkdir()
+    n_chunks = build_index(index_root, Path(args.chunks), args.synthetic_chunks, HashingEmbeddings())
+
+    embeddings = HashingEmbeddings(latency=latency(args.embed_latency, 0.0, 0.0, args.seed))
+    resources._EMBEDDINGS = CachedEmbeddings(
+        embeddings, model="bench-hashing", max_items=config.EMBEDDING_CACHE_SIZE, store_path=None,
+    )
+    answer = CannedChatModel(
+        model_name="bench-answer", answer_tokens=args.answer_tokens, callbacks=llm_callbacks(),
+        latency=latency(args.llm_latency, args.llm_input_latency, args.llm_token_latency, args.seed + 1),
+    )
+    followup = CannedChatModel(
+        model_name="bench-followup", callbacks=llm_callbacks(),
+        latency=latency(args.llm_latency, args.llm_input_latency, args.llm_token_latency, args.seed + 2),
+    )
+    resources._CHAT_MODELS.update(answer=answer, rewrite=answer, summarize=answer, followup=followup)
+    resources._COLLECTIONS = CollectionRegistry(
+        index_root, work_dir / "collections", resources._load_index_bundle,
+        memory_budget_mb=config.COLLECTIONS_MEMORY_BUDGET_MB,
+    )
+    # con umbral > 1 el cache nunca acierta, pero se sigue pagando lookup y store
+    resources._ANSWER_CACHE = SemanticAnswerCache(
+        work_dir / "answer_cache.sqlite",
+        threshold=1.01 if args.no_answer_cache else config.ANSWER_CACHE_THRESHOLD,
+        max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+    )
+    pool = history.ConnectionPool(work_dir / "chat_history.sqlite")
+    history.migrate(pool)
+    history._POOL = pool
+    return n_chunks
+
+async def _asgi_stream(app, path, payload):
+    """
+    POST directo a la app ASGI midiendo el primer evento `token`: el
+    ASGITransport de httpx junta todo el cuerpo antes de devolverlo, así que
+    no sirve para medir el tiempo al primer token.
+    """
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    started = time.perf_counter()
+    sent, finished = False, asyncio.Event()
+    out = {"status": None, "ttft": None, "total": None, "chunks": []}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            out["chunks"].append(chunk)
+            if out["ttft"] is None and b"event: token" in chunk:
+                out["ttft"] = time.perf_counter() - started
+            if not message.get("more_body", False):
+                out["total"] = time.perf_counter() - started
+                finished.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    return out
+
+def _sse_context(raw):
+    """Datos del evento `context` de una respuesta SSE."""
+    event = None
+    for line in raw.decode("utf-8", errors="replace").splitlines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:") and event == "context":
+            return json.loads(line[5:].strip())
+    return {}
+
+async def send_message(client, app, endpoint, session_id, question):
+    payload = {"session_id": session_id, "question": question}
+    if endpoint == "stream":
+        out = await _asgi_stream(app, "/chat/stream", payload)
+        raw = b"".join(out["chunks"])
+        ok = out["status"] == 200 and b"event: done" in raw
+        data = _sse_context(raw) if ok else {}
+        return {"ok": ok, "latency": out["total"], "ttft": out["ttft"], "cache_hit": bool(data.get("cache_hit")),
+                "skip_rag": bool(data.get("skip_rag"))}
+
+    started = time.perf_counter()
+    response = await client.post("/chat", json=payload)
+    latency = time.perf_counter() - started
+    ok = response.status_code == 200
+    data = response.json() if ok else {}
+    return {"ok": ok, "latency": latency, "ttft": None, "cache_hit": bool(data.get("cache_hit")),
+            "skip_rag": bool(data.get("skip_rag"))}
+
+async def replay(client, app, sessions, args, prefix):
+    """
+    Reproduce las sesiones: con --rate llegan como un proceso de Poisson
+    (carga abierta), si no, todas a la vez; --concurrency acota las que están
+    en curso. Los mensajes de una sesión van en orden, separados por --think-time.
+
+    Con --rate la latencia del primer mensaje se mide desde la llegada
+    programada de la sesión, no desde que consigue lugar: si el sistema no da
+    abasto, la espera en cola es parte de lo que ve el usuario (si no, los
+    percentiles sufren coordinated omission). La espera se informa también
+    por separado (queue_wait) y el tiempo de atención solo como service.
+    """
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    records = []
+
+    async def run_session(i, script, arrival):
+        async with semaphore:
+            # sin --rate todas "llegan" a la vez: la cola es del diseño de carga cerrada, no del sistema
+            wait = time.perf_counter() - arrival if args.rate else None
+            for turn, question in enumerate(script):
+                if turn and args.think_time:
+                    await asyncio.sleep(args.think_time)
+                try:
+                    record = await send_message(client, app, args.endpoint, f"{prefix}-{i:05d}", question)
+                except Exception as e:
+                    record = {"ok": False, "latency": None, "ttft": None, "error": str(e)}
+                # la sesión conserva su lugar entre mensajes: solo el primero esperó en cola
+                record["queue_wait"] = wait if turn == 0 else None
+                record["service"] = record["latency"]
+                if record["queue_wait"]:
+                    for key in ("latency", "ttft"):
+                        if record[key] is not None:
+                            record[key] += record["queue_wait"]
+                records.append(record)
+
+    tasks = []
+    start = time.perf_counter()
+    offset = 0.0
+    for i, script in enumerate(sessions):
+        if args.rate and i:
+            # llegadas programadas desde el inicio, sin acumular el retraso del loop
+            offset += rng.expovariate(args.rate)
+            await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+        tasks.append(asyncio.create_task(run_session(i, script, start + offset)))
+    await asyncio.gather(*tasks)
+    return records
+
+def _percentiles(values):
+    if not values:
+        return None
+    ms = np.array(values) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "mean": round(float(ms.mean()), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+def _histograms(metric):
+    """{labels: (buckets acumulados [(le, n)], suma, cantidad)} de un Histogram de prometheus_client."""
+    series = {}
+    for family in metric.collect():
+        for s in family.samples:
+            labels = tuple(sorted((k, v) for k, v in s.labels.items() if k != "le"))
+            buckets, total, count = series.setdefault(labels, ([], 0.0, 0.0))
+            if s.name.endswith("_bucket"):
+                buckets.append((float(s.labels["le"]), s.value))
+            elif s.name.endswith("_sum"):
+                series[labels] = (buckets, s.value, count)
+            elif s.name.endswith("_count"):
+                series[labels] = (buckets, total, s.value)
+    return series
+
+def _counters(metric):
+    return {
+        tuple(sorted(s.labels.items())): s.value
+        for family in metric.collect() for s in family.samples if s.name.endswith("_total")
+    }
+
+def _bucket_quantile(q, buckets):
+    """Cuantil interpolado dentro del bucket, como histogram_quantile de Prometheus."""
+    total = buckets[-1][1]
+    if not total:
+        return None
+    rank, prev_le, prev_n = q * total, 0.0, 0.0
+    for le, n in buckets:
+        if n >= rank:
+            if le == float("inf"):
+                return prev_le
+            return prev_le + (le - prev_le) * ((rank - prev_n) / (n - prev_n) if n > prev_n else 0)
+        prev_le, prev_n = le, n
+    return prev_le
+
+def _histogram_delta(before, after, key):
+    """Cantidad, media y p50/p95 (aprox. por buckets) de lo observado entre dos snapshots, por key(labels)."""
+    out = {}
+    for labels, (buckets, total, count) in after.items():
+        old_buckets, old_total, old_count = before.get(labels, ([], 0.0, 0.0))
+        old = dict(old_buckets)
+        delta = [(le, n - old.get(le, 0.0)) for le, n in buckets]
+        n = count - old_count
+        if n <= 0:
+            continue
+        out[key(dict(labels))] = {
+            "count": int(n),
+            "mean_ms": round((total - old_total) / n * 1000, 2),
+            "p50_ms": round(_bucket_quantile(0.5, delta) * 1000, 2),
+            "p95_ms": round(_bucket_quantile(0.95, delta) * 1000, 2),
+        }
+    return out
+
+def snapshot():
+    return {
+        "nodes": _histograms(NODE_SECONDS),
+        "llm": _histograms(LLM_SECONDS),
+        "llm_tokens": _counters(LLM_TOKENS),
+        "retrieval": _histograms(RETRIEVAL_SECONDS),
+        "db": _histograms(DB_SECONDS),
+    }
+
+def breakdown(before, after):
+    llm = _histogram_delta(before["llm"], after["llm"], lambda l: f"{l['node']} ({l['model']})")
+    for labels, value in after["llm_tokens"].items():
+        l = dict(labels)
+        entry = llm.get(f"{l['node']} ({l['model']})")
+        if entry is not None:
+            entry[f"{l['kind']}_tokens"] = int(value - before["llm_tokens"].get(labels, 0.0))
+    return {
+        "nodes": _histogram_delta(before["nodes"], after["nodes"], lambda l: l["node"]),
+        "llm": llm,
+        "retrieval": _histogram_delta(before["retrieval"], after["retrieval"], lambda l: "retrieve").get("retrieve"),
+        "db": _histogram_delta(before["db"], after["db"], lambda l: l["op"]),
+    }
+
+def summarize(records, elapsed, n_sessions):
+    ok = [r for r in records if r["ok"]]
+    return {
+        "sessions": n_sessions,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": _percentiles([r["latency"] for r in ok]),
+        "service_ms": _percentiles([r["service"] for r in ok]),
+        "queue_wait_ms": _percentiles([r["queue_wait"] for r in records if r.get("queue_wait") is not None]),
+        "ttft_ms": _percentiles([r["ttft"] for r in ok if r.get("ttft") is not None]),
+        "cache_hits": sum(r["cache_hit"] for r in ok),
+        "smalltalk": sum(r["skip_rag"] for r in ok),
+    }
+
+async def run(args, sessions):
+    from api.app import server
+
+    app = server.app
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if args.warmup:
+                # carga el índice y llena los caches de proceso; no entra en los resultados
+                await replay(client, app, build_sessions(args.warmup, args.seed + 100), args, "warmup")
+            before = snapshot()
+            started = time.perf_counter()
+            records = await replay(client, app, sessions, args, f"bench-{args.seed}")
+            elapsed = time.perf_counter() - started
+            after = snapshot()
+    return summarize(records, elapsed, len(sessions)), breakdown(before, after)
+
+def _get(result, dotted):
+    for part in dotted.split("."):
+        result = (result or {}).get(part)
+    return result
+
+def compare(base, current):
+    print(f"\n{'métrica':<18}{'base':>12}{'actual':>12}{'cambio':>10}")
+    for key, higher_is_better in COMPARED:
+        old, new = _get(base, key), _get(current, key)
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{key:<18}{old:>12}{new:>12}{change:>10}")
+
+def print_summary(result):
+    latency = result["latency_ms"] or {}
+    print(
+        f"\n{result['requests']} requests ({result['errors']} errores) en {result['duration_s']}s: "
+        f"{result['throughput_rps']} req/s, p50 {latency.get('p50')} ms, "
+        f"p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms"
+    )
+    queue = result.get("queue_wait_ms")
+    if queue:
+        service = result["service_ms"] or {}
+        print(f"Espera en cola: p50 {queue['p50']} ms, p95 {queue['p95']} ms, p99 {queue['p99']} ms "
+              f"(atención sola: p95 {service.get('p95')} ms)")
+    if result["ttft_ms"]:
+        print(f"Primer token: p50 {result['ttft_ms']['p50']} ms, p95 {result['ttft_ms']['p95']} ms")
+    print(f"\n{'nodo':<24}{'llamadas':>10}{'media ms':>10}{'p95 ms':>10}")
+    for node, s in sorted(result["nodes"].items(), key=lambda item: -item[1]["mean_ms"] * item[1]["count"]):
+        print(f"{node:<24}{s['count']:>10}{s['mean_ms']:>10}{s['p95_ms']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga offline del chat (LLM y embeddings simulados)")
+    parser.add_argument("--sessions", type=int, default=100, help="sesiones a reproducir")
+    parser.add_argument("--sessions-file", type=str, default="", help="JSON con una lista de sesiones (listas de mensajes)")
+    parser.add_argument("--concurrency", type=int, default=8, help="sesiones en curso a la vez")
+    parser.add_argument("--rate", type=float, default=0.0, help="llegada de sesiones por segundo (0 = todas al inicio)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="segundos entre mensajes de una sesión")
+    parser.add_argument("--endpoint", choices=("chat", "stream"), default="chat")
+    parser.add_argument("--warmup", type=int, default=5, help="sesiones previas que no se miden")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="segundos hasta el primer token")
+    parser.add_argument("--llm-input-latency", type=float, default=0.0001, help="segundos extra por token de entrada")
+    parser.add_argument("--llm-token-latency", type=float, default=0.01, help="segundos por token generado")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="segundos por llamada de embeddings")
+    parser.add_argument("--jitter", type=float, default=0.1, help="variación uniforme de la latencia (fracción)")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="largo de las respuestas simuladas")
+    parser.add_argument("--chunks", type=str, default=str(DEFAULT_CHUNKS), help="chunks para el índice del benchmark")
+    parser.add_argument("--synthetic-chunks", type=int, default=500, help="tamaño del corpus sintético si no existe --chunks")
+    parser.add_argument("--no-answer-cache", action="store_true", help="el cache semántico nunca acierta")
+    parser.add_argument("--label", type=str, default="", help="nombre del run (se guarda en el resultado)")
+    parser.add_argument("--output", type=str, default="", help="JSON de salida (por defecto results/bench-<fecha>.json)")
+    parser.add_argument("--compare", type=str, default="", help="JSON de un run anterior para comparar")
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.sessions_file) if args.sessions_file else build_sessions(args.sessions, args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        n_chunks = install_local_backends(Path(tmp), args)
+        result, nodes = asyncio.run(run(args, sessions))
+
+    result = {
+        "label": args.label,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "args": vars(args),
+        "config": {key: getattr(config, key) for key in CONFIG_KEYS},
+        "chunks": n_chunks,
+        **result,
+        **nodes,
+    }
+    print_summary(result)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+if __name__ == "__main__":
+    main()
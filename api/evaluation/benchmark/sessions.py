@@ -0,0 +1,42 @@
+"""
+Guiones de sesión para el benchmark: cada sesión es una lista de mensajes
+que se envían en orden con el mismo session_id, mezclando preguntas nuevas,
+follow-ups y smalltalk como en una conversación real.
+"""
+from __future__ import annotations
+import json
+import random
+from api.evaluation.test_client.test_questions import test_questions
+
+FOLLOWUPS = ("contame más", "¿y un ejemplo?", "explicame mejor", "dale", "¿y cómo se interpreta?")
+GREETINGS = ("hola", "buenas", "hola, ¿cómo estás?")
+CLOSINGS = ("gracias", "perfecto, gracias", "adiós")
+
+# (peso, plantilla): Q = pregunta del libro, F = follow-up, G = saludo, C = cierre
+TEMPLATES = (
+    (4, "Q"),
+    (3, "QF"),
+    (2, "GQFC"),
+    (2, "QQF"),
+    (1, "GQ"),
+    (1, "QFFC"),
+)
+
+def build_sessions(n, seed=0, questions=test_questions):
+    """n sesiones generadas a partir de las plantillas, reproducibles con la semilla."""
+    rng = random.Random(seed)
+    weights = [w for w, _ in TEMPLATES]
+    templates = [t for _, t in TEMPLATES]
+    pools = {"Q": questions, "F": FOLLOWUPS, "G": GREETINGS, "C": CLOSINGS}
+    return [
+        [rng.choice(pools[kind]) for kind in rng.choices(templates, weights)[0]]
+        for _ in range(n)
+    ]
+
+def load_sessions(path):
+    """Sesiones de un JSON: lista de listas de mensajes."""
+    with open(path, "r", encoding="utf-8") as f:
+        sessions = json.load(f)
+    if not all(isinstance(s, list) and s and all(isinstance(m, str) for m in s) for s in sessions):
+        raise ValueError(f"{path} debe contener una lista de sesiones, cada una una lista de mensajes.")
+    return sessions
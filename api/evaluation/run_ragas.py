@@ -2,13 +2,16 @@ from __future__ import annotations
 import argparse
 import asyncio
 import json
+import random
+import time
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from ..graphs.config import EMBEDDING_MODEL, EVALUATOR_MODEL
+from ..graphs.config import EVAL_CONCURRENCY, EVAL_MAX_CONCURRENCY, EVAL_MAX_RETRIES, EVAL_WRITE_BATCH
+from ..graphs.providers import build_chat_model, build_embeddings
 from ..db.history import (
     fetch_answers_pending_eval,
-    save_eval_result,
+    save_eval_results,
 )
+from ..graphs.rate_limits import AdaptiveLimiter, rate_limit_cause, retry_after
 from ragas.dataset_schema import SingleTurnSample
 from ragas.metrics import (
     Faithfulness, 
@@ -37,8 +40,46 @@ def build_samples(rows):
     return samples
 
 
-async def run_eval(limit, dry_run):
-    rows = fetch_answers_pending_eval(limit=limit)
+async def _score(metrics, sample):
+    """Las métricas de una respuesta en paralelo; si alguna falla, se espera al resto y se propaga."""
+    names = list(metrics)
+    values = await asyncio.gather(
+        *(metrics[name].single_turn_ascore(sample) for name in names),
+        return_exceptions=True,
+    )
+    for value in values:
+        if isinstance(value, BaseException):
+            raise value
+    return dict(zip(names, values))
+
+async def _score_with_backoff(metrics, sample, limiter, max_retries=EVAL_MAX_RETRIES, base_delay=2.0, max_delay=60.0):
+    for attempt in range(max_retries + 1):
+        async with limiter:
+            try:
+                scores = await _score(metrics, sample)
+            except Exception as e:
+                # ragas envuelve el error del cliente; el Retry-After viene en el original
+                cause = rate_limit_cause(e)
+                if cause is None or attempt == max_retries:
+                    raise
+            else:
+                await limiter.on_success()
+                return scores
+
+        await limiter.on_rate_limit()
+        delay = retry_after(cause) or min(max_delay, base_delay * 2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, delay / 4))
+
+async def run_eval(limit, dry_run, concurrency=EVAL_CONCURRENCY):
+    """
+    Evalúa las respuestas pendientes con hasta `concurrency` en vuelo (como
+    máximo EVAL_MAX_CONCURRENCY; el límite baja a la mitad ante un rate limit
+    y se recupera de a uno). Los
+    resultados se guardan de a EVAL_WRITE_BATCH por transacción y rag_evals
+    funciona como checkpoint: si la ejecución se corta, la siguiente solo toma
+    las respuestas que todavía no tienen evaluación.
+    """
+    rows = await asyncio.to_thread(fetch_answers_pending_eval, limit)
     if not rows:
         message = "No hay respuestas pendientes de evaluación."
         print(message)
@@ -51,48 +92,43 @@ async def run_eval(limit, dry_run):
         }
 
     total = len(rows)
-    print(f"Evaluando {total} respuestas...")
-
-    evaluator_llm = ChatOpenAI(model=EVALUATOR_MODEL, temperature=0, model_kwargs={
-        "response_format": {"type": "json_object"}
-    })
-    evaluator_embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-
-    faithfulness_metric = Faithfulness(llm=evaluator_llm)
-    precision_metric = LLMContextPrecisionWithoutReference(llm=evaluator_llm)
-    recall_metric = LLMContextRecall(llm=evaluator_llm)
-    relevancy_metric = ResponseRelevancy(llm=evaluator_llm, embeddings=evaluator_embeddings)
+    concurrency = concurrency or EVAL_CONCURRENCY
+    if concurrency < 1:
+        raise ValueError("concurrency debe ser al menos 1.")
+    if concurrency > EVAL_MAX_CONCURRENCY:
+        print(f"concurrency {concurrency} supera el máximo; se usa {EVAL_MAX_CONCURRENCY}.")
+        concurrency = EVAL_MAX_CONCURRENCY
+    print(f"Evaluando {total} respuestas ({concurrency} en paralelo)...")
+
+    evaluator_llm = build_chat_model("evaluate", json_mode=True)
+    evaluator_embeddings = build_embeddings("embed")
+
+    metrics = {
+        "faithfulness": Faithfulness(llm=evaluator_llm),
+        "context_precision": LLMContextPrecisionWithoutReference(llm=evaluator_llm),
+        "answer_relevancy": ResponseRelevancy(llm=evaluator_llm, embeddings=evaluator_embeddings),
+        "context_recall": LLMContextRecall(llm=evaluator_llm),
+    }
 
     samples = build_samples(rows)
-
-    evaluated = 0
+    limiter = AdaptiveLimiter(concurrency)
+    pending = []
+    write_lock = asyncio.Lock()
+    progress = {"evaluated": 0, "saved": 0}
     errors = []
 
-    for idx, r in enumerate(rows):
-
-        print(f"\n--- [{r['session_id']} - turn {r['turn']}] ---")
-
-        scores = {}
+    async def flush(min_size=1):
+        async with write_lock:
+            if len(pending) < min_size:
+                return
+            batch = pending[:]
+            pending.clear()
+            await asyncio.to_thread(save_eval_results, batch)
+            progress["saved"] += len(batch)
 
+    async def evaluate(r, sample):
         try:
-            scores["faithfulness"] = await faithfulness_metric.single_turn_ascore(samples[idx])
-            scores["context_precision"] = await precision_metric.single_turn_ascore(samples[idx])
-            scores["answer_relevancy"] = await relevancy_metric.single_turn_ascore(samples[idx])
-            scores["context_recall"] = await recall_metric.single_turn_ascore(samples[idx])
-
-            print(json.dumps(scores, indent=2, ensure_ascii=False))
-
-            if not dry_run:
-                save_eval_result(
-                    r["session_id"],
-                    r["turn"],
-                    faithfulness=scores.get("faithfulness"),
-                    answer_relevancy=scores.get("answer_relevancy"),
-                    context_precision=scores.get("context_precision"),
-                    context_recall=scores.get("context_recall")
-                )
-            evaluated += 1
-
+            scores = await _score_with_backoff(metrics, sample, limiter)
         except Exception as e:
             error_msg = f"Error evaluando sesión {r['session_id']}, turn {r['turn']}: {e}"
             print(error_msg)
@@ -103,16 +139,35 @@ async def run_eval(limit, dry_run):
                     "error": str(e),
                 }
             )
+            return
+
+        progress["evaluated"] += 1
+        print(f"[{progress['evaluated']}/{total}] {r['session_id']} - turn {r['turn']}: "
+              f"{json.dumps(scores, ensure_ascii=False)}")
+        if not dry_run:
+            pending.append({"session_id": r["session_id"], "turn": r["turn"], **scores})
+            await flush(EVAL_WRITE_BATCH)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(evaluate(r, sample) for r, sample in zip(rows, samples)))
+    finally:
+        # también al cancelar: lo ya evaluado queda guardado y no se repite
+        if not dry_run:
+            await flush()
+    elapsed = time.perf_counter() - started
 
     if dry_run:
         print("\nDRY RUN activado → no se guardaron resultados.")
     else:
-        print("\nEvaluaciones guardadas correctamente.")
+        print(f"\n{progress['saved']} evaluaciones guardadas en {elapsed:.1f}s.")
 
     return {
         "requested": total,
-        "evaluated": evaluated,
+        "evaluated": progress["evaluated"],
         "dry_run": dry_run,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 1),
         "errors": errors,
         "message": (
             "DRY RUN activado → no se guardaron resultados."
@@ -125,9 +180,13 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--limit", type=int, default=None, help="Cantidad máxima de respuestas a evaluar")
     parser.add_argument("--dry-run", action="store_true", help="Evalúa pero NO graba en la base")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY,
+                        help=f"Respuestas evaluadas en paralelo (1 a {EVAL_MAX_CONCURRENCY})")
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency debe ser al menos 1")
 
-    asyncio.run(run_eval(limit=args.limit, dry_run=args.dry_run))
+    asyncio.run(run_eval(limit=args.limit, dry_run=args.dry_run, concurrency=args.concurrency))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,187 @@
+from __future__ import annotations
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.documents import Document
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respuestas RAG indexado por el embedding de la pregunta reescrita.
+
+    - Un hit requiere similitud coseno >= threshold contra una entrada previa.
+    - Las entradas vencen a los ttl_seconds y, si se supera max_entries,
+      se descartan las usadas menos recientemente.
+    - Cada entrada guarda el fingerprint del índice (o del conjunto de
+      colecciones) que la generó y solo se compara contra consultas con el
+      mismo fingerprint. Tras un rebuild las viejas dejan de coincidir y
+      salen por TTL o por LRU; así conviven varias versiones y colecciones.
+    """
+
+    def __init__(self, path, threshold, max_entries, ttl_seconds):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # fingerprint -> {"ids", "last_used", "matrix"} de las entradas en memoria
+        self._parts = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as con:
+            con.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fingerprint TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources_json TEXT NOT NULL,
+                docs_json TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            );
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_fingerprint ON answer_cache(fingerprint)")
+
+    def _conn(self):
+        return sqlite3.connect(self.path)
+
+    @staticmethod
+    def _normalize(vector):
+        v = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _load(self, fingerprint):
+        """Entradas vigentes de un fingerprint, cargadas en memoria la primera vez."""
+        part = self._parts.get(fingerprint)
+        if part is not None:
+            return part
+
+        min_created = time.time() - self.ttl_seconds
+        with self._conn() as con:
+            con.execute("DELETE FROM answer_cache WHERE created_at < ?", (min_created,))
+            rows = con.execute(
+                "SELECT id, vector, last_used_at FROM answer_cache WHERE fingerprint = ? ORDER BY id",
+                (fingerprint,),
+            ).fetchall()
+
+        part = {
+            "ids": [r[0] for r in rows],
+            "last_used": [r[2] for r in rows],
+            "matrix": np.vstack([np.frombuffer(r[1], dtype="float32") for r in rows]) if rows else None,
+        }
+        self._parts[fingerprint] = part
+        return part
+
+    @staticmethod
+    def _forget(part, positions):
+        positions = {int(i) for i in positions}
+        keep = [i for i in range(len(part["ids"])) if i not in positions]
+        dropped = [part["ids"][i] for i in positions]
+        part["ids"] = [part["ids"][i] for i in keep]
+        part["last_used"] = [part["last_used"][i] for i in keep]
+        part["matrix"] = part["matrix"][keep] if keep else None
+        return dropped
+
+    def _drop(self, part, positions):
+        dropped = self._forget(part, positions)
+        with self._conn() as con:
+            con.executemany("DELETE FROM answer_cache WHERE id = ?", [(i,) for i in dropped])
+
+    def _evict_overflow(self):
+        """LRU global: SQLite tiene last_used_at de todas las entradas, cargadas o no."""
+        with self._conn() as con:
+            total = con.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+            overflow = total - self.max_entries
+            if overflow <= 0:
+                return
+            victims = {r[0] for r in con.execute(
+                "SELECT id FROM answer_cache ORDER BY last_used_at LIMIT ?", (overflow,)
+            )}
+            con.executemany("DELETE FROM answer_cache WHERE id = ?", [(i,) for i in victims])
+        for part in self._parts.values():
+            positions = [i for i, entry_id in enumerate(part["ids"]) if entry_id in victims]
+            if positions:
+                self._forget(part, positions)
+
+    def lookup(self, vector, fingerprint):
+        """Devuelve {"answer", "sources", "docs", "similarity"} o None."""
+        with self._lock:
+            part = self._load(fingerprint)
+            if part["matrix"] is None:
+                self.misses += 1
+                return None
+
+            sims = part["matrix"] @ self._normalize(vector)
+            best = int(np.argmax(sims))
+            if float(sims[best]) < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = part["ids"][best]
+            now = time.time()
+            with self._conn() as con:
+                row = con.execute(
+                    "SELECT answer, sources_json, docs_json, created_at FROM answer_cache WHERE id = ?",
+                    (entry_id,),
+                ).fetchone()
+                if row and row[3] >= now - self.ttl_seconds:
+                    con.execute("UPDATE answer_cache SET last_used_at = ? WHERE id = ?", (now, entry_id))
+
+            if not row or row[3] < now - self.ttl_seconds:
+                self._drop(part, [best])
+                self.misses += 1
+                return None
+
+            part["last_used"][best] = now
+            self.hits += 1
+
+        answer, sources_json, docs_json, _ = row
+        return {
+            "answer": answer,
+            "sources": json.loads(sources_json),
+            "docs": [
+                Document(page_content=d["page_content"], metadata=d["metadata"])
+                for d in json.loads(docs_json)
+            ],
+            "similarity": float(sims[best]),
+        }
+
+    def store(self, question, vector, fingerprint, answer, sources, docs):
+        v = self._normalize(vector)
+        now = time.time()
+        docs_json = json.dumps(
+            [{"page_content": d.page_content, "metadata": d.metadata or {}} for d in docs or []],
+            ensure_ascii=False,
+        )
+        with self._lock:
+            part = self._load(fingerprint)
+            with self._conn() as con:
+                cur = con.execute("""
+                    INSERT INTO answer_cache
+                    (fingerprint, question, vector, answer, sources_json, docs_json, created_at, last_used_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    fingerprint, question, v.tobytes(), answer,
+                    json.dumps(sources, ensure_ascii=False), docs_json, now, now,
+                ))
+                entry_id = cur.lastrowid
+
+            part["ids"].append(entry_id)
+            part["last_used"].append(now)
+            part["matrix"] = v[None, :] if part["matrix"] is None else np.vstack([part["matrix"], v])
+            self._evict_overflow()
+
+    def stats(self):
+        return {
+            "entries": sum(len(p["ids"]) for p in self._parts.values()),
+            "fingerprints": len(self._parts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "threshold": self.threshold,
+        }
@@ -0,0 +1,99 @@
+from __future__ import annotations
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from .config import BACKGROUND_WORKERS
+
+
+class _SessionJobs:
+    def __init__(self):
+        self.summary = None
+        self.running = False
+        self.idle = threading.Event()
+
+
+class SessionTaskQueue:
+    """
+    Cola en proceso para resumir el historial después de responder, con un
+    pool acotado de workers. Los turnos no pasan por acá: los guarda el
+    escritor write-behind de api/db/writer.py.
+
+    - Los resúmenes de una misma sesión corren en serie; sesiones distintas
+      corren en paralelo.
+    - Solo sobrevive el pedido de resumen más nuevo por sesión: si llega otro
+      antes de que empiece, reemplaza al pendiente.
+    - wait_idle() permite que el turno siguiente espere a que termine lo pendiente.
+    """
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session-jobs")
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit_summary(self, session_id, fn, *args):
+        def replace(jobs):
+            jobs.summary = (fn, args)
+        self._submit(session_id, replace)
+
+    def _submit(self, session_id, add):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("La cola de tareas ya fue cerrada.")
+            jobs = self._sessions.get(session_id)
+            if jobs is None:
+                jobs = self._sessions[session_id] = _SessionJobs()
+            add(jobs)
+            if not jobs.running:
+                jobs.running = True
+                self._executor.submit(self._drain, session_id, jobs)
+
+    def _next_job(self, session_id, jobs):
+        with self._lock:
+            if jobs.summary:
+                job, jobs.summary = jobs.summary, None
+                return job
+            jobs.running = False
+            jobs.idle.set()
+            del self._sessions[session_id]
+            return None
+
+    def _drain(self, session_id, jobs):
+        while True:
+            job = self._next_job(session_id, jobs)
+            if job is None:
+                return
+            fn, args = job
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def wait_idle(self, session_id, timeout):
+        """Espera (hasta timeout) a que la sesión no tenga trabajos pendientes."""
+        with self._lock:
+            jobs = self._sessions.get(session_id)
+        if jobs is None:
+            return True
+        return jobs.idle.wait(timeout)
+
+    def pending(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+
+
+_TASK_QUEUE = None
+_TASK_QUEUE_LOCK = threading.Lock()
+
+def get_task_queue():
+    global _TASK_QUEUE
+    if _TASK_QUEUE is None:
+        with _TASK_QUEUE_LOCK:
+            if _TASK_QUEUE is None:
+                _TASK_QUEUE = SessionTaskQueue(BACKGROUND_WORKERS)
+    return _TASK_QUEUE
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import os
+from collections import Counter
+import numpy as np
+from .text_utils import tokenize
+
+BM25_FILE = "bm25.npz"
+
+class BM25Index:
+    """
+    Índice invertido BM25 en formato CSR: para cada término del vocabulario,
+    postings[indptr[t]:indptr[t+1]] son las posiciones de los chunks que lo
+    contienen y tfs sus frecuencias. Se guarda como .npz sin pickle.
+    """
+
+    def __init__(self, vocab, indptr, postings, tfs, doc_len, ids, k1=1.5, b=0.75):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.postings = postings
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+        n = len(ids)
+        df = np.diff(indptr).astype("float32")
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = float(doc_len.mean()) if n else 1.0
+        # parte del denominador que solo depende del documento
+        self._norm = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))).astype("float32")
+
+    @classmethod
+    def build(cls, texts, ids, k1=1.5, b=0.75):
+        # texts puede ser un generador (ingest lee los chunks desde disco)
+        postings_by_term = {}
+        lengths = []
+        for pos, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings_by_term.setdefault(term, []).append((pos, tf))
+        doc_len = np.array(lengths, dtype="float32")
+
+        terms = sorted(postings_by_term)
+        indptr = np.zeros(len(terms) + 1, dtype="int64")
+        postings, tfs = [], []
+        for i, term in enumerate(terms):
+            plist = postings_by_term[term]
+            indptr[i + 1] = indptr[i] + len(plist)
+            postings.extend(p for p, _ in plist)
+            tfs.extend(tf for _, tf in plist)
+
+        return cls(
+            {t: i for i, t in enumerate(terms)},
+            indptr,
+            np.array(postings, dtype="int32"),
+            np.array(tfs, dtype="float32"),
+            doc_len,
+            list(ids),
+            k1=k1,
+            b=b,
+        )
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        """Indexa los mismos chunks (y con los mismos ids) que el docstore del índice FAISS."""
+        ids = list(vectorstore.index_to_docstore_id.values())
+        texts = [vectorstore.docstore.search(i).page_content for i in ids]
+        return cls.build(texts, ids)
+
+    def save(self, path):
+        terms = sorted(self.vocab, key=self.vocab.get)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                terms=np.array(terms, dtype=str),
+                indptr=self.indptr,
+                postings=self.postings,
+                tfs=self.tfs,
+                doc_len=self.doc_len,
+                ids=np.array(self.ids, dtype=str),
+                params=np.array([self.k1, self.b], dtype="float32"),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = (float(x) for x in data["params"])
+            return cls(
+                {t: i for i, t in enumerate(data["terms"].tolist())},
+                data["indptr"],
+                data["postings"],
+                data["tfs"],
+                data["doc_len"],
+                data["ids"].tolist(),
+                k1=k1,
+                b=b,
+            )
+
+    def search(self, query, k):
+        """Top-k (id, score) por BM25; solo chunks que comparten algún término con la consulta."""
+        scores = np.zeros(len(self.ids), dtype="float32")
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs = self.postings[start:end]
+            tf = self.tfs[start:end]
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in hits]
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import contextvars
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from .index_manager import IndexManager, CURRENT_FILE
+from .index_store import INDEX_FILE
+
+DEFAULT_COLLECTION = "default"
+ALL_COLLECTIONS = "*"
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# colecciones fijadas para el request en curso: {nombre: IndexBundle}
+_PINNED = contextvars.ContextVar("pinned_collections", default=None)
+
+class UnknownCollection(ValueError):
+    pass
+
+class CollectionRegistry:
+    """
+    Registro de colecciones (un índice versionado por libro o material).
+
+    "default" es el índice de FAISS_DIR; el resto son los subdirectorios de
+    collections_dir con un índice publicado. Cada colección se carga recién
+    cuando se consulta y, si las cargadas superan memory_budget_mb, se
+    descargan las usadas menos recientemente.
+    """
+
+    def __init__(self, default_root, collections_dir, loader, memory_budget_mb):
+        self.default_root = default_root
+        self.collections_dir = collections_dir
+        self.loader = loader
+        self.memory_budget_mb = memory_budget_mb
+        self._managers = {}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.evictions = 0
+
+    def _root(self, name):
+        if name == DEFAULT_COLLECTION:
+            return self.default_root
+        if not _NAME.match(name):
+            raise UnknownCollection(f"Nombre de colección inválido: {name!r}")
+        return self.collections_dir / name
+
+    @staticmethod
+    def _is_index(root):
+        return (root / CURRENT_FILE).exists() or (root / INDEX_FILE).exists()
+
+    def names(self):
+        names = [DEFAULT_COLLECTION] if self._is_index(self.default_root) else []
+        if self.collections_dir.exists():
+            names += sorted(
+                p.name for p in self.collections_dir.iterdir()
+                if p.is_dir() and _NAME.match(p.name) and self._is_index(p)
+            )
+        return names
+
+    def resolve(self, collections):
+        """Normaliza lo pedido en /chat: None, un nombre, una lista o "*" (todas)."""
+        if not collections:
+            return [DEFAULT_COLLECTION]
+        if isinstance(collections, str):
+            collections = [collections]
+        if ALL_COLLECTIONS in collections:
+            return self.names()
+        names = list(dict.fromkeys(collections))
+        for name in names:
+            if not self._is_index(self._root(name)):
+                raise UnknownCollection(f"No existe la colección: {name}")
+        return names
+
+    def manager(self, name):
+        with self._lock:
+            manager = self._managers.get(name)
+            if manager is None:
+                root = self._root(name)
+                manager = IndexManager(root, lambda version, path: self.loader(name, version, path), name=name)
+                self._managers[name] = manager
+            return manager
+
+    def _touch(self, name, bundle, protected):
+        """Marca la colección como recién usada y descarga las más viejas si se pasa del presupuesto."""
+        evict = []
+        with self._lock:
+            self._lru[name] = bundle.stats.get("disk_mb", 0.0)
+            self._lru.move_to_end(name)
+            total = sum(self._lru.values())
+            for other in list(self._lru):
+                if total <= self.memory_budget_mb:
+                    break
+                if other in protected:
+                    continue
+                total -= self._lru.pop(other)
+                evict.append(other)
+        for other in evict:
+            self._managers[other].unload()
+            self.evictions += 1
+
+    def current(self, names):
+        bundles = {}
+        for name in names:
+            bundles[name] = self.manager(name).current()
+            self._touch(name, bundles[name], set(names))
+        return bundles
+
+    def active(self, names):
+        """Colecciones fijadas para el request actual o, si no hay, sus versiones activas."""
+        pinned = _PINNED.get() or {}
+        missing = [n for n in names if n not in pinned]
+        return {**{n: pinned[n] for n in names if n in pinned}, **self.current(missing)}
+
+    def acquire(self, names):
+        bundles = {}
+        try:
+            for name in names:
+                bundles[name] = self.manager(name).acquire()
+                self._touch(name, bundles[name], set(names))
+        except Exception:
+            self.release(bundles)
+            raise
+        return bundles
+
+    @staticmethod
+    def release(bundles):
+        for bundle in bundles.values():
+            bundle.release()
+
+    @contextmanager
+    def use(self, bundles):
+        """Fija colecciones ya adquiridas para el código que corre dentro del bloque."""
+        token = _PINNED.set(bundles)
+        try:
+            yield bundles
+        finally:
+            _PINNED.reset(token)
+
+    @contextmanager
+    def pinned(self, names):
+        bundles = self.acquire(names)
+        try:
+            with self.use(bundles):
+                yield bundles
+        finally:
+            self.release(bundles)
+
+    def reload(self, name, force=False):
+        """Recarga una colección (la carga si no lo estaba) y la deja en el LRU."""
+        manager = self.manager(name)
+        reloaded = manager.reload(force)
+        self._touch(name, manager.current(), {name})
+        return reloaded
+
+    def loaded(self):
+        with self._lock:
+            return list(self._lru)
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            for name in self.loaded():
+                self.manager(name).poll()
+
+    def start_watcher(self, interval):
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="index-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def stats(self):
+        loaded = self.loaded()
+        return {
+            "collections": self.names(),
+            "loaded": {name: self.manager(name).stats() for name in loaded},
+            "loaded_mb": round(sum(self._lru.values()), 2),
+            "memory_budget_mb": self.memory_budget_mb,
+            "evictions": self.evictions,
+        }
+
+def format_versions(bundles):
+    """Versión activa para mostrar: la de la colección si es una sola, o nombre@versión de cada una."""
+    if len(bundles) == 1:
+        return next(iter(bundles.values())).version
+    return ",".join(f"{name}@{b.version}" for name, b in bundles.items())
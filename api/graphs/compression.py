@@ -0,0 +1,184 @@
+from __future__ import annotations
+import math
+import os
+import re
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from .text_utils import tokenize
+from .config import (
+    COMPRESSION_TOP_SENTENCES,
+    COMPRESSION_NEIGHBOURS,
+    COMPRESSION_MIN_SENTENCES,
+    COMPRESSION_DENSE_WEIGHT,
+)
+
+SENTENCES_FILE = "sentences.npz"
+CONTENT_MARKER = "### Content\n"
+GAP_MARK = " [...] "
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_STATS_LOCK = threading.Lock()
+_STATS = {"requests": 0, "tokens_before": 0, "tokens_after": 0}
+
+def strip_metadata_header(text):
+    """Saca el encabezado que agrega enrich_text_for_embedding (capítulo/sección ya van en la cita)."""
+    head, marker, content = text.partition(CONTENT_MARKER)
+    return content.strip() if marker else text.strip()
+
+def split_sentences(text):
+    """Misma partición al construir el índice y al comprimir, para que los vectores se alineen."""
+    return [s for s in _SENTENCE_END.split(strip_metadata_header(text)) if s]
+
+def _normalize(vectors, dims):
+    # los modelos text-embedding-3 admiten truncar dimensiones y renormalizar
+    vectors = np.asarray(vectors, dtype="float32")[:, :dims]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class SentenceIndex:
+    """
+    Vectores de las oraciones de cada chunk, calculados al construir el índice.
+    Para el chunk ids[i], sus oraciones son vectors[indptr[i]:indptr[i+1]].
+    Se guardan truncados a `dims` dimensiones y en float16.
+    """
+
+    def __init__(self, ids, indptr, vectors):
+        self.ids = ids
+        self.indptr = indptr
+        self.vectors = vectors
+        self.dims = vectors.shape[1] if vectors.ndim == 2 else 0
+        self._pos = {doc_id: i for i, doc_id in enumerate(ids)}
+
+    @classmethod
+    def build(cls, items, embed_texts, dims, window=2000):
+        """
+        items: (id, texto del chunk) en cualquier iterable; embed_texts embebe
+        una lista de textos. Se embebe de a `window` oraciones.
+        """
+        ids, indptr, blocks, pending = [], [0], [], []
+
+        def flush():
+            if pending:
+                blocks.append(_normalize(embed_texts(pending), dims).astype("float16"))
+                pending.clear()
+
+        for doc_id, text in items:
+            sentences = split_sentences(text)
+            ids.append(doc_id)
+            indptr.append(indptr[-1] + len(sentences))
+            pending.extend(sentences)
+            if len(pending) >= window:
+                flush()
+        flush()
+
+        vectors = np.concatenate(blocks) if blocks else np.zeros((0, dims), dtype="float16")
+        return cls(ids, np.array(indptr, dtype="int64"), vectors)
+
+    def save(self, path):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=np.array(self.ids, dtype=str), indptr=self.indptr, vectors=self.vectors)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["ids"].tolist(), data["indptr"], data["vectors"])
+
+    def get(self, doc_id, n_sentences):
+        """Vectores de las oraciones del chunk, o None si no está o no coincide la partición."""
+        i = self._pos.get(doc_id)
+        if i is None:
+            return None
+        start, end = self.indptr[i], self.indptr[i + 1]
+        if end - start != n_sentences:
+            return None
+        return self.vectors[start:end].astype("float32")
+
+    def __len__(self):
+        return len(self.ids)
+
+def _lexical_scores(query, sentences_by_doc):
+    """
+    Cobertura de los términos de la consulta por oración, ponderada por un IDF
+    calculado sobre las oraciones recuperadas. En [0, 1].
+    """
+    terms = set(tokenize(query))
+    token_sets = [[set(tokenize(s)) for s in sentences] for sentences in sentences_by_doc]
+    n = sum(len(ts) for ts in token_sets) or 1
+    idf = {t: math.log(1 + n / (1 + sum(t in s for ts in token_sets for s in ts))) for t in terms}
+    total = sum(idf.values()) or 1.0
+    return [np.array([sum(idf[t] for t in terms & s) / total for s in ts], dtype="float32") for ts in token_sets]
+
+def _select(scores, top, neighbours):
+    """Índices de las `top` mejores oraciones y sus vecinas, en orden original."""
+    keep = set()
+    for i in np.argsort(-scores, kind="stable")[:top]:
+        keep.update(range(max(0, i - neighbours), min(len(scores), i + neighbours + 1)))
+    return sorted(keep)
+
+def _join(sentences, selected):
+    parts, prev = [], None
+    for i in selected:
+        if prev is not None:
+            parts.append(" " if i == prev + 1 else GAP_MARK)
+        parts.append(sentences[i])
+        prev = i
+    text = "".join(parts)
+    if selected and selected[0] > 0:
+        text = "[...] " + text
+    if selected and selected[-1] < len(sentences) - 1:
+        text += " [...]"
+    return text
+
+def compress_docs(query, docs, query_vector=None, sentence_indexes=None):
+    """
+    Deja de cada chunk solo las oraciones más relevantes para la consulta y
+    sus vecinas. El score combina cobertura léxica y, si el índice tiene
+    vectores de oraciones, el producto punto con la consulta. Los chunks
+    cortos quedan enteros (sin el encabezado de metadatos).
+
+    sentence_indexes: colección → SentenceIndex. Devuelve docs nuevos con la
+    misma metadata.
+    """
+    sentence_indexes = sentence_indexes or {}
+    sentences_by_doc = [split_sentences(d.page_content) for d in docs]
+    lexical = _lexical_scores(query, sentences_by_doc)
+
+    compressed = []
+    for d, sentences, lex in zip(docs, sentences_by_doc, lexical):
+        m = d.metadata or {}
+        if len(sentences) <= COMPRESSION_MIN_SENTENCES:
+            text = " ".join(sentences)
+        else:
+            scores = lex
+            index = sentence_indexes.get(m.get("collection"))
+            vectors = index.get(m.get("id"), len(sentences)) if index is not None and query_vector is not None else None
+            if vectors is not None:
+                q = _normalize([query_vector], index.dims)[0]
+                scores = COMPRESSION_DENSE_WEIGHT * (vectors @ q) + (1 - COMPRESSION_DENSE_WEIGHT) * lex
+            text = _join(sentences, _select(scores, COMPRESSION_TOP_SENTENCES, COMPRESSION_NEIGHBOURS))
+        compressed.append(Document(id=d.id, page_content=text, metadata=dict(m)))
+    return compressed
+
+def record_compression(tokens_before, tokens_after):
+    with _STATS_LOCK:
+        _STATS["requests"] += 1
+        _STATS["tokens_before"] += tokens_before
+        _STATS["tokens_after"] += tokens_after
+    return {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "ratio": round(tokens_after / tokens_before, 3) if tokens_before else 1.0,
+    }
+
+def compression_stats():
+    with _STATS_LOCK:
+        before = _STATS["tokens_before"]
+        return {
+            "requests": _STATS["requests"],
+            "tokens_before": before,
+            "tokens_after": _STATS["tokens_after"],
+            "ratio": round(_STATS["tokens_after"] / before, 3) if before else 1.0,
+        }
@@ -8,5 +8,100 @@ FOLLOWUP_MODEL = "gpt-4.1-mini"
 TOP_K = 4
 SCORE_THRESHOLD = 0.25
 LANG = "ES"
-MAX_CONTEXT_CHARS = 5000
-EVALUATOR_MODEL = "gpt-4o-mini"
\ No newline at end of file
+EVALUATOR_MODEL = "gpt-4o-mini"
+
+# RAGAS: respuestas evaluadas en paralelo (se reduce sola ante rate limits),
+# reintentos por rate limit y resultados por transacción de escritura
+EVAL_CONCURRENCY = 8
+# tope para --concurrency y para el campo concurrency de /rag/evaluate
+EVAL_MAX_CONCURRENCY = EVAL_CONCURRENCY * 4
+EVAL_MAX_RETRIES = 6
+EVAL_WRITE_BATCH = 20
+
+# Backend de cada rol de modelo: "openai", "openai_compatible" (servidor propio con
+# la API de OpenAI: vLLM, Ollama, llama.cpp, LM Studio) o "local" (determinista, sin red).
+# MODEL_PROVIDER=<backend> en el entorno fuerza el mismo backend para todos los roles y
+# MODEL_PROVIDER_<ROL> (ej. MODEL_PROVIDER_FOLLOWUP) solo para uno.
+MODEL_PROVIDERS = {
+    "answer": {"backend": "openai", "model": LLM_MODEL},
+    "followup": {"backend": "openai", "model": FOLLOWUP_MODEL},
+    "rewrite": {"backend": "openai", "model": LLM_MODEL},
+    "summarize": {"backend": "openai", "model": LLM_MODEL},
+    "embed": {"backend": "openai", "model": EMBEDDING_MODEL},
+    "evaluate": {"backend": "openai", "model": EVALUATOR_MODEL},
+}
+# URL por defecto del backend openai_compatible (o OPENAI_COMPATIBLE_BASE_URL en el entorno)
+OPENAI_COMPATIBLE_BASE_URL = "http://localhost:8001/v1"
+# dimensión de los embeddings del backend local
+LOCAL_EMBEDDING_DIMS = 384
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = PROJECT_ROOT / "api" / "db" / "answer_cache.sqlite"
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 5000
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+EMBEDDING_CACHE_SIZE = 4096
+# None desactiva el cache en disco y deja solo el LRU en memoria
+EMBEDDING_CACHE_PATH = PROJECT_ROOT / "api" / "db" / "embedding_cache.sqlite"
+
+# Recupera documentos con la pregunta original mientras se detecta el follow-up
+SPECULATIVE_RETRIEVAL = True
+
+# Clasificador local antes del LLM de detect_followup
+FOLLOWUP_FASTPATH_ENABLED = True
+FOLLOWUP_FASTPATH_CONFIDENCE = 0.85
+
+# Guardado de historial y resumen en segundo plano
+BACKGROUND_WORKERS = 4
+BACKGROUND_WAIT_SECONDS = 2.0
+
+# Escritor de turnos (api/db/writer.py). "batched": el request no espera y el turno
+# se escribe en el próximo lote; "sync": el request espera el commit de su lote.
+WRITE_MODE = "batched"
+WRITE_BATCH_SIZE = 64
+WRITE_FLUSH_INTERVAL = 0.02
+
+# Parámetros de búsqueda para índices aproximados (ver build_meta.json del índice)
+FAISS_NPROBE = 16
+FAISS_EF_SEARCH = 128
+
+# Recuperación híbrida: BM25 (bm25.npz junto al índice) + FAISS fusionados con RRF
+HYBRID_RETRIEVAL = True
+DENSE_CANDIDATES = 20
+LEXICAL_CANDIDATES = 20
+RRF_K = 60
+DENSE_WEIGHT = 1.0
+LEXICAL_WEIGHT = 1.0
+
+# Re-ranking por diversidad (MMR) sobre los vectores guardados en el índice
+MMR_ENABLED = True
+MMR_LAMBDA = 0.5
+MMR_FETCH_K = 12
+
+# Versiones del índice: cada worker revisa el puntero CURRENT cada N segundos (0 = no mirar)
+INDEX_WATCH_INTERVAL = 5.0
+INDEX_KEEP_VERSIONS = 3
+
+# Colecciones adicionales: cada subdirectorio es un índice versionado ("default" es FAISS_DIR)
+COLLECTIONS_DIR = PROJECT_ROOT / "api" / "collections"
+COLLECTIONS_MEMORY_BUDGET_MB = 4096
+
+# Presupuesto de tokens (tiktoken) del prompt de respuesta, por modelo
+PROMPT_TOKEN_BUDGET = 6000
+PROMPT_TOKEN_BUDGETS = {"gpt-4.1-mini": 6000}
+HISTORY_SUMMARY_MAX_TOKENS = 400
+RECENT_TURNS_MAX_TOKENS = 800
+MAX_CHUNK_TOKENS = 1200
+MIN_CHUNK_TOKENS = 64
+# tokens de historial (turnos + respuesta) a partir de los cuales se resume
+SUMMARIZE_HISTORY_TOKENS = 1200
+
+# Compresión extractiva de los chunks recuperados antes de armar el prompt.
+# Apagada hasta comparar faithfulness de RAGAS con y sin compresión.
+COMPRESSION_ENABLED = False
+COMPRESSION_TOP_SENTENCES = 3
+COMPRESSION_NEIGHBOURS = 1
+COMPRESSION_MIN_SENTENCES = 6
+COMPRESSION_DENSE_WEIGHT = 0.6
+# dimensiones de los vectores de oraciones (sentences.npz, generado con el índice)
+SENTENCE_VECTOR_DIMS = 256
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_WS = re.compile(r"\s+")
+
+def normalize_query(text):
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def embedding_key(model, text):
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Vectores persistidos en SQLite, indexados por embedding_key()."""
+
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL
+        );
+        """)
+        self._con.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._con.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                found.update((k, np.frombuffer(v, dtype="float32").tolist()) for k, v in rows)
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            self._con.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype="float32").tobytes()) for k, v in items],
+            )
+            self._con.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envuelve un modelo de embeddings con un LRU en memoria y, opcionalmente,
+    un store en disco. La clave es (modelo, hash del texto); las consultas se
+    normalizan (espacios/Unicode) antes de calcular la clave y de embeber.
+    """
+
+    def __init__(self, underlying, model, max_items=4096, store_path=None):
+        self.underlying = underlying
+        self.model = model
+        self.max_items = max_items
+        self.store = EmbeddingStore(store_path) if store_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def _lookup_memory(self, keys):
+        found = {}
+        with self._lock:
+            for k in keys:
+                if k in self._lru:
+                    self._lru.move_to_end(k)
+                    found[k] = self._lru[k]
+                    self.hits += 1
+        pending = [k for k in dict.fromkeys(keys) if k not in found]
+        return found, (pending if self.store else [])
+
+    def _remember_from_disk(self, found, from_disk):
+        with self._lock:
+            for k, v in from_disk.items():
+                self._remember(k, v)
+                self.disk_hits += 1
+        found.update(from_disk)
+        return found
+
+    def _save_memory(self, items):
+        with self._lock:
+            for k, v in items:
+                self._remember(k, v)
+            self.misses += len(items)
+        return bool(self.store and items)
+
+    def _lookup(self, keys):
+        """Resuelve las claves desde memoria y disco; devuelve {key: vector}."""
+        found, pending = self._lookup_memory(keys)
+        if not pending:
+            return found
+        return self._remember_from_disk(found, self.store.get_many(pending))
+
+    async def _alookup(self, keys):
+        # el LRU se consulta en el event loop; SQLite, en un hilo
+        found, pending = self._lookup_memory(keys)
+        if not pending:
+            return found
+        return self._remember_from_disk(found, await asyncio.to_thread(self.store.get_many, pending))
+
+    def _save(self, items):
+        if self._save_memory(items):
+            self.store.put_many(items)
+
+    async def _asave(self, items):
+        if self._save_memory(items):
+            await asyncio.to_thread(self.store.put_many, items)
+
+    def _missing(self, texts, found):
+        missing = {}
+        for t in texts:
+            k = embedding_key(self.model, t)
+            if k not in found and k not in missing:
+                missing[k] = t
+        return missing
+
+    def get_cached(self, texts):
+        """Vectores ya conocidos para cada texto (None si hay que calcularlo)."""
+        keys = [embedding_key(self.model, t) for t in texts]
+        found = self._lookup(keys)
+        return [found.get(k) for k in keys]
+
+    def put(self, texts, vectors):
+        self._save([(embedding_key(self.model, t), v) for t, v in zip(texts, vectors)])
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.model, t) for t in texts]
+        found = self._lookup(keys)
+        missing = self._missing(texts, found)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            items = list(zip(missing.keys(), vectors))
+            self._save(items)
+            found.update(items)
+        return [found[k] for k in keys]
+
+    async def aembed_documents(self, texts):
+        keys = [embedding_key(self.model, t) for t in texts]
+        found = await self._alookup(keys)
+        missing = self._missing(texts, found)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            items = list(zip(missing.keys(), vectors))
+            await self._asave(items)
+            found.update(items)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        text = normalize_query(text)
+        key = embedding_key(self.model, text)
+        found = self._lookup([key])
+        if key not in found:
+            vector = self.underlying.embed_query(text)
+            self._save([(key, vector)])
+            return vector
+        return found[key]
+
+    async def aembed_query(self, text):
+        text = normalize_query(text)
+        key = embedding_key(self.model, text)
+        found = await self._alookup([key])
+        if key not in found:
+            vector = await self.underlying.aembed_query(text)
+            await self._asave([(key, vector)])
+            return vector
+        return found[key]
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model": self.model,
+            "size": len(self._lru),
+            "max_items": self.max_items,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
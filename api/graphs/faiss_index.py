@@ -0,0 +1,83 @@
+from __future__ import annotations
+import json
+import math
+import faiss
+
+BUILD_META_FILE = "build_meta.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+def load_build_meta(index_dir):
+    path = index_dir / BUILD_META_FILE
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_build_meta(index_dir, meta):
+    with open(index_dir / BUILD_META_FILE, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+def default_nlist(n_vectors):
+    # ~4·sqrt(N) listas, sin bajar de 39 puntos de entrenamiento por centroide
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+def create_index(index_type, dim, train_vectors, params):
+    """
+    Crea un índice FAISS vacío (y entrenado si es IVF) con métrica L2, la misma
+    que usa LangChain por defecto, para que los relevance scores no cambien.
+
+    params: nlist, hnsw_m, ef_construction, pq_m, pq_bits. Devuelve el índice y
+    los parámetros efectivamente usados, para guardarlos en build_meta.json.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim), {}
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return index, {"hnsw_m": params["hnsw_m"], "ef_construction": params["ef_construction"]}
+
+    n = len(train_vectors)
+    nlist = params.get("nlist") or default_nlist(n)
+    if n < nlist:
+        raise ValueError(f"Se necesitan al menos {nlist} vectores para entrenar {nlist} listas IVF (hay {n}).")
+    quantizer = faiss.IndexFlatL2(dim)
+
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        used = {"nlist": nlist}
+    elif index_type == "ivf_pq":
+        pq_m, pq_bits = params["pq_m"], params["pq_bits"]
+        if dim % pq_m:
+            raise ValueError(f"La dimensión {dim} no es divisible por pq_m={pq_m}.")
+        if n < 2 ** pq_bits:
+            raise ValueError(f"IVF-PQ con {pq_bits} bits requiere al menos {2 ** pq_bits} vectores (hay {n}).")
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits)
+        used = {"nlist": nlist, "pq_m": pq_m, "pq_bits": pq_bits}
+    else:
+        raise ValueError(f"Tipo de índice desconocido: {index_type}. Opciones: {', '.join(INDEX_TYPES)}")
+
+    index.train(train_vectors)
+    return index, used
+
+def supports_delete(index_type):
+    # HNSW no permite remove_ids y en IVF los ids no se compactan al borrar,
+    # que es lo que asume FAISS.delete de LangChain
+    return index_type == "flat"
+
+def apply_search_params(index, nprobe, ef_search):
+    """Configura los parámetros de búsqueda del índice cargado según su tipo."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+
+def enable_reconstruct(index):
+    """IVF necesita un direct map para reconstruct(); flat y HNSW ya lo soportan."""
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass
@@ -0,0 +1,225 @@
+from __future__ import annotations
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+import numpy as np
+from .prompts.followup_examples import FOLLOWUP_EXAMPLES, FOLLOWUP_HOLDOUT
+
+LABELS = ("smalltalk", "standalone", "followup")
+
+_TOKEN = re.compile(r"[a-zñ0-9²]+")
+
+SMALLTALK_ANCHORS = {
+    "hola", "buenas", "buen", "buenos", "chau", "adios", "gracias", "saludos",
+    "hey", "hi", "hello", "bye", "goodbye", "thanks", "thank", "thx",
+}
+SMALLTALK_WORDS = SMALLTALK_ANCHORS | {
+    "dia", "dias", "tardes", "noches", "que", "tal", "como", "estas", "andas", "va",
+    "hasta", "luego", "pronto", "nos", "vemos", "muchas", "mil", "genial", "bien",
+    "muy", "todo", "perfecto", "there", "you", "a", "lot", "so", "much", "good",
+    "morning", "evening", "see", "ya",
+}
+AFFIRMATIVE_WORDS = {
+    "si", "dale", "ok", "okay", "okey", "claro", "perfecto", "continua", "continuar",
+    "segui", "seguir", "mostrame", "bueno", "por", "favor", "de", "acuerdo",
+    "yes", "yeah", "sure", "go", "on", "please",
+}
+ANAPHORA_CUES = {
+    "eso", "esto", "esa", "ese", "aquello", "ello", "anterior", "mismo", "misma",
+    "mas", "mejor", "ejemplo", "otro", "otra", "tambien", "entonces", "detalle",
+    "it", "that", "this", "those", "these", "more", "another", "example", "why", "also",
+}
+LEADING_CONNECTORS = {"y", "pero", "entonces", "e", "o", "and", "but", "so", "porque"}
+# "what about QDA?" retoma el tema; "what is QDA?" es una pregunta nueva
+LEADING_PHRASES = {("what", "about"), ("how", "about")}
+INTERROGATIVES = {
+    "que", "como", "cual", "cuales", "cuando", "donde", "quien", "por", "para",
+    "what", "how", "which", "when", "where", "who", "why",
+}
+DEFINITION_VERBS = {"explicame", "explica", "defini", "define", "describe", "explain", "es", "son", "is", "are"}
+# preguntas dirigidas al asistente ("¿quién sos?", "contame un chiste")
+ASSISTANT_WORDS = {
+    "sos", "eres", "llamas", "nombre", "podes", "puedes", "sabes", "hacer", "chiste", "broma",
+    "bot", "robot", "asistente", "who", "your", "name", "joke",
+}
+STOPWORDS = {"the", "and", "del", "las", "los", "una", "con", "sin", "sobre", "for"}
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return _TOKEN.findall(text)
+
+def _features(tokens, raw, has_history):
+    n = len(tokens)
+    anaphora = sum(t in ANAPHORA_CUES for t in tokens)
+    # desde 3 letras para no perder siglas (QDA, LDA, PCA)
+    content = [
+        t for t in tokens
+        if len(t) >= 3 and t not in ANAPHORA_CUES | SMALLTALK_WORDS | AFFIRMATIVE_WORDS | INTERROGATIVES
+        | DEFINITION_VERBS | ASSISTANT_WORDS | STOPWORDS
+    ]
+    leading = bool(tokens) and (tokens[0] in LEADING_CONNECTORS or tuple(tokens[:2]) in LEADING_PHRASES)
+    # "qué es X", "what are X", "explicame X"
+    definition = bool(tokens) and (
+        tokens[0] in DEFINITION_VERBS
+        or (len(tokens) > 2 and tokens[0] in INTERROGATIVES and tokens[1] in DEFINITION_VERBS)
+    )
+    return np.array([
+        1.0,
+        float(has_history),
+        math.log1p(n),
+        sum(t in SMALLTALK_ANCHORS for t in tokens) / max(n, 1),
+        float(n > 0 and all(t in SMALLTALK_WORDS for t in tokens)),
+        float(n > 0 and all(t in AFFIRMATIVE_WORDS for t in tokens)),
+        anaphora / max(n, 1),
+        float(leading),
+        float(bool(tokens) and tokens[0] in INTERROGATIVES),
+        float("?" in raw),
+        math.log1p(len(content)),
+        float(definition),
+        float(any(t in ASSISTANT_WORDS for t in tokens)),
+    ])
+
+
+class FollowupClassifier:
+    """
+    Clasificador local smalltalk/standalone/followup: reglas de alta precisión
+    y, si ninguna aplica, una regresión logística multinomial entrenada con
+    los ejemplos semilla de prompts/followup_examples.py. El fast path
+    (fast_label) solo usa el modelo cuando no hay historial.
+
+    Las probabilidades se calibran con temperature scaling sobre predicciones
+    fuera de muestra (validación cruzada), para que una confianza de 0.85
+    signifique lo mismo en ejemplos que el modelo no vio.
+    """
+
+    def __init__(self, examples=FOLLOWUP_EXAMPLES, epochs=800, lr=0.5, l2=1e-3, folds=5):
+        X = np.vstack([_features(_normalize(t), t, h) for t, h, _ in examples])
+        y = np.array([LABELS.index(label) for _, _, label in examples])
+        self._fit_args = (epochs, lr, l2)
+        self.temperature = self._calibrate(X, y, folds)
+        self.W = self._fit(X, y, *self._fit_args)
+
+    @staticmethod
+    def _fit(X, y, epochs, lr, l2):
+        Y = np.eye(len(LABELS))[y]
+        W = np.zeros((X.shape[1], len(LABELS)))
+        for _ in range(epochs):
+            P = FollowupClassifier._softmax(X @ W)
+            grad = X.T @ (P - Y) / len(X) + l2 * W
+            W -= lr * grad
+        return W
+
+    def _calibrate(self, X, y, folds):
+        """Temperatura que minimiza la log-loss de las predicciones de validación cruzada."""
+        # folds intercalados para que cada uno tenga ejemplos de todas las clases
+        order = np.argsort(y, kind="stable")
+        logits = np.zeros((len(y), len(LABELS)))
+        for k in range(folds):
+            test = order[k::folds]
+            train = np.setdiff1d(order, test)
+            W = self._fit(X[train], y[train], *self._fit_args)
+            logits[test] = X[test] @ W
+        temperatures = np.linspace(0.5, 5.0, 46)
+        losses = [
+            -np.log(self._softmax(logits / T)[np.arange(len(y)), y] + 1e-12).mean()
+            for T in temperatures
+        ]
+        return float(temperatures[int(np.argmin(losses))])
+
+    @staticmethod
+    def _softmax(Z):
+        Z = Z - Z.max(axis=-1, keepdims=True)
+        E = np.exp(Z)
+        return E / E.sum(axis=-1, keepdims=True)
+
+    def _rules(self, tokens, has_history):
+        if not tokens:
+            return None
+        if all(t in SMALLTALK_WORDS for t in tokens) and any(t in SMALLTALK_ANCHORS for t in tokens):
+            return "smalltalk", 0.97
+        # sin historial solo se descarta el follow-up (en predict); smalltalk
+        # o standalone lo decide el modelo
+        if has_history and all(t in AFFIRMATIVE_WORDS for t in tokens):
+            return "followup", 0.95
+        return None
+
+    def predict(self, question, has_history):
+        """Devuelve (etiqueta, confianza)."""
+        tokens = _normalize(question)
+        ruled = self._rules(tokens, has_history)
+        if ruled:
+            return ruled
+        probs = self._softmax(_features(tokens, question, has_history) @ self.W / self.temperature)
+        if not has_history:
+            # sin historial no puede haber follow-up
+            probs[LABELS.index("followup")] = 0.0
+            probs = probs / probs.sum()
+        best = int(np.argmax(probs))
+        return LABELS[best], float(probs[best])
+
+    def fast_label(self, question, has_history, threshold):
+        """
+        Etiqueta con la que se puede saltear el LLM, o None. Con historial
+        solo deciden las reglas (saludos y respuestas afirmativas): el modelo
+        confunde follow-ups sin anáforas ("¿cuáles son las desventajas?") con
+        preguntas nuevas, y tomarlos como standalone saltearía la reescritura.
+        """
+        ruled = self._rules(_normalize(question), has_history)
+        if ruled:
+            return ruled[0]
+        if has_history:
+            return None
+        label, confidence = self.predict(question, has_history)
+        return label if confidence >= threshold else None
+
+    def evaluate(self, examples=FOLLOWUP_HOLDOUT, threshold=None):
+        """
+        Exactitud sobre ejemplos etiquetados y, para un umbral, qué fracción
+        decidiría el fast path (coverage) y con qué exactitud.
+        """
+        hits, fast, fast_hits = 0, 0, 0
+        for question, has_history, label in examples:
+            predicted, _ = self.predict(question, has_history)
+            hits += predicted == label
+            fast_label = self.fast_label(question, has_history, threshold) if threshold is not None else None
+            if fast_label is not None:
+                fast += 1
+                fast_hits += fast_label == label
+        n = len(examples)
+        return {
+            "accuracy": round(hits / n, 4) if n else 0.0,
+            "fastpath_coverage": round(fast / n, 4) if n else 0.0,
+            "fastpath_accuracy": round(fast_hits / fast, 4) if fast else None,
+        }
+
+
+_CLASSIFIER = None
+_CLASSIFIER_LOCK = threading.Lock()
+_DECISIONS = Counter()
+_DECISIONS_LOCK = threading.Lock()
+
+def get_followup_classifier():
+    global _CLASSIFIER
+    if _CLASSIFIER is None:
+        with _CLASSIFIER_LOCK:
+            if _CLASSIFIER is None:
+                _CLASSIFIER = FollowupClassifier()
+    return _CLASSIFIER
+
+def record_decision(label, source):
+    """source: 'fastpath' si decidió el clasificador local, 'llm' si hubo que llamar al modelo."""
+    with _DECISIONS_LOCK:
+        _DECISIONS[(source, label)] += 1
+
+def decision_stats():
+    stats = {"fastpath": {}, "llm": {}}
+    with _DECISIONS_LOCK:
+        for (source, label), n in _DECISIONS.items():
+            stats[source][label] = n
+    total = sum(sum(v.values()) for v in stats.values())
+    stats["fastpath_rate"] = round(sum(stats["fastpath"].values()) / total, 4) if total else 0.0
+    return stats
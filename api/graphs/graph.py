@@ -1,38 +1,116 @@
 from __future__ import annotations
-from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
 from .state_schema import RAGState
-from .nodes.history import load_history_node
-from .nodes.detect_followup import detect_followup_node
-from .nodes.smalltalk import smalltalk_node
-from .nodes.rewrite import rewrite_query_node
-from .nodes.rag_pipeline import rag_pipeline_node
-from .nodes.history import save_history_node
-from .nodes.summarize_history import summarize_history_node
+from .config import SPECULATIVE_RETRIEVAL
+from api.monitoring.metrics import timed_node
+from .nodes.history import load_history_node, aload_history_node
+from .nodes.detect_followup import detect_followup_node, adetect_followup_node
+from .nodes.smalltalk import smalltalk_node, asmalltalk_node
+from .nodes.rewrite import rewrite_query_node, arewrite_query_node
+from .nodes.rag_pipeline import (
+    rag_pipeline_node, arag_pipeline_node,
+    retrieve_node, aretrieve_node,
+    speculative_retrieve_node, aspeculative_retrieve_node,
+)
+from .nodes.history import save_history_node, asave_history_node
+from .nodes.answer_cache import answer_cache_node, aanswer_cache_node, cache_answer_node, acache_answer_node
+from .nodes.summarize_history import summarize_history_node, asummarize_history_node
 
 def to_smalltalk(state):
     return "smalltalk" if state.get("skip_rag") else "rewrite_query"
 
-def build_rag_graph():
-    graph = StateGraph(RAGState)
+def on_cache_hit(state):
+    return "hit" if state.get("cache_hit") else "miss"
 
-    graph.add_node("load_history", load_history_node)
-    graph.add_node("detect_followup", detect_followup_node)
-    graph.add_node("smalltalk", smalltalk_node)
-    graph.add_node("rewrite_query", rewrite_query_node)
-    graph.add_node("rag_pipeline", rag_pipeline_node)
-    graph.add_node("save_history", save_history_node)
-    graph.add_node("summarize_history", summarize_history_node)
+def _node(func, afunc):
+    # invoke() usa la versión sync y ainvoke() la async del mismo nodo;
+    # ambas se miden en rag_graph_node_seconds{node}
+    func, afunc = timed_node(func, afunc)
+    return RunnableLambda(func, afunc=afunc)
 
-    graph.set_entry_point("load_history")
+def _build_classify_graph():
+    graph = StateGraph(RAGState)
+    graph.add_node("load_history", _node(load_history_node, aload_history_node))
+    graph.add_node("detect_followup", _node(detect_followup_node, adetect_followup_node))
+    graph.add_edge(START, "load_history")
     graph.add_edge("load_history", "detect_followup")
-    graph.add_conditional_edges("detect_followup", to_smalltalk, {
+    graph.add_edge("detect_followup", END)
+    return graph.compile()
+
+def _add_classification(graph, routes):
+    """
+    Agrega load_history → detect_followup y devuelve la ruta según la etiqueta.
+
+    Con SPECULATIVE_RETRIEVAL ambos nodos corren como un subgrafo ("classify")
+    en el mismo paso que speculative_retrieve, que busca documentos con la
+    pregunta original. Si la pregunta resulta standalone, rag_pipeline/retrieve
+    reutilizan esos docs y la búsqueda queda fuera del camino crítico.
+    """
+    if not SPECULATIVE_RETRIEVAL:
+        graph.add_node("load_history", _node(load_history_node, aload_history_node))
+        graph.add_node("detect_followup", _node(detect_followup_node, adetect_followup_node))
+        graph.set_entry_point("load_history")
+        graph.add_edge("load_history", "detect_followup")
+        graph.add_conditional_edges("detect_followup", to_smalltalk, routes)
+        return
+
+    graph.add_node("classify", _build_classify_graph())
+    graph.add_node("speculative_retrieve", _node(speculative_retrieve_node, aspeculative_retrieve_node))
+    graph.add_edge(START, "classify")
+    graph.add_edge(START, "speculative_retrieve")
+    graph.add_conditional_edges("classify", to_smalltalk, routes)
+    graph.add_edge("speculative_retrieve", END)
+
+def build_rag_graph():
+    graph = StateGraph(RAGState)
+
+    _add_classification(graph, {
         "smalltalk": "smalltalk",
         "rewrite_query": "rewrite_query"
     })
+    graph.add_node("smalltalk", _node(smalltalk_node, asmalltalk_node))
+    graph.add_node("rewrite_query", _node(rewrite_query_node, arewrite_query_node))
+    graph.add_node("answer_cache", _node(answer_cache_node, aanswer_cache_node))
+    graph.add_node("rag_pipeline", _node(rag_pipeline_node, arag_pipeline_node))
+    graph.add_node("cache_answer", _node(cache_answer_node, acache_answer_node))
+    graph.add_node("save_history", _node(save_history_node, asave_history_node))
+    graph.add_node("summarize_history", _node(summarize_history_node, asummarize_history_node))
+
     graph.add_edge("smalltalk", "save_history")
-    graph.add_edge("rewrite_query", "rag_pipeline")
-    graph.add_edge("rag_pipeline", "save_history")
+    graph.add_edge("rewrite_query", "answer_cache")
+    graph.add_conditional_edges("answer_cache", on_cache_hit, {
+        "hit": "save_history",
+        "miss": "rag_pipeline"
+    })
+    graph.add_edge("rag_pipeline", "cache_answer")
+    graph.add_edge("cache_answer", "save_history")
     graph.add_edge("save_history", "summarize_history")
     graph.add_edge("summarize_history", END)
 
     return graph.compile()
+
+def build_rag_stream_graph():
+    """
+    Variante para /chat/stream: corre hasta la recuperación de documentos.
+    La respuesta se genera en streaming fuera del grafo y el guardado del
+    historial se hace recién cuando el stream termina.
+    """
+    graph = StateGraph(RAGState)
+
+    _add_classification(graph, {
+        "smalltalk": END,
+        "rewrite_query": "rewrite_query"
+    })
+    graph.add_node("rewrite_query", _node(rewrite_query_node, arewrite_query_node))
+    graph.add_node("answer_cache", _node(answer_cache_node, aanswer_cache_node))
+    graph.add_node("retrieve", _node(retrieve_node, aretrieve_node))
+
+    graph.add_edge("rewrite_query", "answer_cache")
+    graph.add_conditional_edges("answer_cache", on_cache_hit, {
+        "hit": END,
+        "miss": "retrieve"
+    })
+    graph.add_edge("retrieve", END)
+
+    return graph.compile()
@@ -0,0 +1,202 @@
+from __future__ import annotations
+import os
+import shutil
+import threading
+import traceback
+from datetime import datetime
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+LEGACY_VERSION = "legacy"
+
+def resolve_current(root):
+    """
+    Versión publicada y su directorio. Sin archivo CURRENT se asume el layout
+    anterior, con el índice directamente en root.
+    """
+    pointer = root / CURRENT_FILE
+    if pointer.exists():
+        version = pointer.read_text(encoding="utf-8").strip()
+        return version, root / VERSIONS_DIR / version
+    return LEGACY_VERSION, root
+
+def new_version_dir(root):
+    """Directorio vacío para una versión nueva, nombrada por fecha (UTC)."""
+    base = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    version, n = base, 1
+    while (root / VERSIONS_DIR / version).exists():
+        version, n = f"{base}-{n}", n + 1
+    path = root / VERSIONS_DIR / version
+    path.mkdir(parents=True)
+    return version, path
+
+def publish_version(root, version):
+    """Apunta CURRENT a la versión indicada con un rename atómico."""
+    tmp = root / (CURRENT_FILE + ".tmp")
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, root / CURRENT_FILE)
+
+def prune_versions(root, keep):
+    """Borra las versiones más viejas, conservando `keep` y siempre la publicada."""
+    versions_dir = root / VERSIONS_DIR
+    if keep <= 0 or not versions_dir.exists():
+        return []
+    current, _ = resolve_current(root)
+    versions = sorted(p.name for p in versions_dir.iterdir() if p.is_dir())
+    stale = [v for v in versions[:-keep] if v != current]
+    for v in stale:
+        # en Linux los workers que aún la tengan mapeada siguen leyéndola
+        shutil.rmtree(versions_dir / v, ignore_errors=True)
+    return stale
+
+class IndexBundle:
+    """
+    Una versión cargada del índice (FAISS + BM25 + fingerprint) con conteo de
+    referencias de los requests que la fijaron. Al retirarla queda cerrada
+    (closed) recién cuando terminan esos requests; la memoria la libera el GC
+    cuando ya nadie tiene una referencia, así que quien la usa sin fijarla
+    (las rutas de LangServe, registry.active()) no ve campos en None.
+    """
+
+    def __init__(self, version, path, vectorstore, bm25, fingerprint, stats, sentences=None):
+        self.version = version
+        self.path = path
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.sentences = sentences
+        self.fingerprint = fingerprint
+        self.stats = stats
+        self._refs = 0
+        self._retired = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            close = self._retired and self._refs == 0
+        if close:
+            self._close()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            close = self._refs == 0
+        if close:
+            self._close()
+
+    def _close(self):
+        # no se anulan los campos: el manager ya soltó su referencia y el GC
+        # libera el índice, su mmap y el docstore cuando el último lector termina
+        self.closed = True
+
+class IndexManager:
+    """
+    Mantiene la versión activa de un índice y la reemplaza en caliente cuando
+    cambia el puntero CURRENT: la nueva se carga aparte y el swap es un cambio
+    de referencia, así que los requests en curso terminan con la anterior.
+    """
+
+    def __init__(self, root, loader, name=None):
+        self.root = root
+        self.loader = loader
+        self.name = name or root.name
+        self._current = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+        self.last_error = None
+
+    def current(self):
+        bundle = self._current
+        if bundle is None:
+            with self._reload_lock:
+                bundle = self._load_locked()
+        return bundle
+
+    def _load_locked(self):
+        # se llama con _reload_lock tomado: carga la versión publicada si no hay una activa
+        bundle = self._current
+        if bundle is None:
+            version, path = resolve_current(self.root)
+            bundle = self.loader(version, path)
+            with self._lock:
+                self._current = bundle
+        return bundle
+
+    def loaded(self):
+        return self._current is not None
+
+    def version(self):
+        bundle = self._current
+        return bundle.version if bundle is not None else None
+
+    def acquire(self):
+        # el swap y unload() también toman _lock: no se puede adquirir una versión ya retirada
+        with self._lock:
+            if self._current is not None:
+                return self._current.acquire()
+        # sin versión activa (primera carga o descargada por el registry): la carga
+        # y la adquisición van bajo los mismos locks para que unload() no se cuele
+        with self._reload_lock:
+            bundle = self._load_locked()
+            with self._lock:
+                return bundle.acquire()
+
+    def reload(self, force=False):
+        """
+        Carga la versión publicada si difiere de la activa (o siempre con force).
+        Devuelve True si hubo swap.
+        """
+        with self._reload_lock:
+            version, path = resolve_current(self.root)
+            old = self._current
+            if old is not None and old.version == version and not force:
+                return False
+            new = self.loader(version, path)
+            with self._lock:
+                self._current = new
+            self.reloads += 1
+        if old is not None:
+            old.retire()
+        return True
+
+    def poll(self):
+        """Recarga si CURRENT apunta a otra versión. Pensado para el watcher."""
+        pointer = self.root / CURRENT_FILE
+        if self._current is None or not pointer.exists():
+            return False
+        try:
+            reloaded = False
+            if pointer.read_text(encoding="utf-8").strip() != self._current.version:
+                reloaded = self.reload()
+                print(f"[pid {os.getpid()}] Índice {self.name} recargado: versión {self._current.version}", flush=True)
+            self.last_error = None
+            return reloaded
+        except Exception as e:
+            # se sigue sirviendo la versión anterior; se reintenta en el próximo ciclo
+            self.last_error = str(e)
+            traceback.print_exc()
+            return False
+
+    def unload(self):
+        """Descarga la versión activa (se libera cuando terminan sus requests)."""
+        with self._reload_lock:
+            with self._lock:
+                old, self._current = self._current, None
+        if old is not None:
+            old.retire()
+
+    def stats(self):
+        bundle = self._current
+        return {
+            "version": bundle.version if bundle is not None else None,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            **(bundle.stats if bundle is not None else {}),
+        }
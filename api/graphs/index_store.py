@@ -0,0 +1,184 @@
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from .faiss_index import load_build_meta
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+PICKLE_FILE = "index.pkl"
+
+class SqliteDocstore(Docstore):
+    """
+    Docstore de solo lectura sobre docstore.sqlite: cada chunk se busca por id
+    (o por posición en el índice FAISS) en vez de deserializar todo a memoria.
+    Varios procesos comparten las mismas páginas a través del page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # una sola conexión abierta al cargar: si el archivo se reemplaza por un
+        # rebuild, este proceso sigue leyendo la versión que corresponde a su índice
+        self._con = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._count = None
+
+    def _fetchone(self, sql, params=()):
+        with self._lock:
+            return self._con.execute(sql, params).fetchone()
+
+    def search(self, search):
+        row = self._fetchone("SELECT page_content, metadata FROM docs WHERE id = ?", (search,))
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def id_at(self, position):
+        row = self._fetchone("SELECT id FROM docs WHERE position = ?", (position,))
+        return None if row is None else row[0]
+
+    def positions_of(self, ids):
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            rows = dict(self._con.execute(f"SELECT id, position FROM docs WHERE id IN ({marks})", list(ids)))
+        return [rows.get(i) for i in ids]
+
+    def positions(self):
+        with self._lock:
+            return [r[0] for r in self._con.execute("SELECT position FROM docs ORDER BY position")]
+
+    def count(self):
+        if self._count is None:
+            self._count = self._fetchone("SELECT COUNT(*) FROM docs")[0]
+        return self._count
+
+class DocstoreIdMap(Mapping):
+    """index_to_docstore_id perezoso: resuelve posición → id contra el docstore."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position):
+        doc_id = self.docstore.id_at(int(position))
+        if doc_id is None:
+            raise KeyError(position)
+        return doc_id
+
+    def __iter__(self):
+        return iter(self.docstore.positions())
+
+    def __len__(self):
+        return self.docstore.count()
+
+def index_format(index_dir):
+    """"sqlite" para índices guardados con save_index_store, "pickle" para los de save_local."""
+    if (index_dir / DOCSTORE_FILE).exists():
+        return "sqlite"
+    if (index_dir / PICKLE_FILE).exists():
+        return "pickle"
+    raise FileNotFoundError(f"No hay docstore en {index_dir} ({DOCSTORE_FILE} ni {PICKLE_FILE}).")
+
+def _replace_atomically(path, write):
+    # se escribe a un temporal y se renombra: quien tenga el archivo viejo
+    # abierto o mapeado lo sigue viendo completo hasta recargar
+    tmp = path.with_name(path.name + ".tmp")
+    if tmp.exists():
+        tmp.unlink()
+    write(tmp)
+    os.replace(tmp, path)
+
+def _write_docstore(rows, path):
+    con = sqlite3.connect(path)
+    try:
+        con.execute("""
+            CREATE TABLE docs (
+                position INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                page_content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        # executemany consume el iterador de a una fila: no hace falta tener todo en memoria
+        con.executemany(
+            "INSERT INTO docs VALUES (?, ?, ?, ?)",
+            ((position, doc_id, content, json.dumps(metadata, ensure_ascii=False))
+             for position, doc_id, content, metadata in rows),
+        )
+        con.commit()
+    finally:
+        con.close()
+
+def _vectorstore_rows(vectorstore):
+    for position, doc_id in vectorstore.index_to_docstore_id.items():
+        doc = vectorstore.docstore.search(doc_id)
+        yield position, doc_id, doc.page_content, doc.metadata
+
+def save_index_parts(index, rows, index_dir):
+    """
+    Guarda un índice FAISS y su docstore a partir de filas
+    (posición, id, texto, metadata), que pueden venir de un generador.
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+    _replace_atomically(index_dir / INDEX_FILE, lambda p: faiss.write_index(index, str(p)))
+    _replace_atomically(index_dir / DOCSTORE_FILE, lambda p: _write_docstore(rows, p))
+    # un pickle viejo quedaría desincronizado con el índice nuevo
+    (index_dir / PICKLE_FILE).unlink(missing_ok=True)
+
+def save_index_store(vectorstore, index_dir):
+    """Guarda el índice FAISS y el docstore SQLite (sin pickle) en index_dir."""
+    save_index_parts(vectorstore.index, _vectorstore_rows(vectorstore), index_dir)
+
+def _mmap_flags(index_dir):
+    # IVF mapea sus listas invertidas con IO_FLAG_MMAP; flat/HNSW mapean los
+    # vectores en su lugar con IO_FLAG_MMAP_IFC. Las dos juntas no se admiten.
+    index_type = load_build_meta(index_dir).get("index_type", "flat")
+    mmap = faiss.IO_FLAG_MMAP if index_type.startswith("ivf") else faiss.IO_FLAG_MMAP_IFC
+    return mmap | faiss.IO_FLAG_READ_ONLY
+
+def load_index_store(index_dir, embeddings, in_memory=False):
+    """
+    Abre un índice guardado con save_index_store. Por defecto los vectores se
+    mapean desde disco y los chunks se leen de SQLite a demanda, así que la
+    carga es casi instantánea y los workers comparten memoria.
+
+    in_memory=True lo carga completo y modificable (para --incremental).
+    Los índices antiguos con index.pkl se siguen cargando vía pickle.
+    """
+    if index_format(index_dir) == "pickle":
+        return FAISS.load_local(str(index_dir), embeddings, allow_dangerous_deserialization=True)
+
+    docstore = SqliteDocstore(index_dir / DOCSTORE_FILE)
+    if in_memory:
+        index = faiss.read_index(str(index_dir / INDEX_FILE))
+        mapping = dict(DocstoreIdMap(docstore))
+        return FAISS(embeddings, index, InMemoryDocstore({i: docstore.search(i) for i in mapping.values()}), mapping)
+
+    index = faiss.read_index(str(index_dir / INDEX_FILE), _mmap_flags(index_dir))
+    return FAISS(embeddings, index, docstore, DocstoreIdMap(docstore))
+
+def docstore_positions(vectorstore, ids):
+    """Posición en el índice FAISS de cada id del docstore (None si no está)."""
+    docstore = vectorstore.docstore
+    if isinstance(docstore, SqliteDocstore):
+        return docstore.positions_of(ids)
+    # docstore en memoria (índices con pickle): el mapa inverso se arma una vez
+    reverse = getattr(vectorstore, "_position_by_id", None)
+    if reverse is None:
+        reverse = {doc_id: pos for pos, doc_id in vectorstore.index_to_docstore_id.items()}
+        vectorstore._position_by_id = reverse
+    return [reverse.get(i) for i in ids]
+
+def process_rss_mb():
+    """Memoria residente actual del proceso en MB (None si no se puede leer)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError):
+        return None
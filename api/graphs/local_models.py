@@ -0,0 +1,225 @@
+"""
+Backend "local" de providers.py: LLM y embeddings deterministas que no usan
+la red. Respetan las interfaces de LangChain (BaseChatModel y Embeddings),
+así que el grafo, los caches, el build del índice y las métricas los usan
+igual que a los modelos reales. Sirven para correr todo sin conexión y, con
+una latencia simulada, para el benchmark de carga.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import random
+import re
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from .followup_classifier import get_followup_classifier
+from .text_utils import tokenize
+
+class LatencyModel:
+    """
+    Latencia simulada: base + por token de entrada + por token de salida,
+    con un jitter uniforme de ±jitter (fracción) a partir de una semilla fija.
+    """
+
+    def __init__(self, base=0.0, per_input_token=0.0, per_output_token=0.0, jitter=0.0, seed=0):
+        self.base = base
+        self.per_input_token = per_input_token
+        self.per_output_token = per_output_token
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    def _scale(self):
+        return 1.0 + self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 1.0
+
+    def first_token(self, input_tokens):
+        return (self.base + self.per_input_token * input_tokens) * self._scale()
+
+    def per_token(self):
+        return self.per_output_token * self._scale()
+
+def approx_tokens(text):
+    # ~4 caracteres por token, suficiente para simular latencia y usage
+    return max(1, len(text) // 4)
+
+class ApproxTokenizer:
+    """
+    Tokenizador aproximado con la interfaz de tiktoken.Encoding que usan
+    prompt_budget y ConcurrentEmbedder: trozos de hasta 4 caracteres de
+    palabra o un signo, cada uno con el espacio que lo precede. No necesita
+    archivos ni red y decode(encode(t)) devuelve t.
+    """
+
+    name = "approx"
+    _PIECE = re.compile(r"\s*(?:\w{1,4}|[^\w\s])|\s+")
+
+    def encode(self, text, disallowed_special=()):
+        return self._PIECE.findall(text)
+
+    def encode_batch(self, texts, disallowed_special=()):
+        return [self.encode(t) for t in texts]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings por hashing de términos y bigramas (normalizados): textos con
+    vocabulario en común quedan cerca, así que la recuperación devuelve
+    fragmentos razonables sin llamar a la API.
+    """
+
+    def __init__(self, dims=384, latency=None):
+        self.dims = dims
+        self.latency = latency or LatencyModel()
+        self.calls = 0
+
+    def _vector(self, text):
+        terms = tokenize(text)
+        v = np.zeros(self.dims, dtype="float32")
+        for term in terms + [a + " " + b for a, b in zip(terms, terms[1:])]:
+            h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dims] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = np.linalg.norm(v)
+        return (v / norm if norm else v).tolist()
+
+    def _delay(self, texts):
+        self.calls += 1
+        return self.latency.first_token(sum(approx_tokens(t) for t in texts))
+
+    def embed_documents(self, texts):
+        delay = self._delay(texts)
+        if delay:
+            time.sleep(delay)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        delay = self._delay(texts)
+        if delay:
+            await asyncio.sleep(delay)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+def _between(text, start, end):
+    _, found, rest = text.partition(start)
+    return rest.partition(end)[0].strip() if found else ""
+
+_SOURCE_HEADER = re.compile(r"^\(Fuente \d+ \| pág (\S+) \| cap [^)]*\)$", re.MULTILINE)
+
+def scripted_reply(prompt, answer_tokens=120):
+    """
+    Respuesta determinista según el prompt del repo que la pide: etiqueta de
+    follow-up (con el clasificador local), reescritura, resumen, smalltalk o
+    una respuesta armada con el primer fragmento del contexto.
+    """
+    if "Nuevo mensaje:" in prompt:
+        question = _between(prompt, "Nuevo mensaje:", "Respuesta:")
+        has_history = bool(_between(prompt, "Historial:", "Nuevo mensaje:"))
+        label, _ = get_followup_classifier().predict(question, has_history)
+        return label
+
+    if "PREGUNTA REESCRITA:" in prompt:
+        question = _between(prompt, "PREGUNTA ORIGINAL DEL USUARIO:", "PREGUNTA REESCRITA:")
+        previous = [line[3:] for line in prompt.splitlines() if line.startswith("U: ")]
+        # como pide el prompt, solo se reescriben los mensajes que no se entienden solos
+        if previous and len(question.split()) <= 3:
+            return f"{question} (sobre: {previous[-1]})"
+        return question
+
+    if "Conversación:" in prompt:
+        conversation = prompt.partition("Conversación:")[2].split()
+        return "Resumen: " + " ".join(conversation[:60])
+
+    if "Usuario:" in prompt and "Asistente:" in prompt:
+        return "¡Hola! ¿En qué te puedo ayudar con el libro?"
+
+    context = prompt.partition("Contexto del libro (fragmentos recuperados):")[2].partition("Responde:")[0]
+    match = _SOURCE_HEADER.search(context)
+    if not match:
+        return "No hay información suficiente en el libro para responder."
+    words = context[match.end():].split()
+    if not words:
+        return "No hay información suficiente en el libro para responder."
+    body = [words[i % len(words)] for i in range(answer_tokens)]
+    return f"Según el libro (pág {match.group(1)}): " + " ".join(body)
+
+class CannedChatModel(BaseChatModel):
+    """Chat model local: scripted_reply con latencia de primer token y por token (por defecto, cero)."""
+
+    model_name: str = "canned"
+    answer_tokens: int = 120
+    latency: LatencyModel = None
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def _llm_type(self):
+        return "canned"
+
+    @property
+    def _identifying_params(self):
+        # las métricas toman el modelo de invocation_params
+        return {"model_name": self.model_name}
+
+    def _prompt(self, messages):
+        return "\n".join(str(m.content) for m in messages)
+
+    def _reply(self, messages):
+        prompt = self._prompt(messages)
+        text = scripted_reply(prompt, self.answer_tokens)
+        usage = {
+            "input_tokens": approx_tokens(prompt),
+            "output_tokens": len(text.split()),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return text, usage
+
+    def _latency(self):
+        return self.latency or LatencyModel()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply(messages)
+        latency = self._latency()
+        time.sleep(latency.first_token(usage["input_tokens"]) + latency.per_token() * usage["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply(messages)
+        latency = self._latency()
+        await asyncio.sleep(latency.first_token(usage["input_tokens"]) + latency.per_token() * usage["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _chunks(self, text, usage):
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            message = AIMessageChunk(content=word if last else word + " ", usage_metadata=usage if last else None)
+            yield ChatGenerationChunk(message=message)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply(messages)
+        latency = self._latency()
+        time.sleep(latency.first_token(usage["input_tokens"]))
+        for chunk in self._chunks(text, usage):
+            time.sleep(latency.per_token())
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply(messages)
+        latency = self._latency()
+        await asyncio.sleep(latency.first_token(usage["input_tokens"]))
+        for chunk in self._chunks(text, usage):
+            await asyncio.sleep(latency.per_token())
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
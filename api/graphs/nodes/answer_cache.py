@@ -0,0 +1,62 @@
+from __future__ import annotations
+import asyncio
+from ..resources import get_answer_cache, get_embeddings, get_index_fingerprint
+from ..config import ANSWER_CACHE_ENABLED
+
+def _hit_result(hit):
+    return {
+        "cache_hit": True,
+        "answer": hit["answer"],
+        "sources": hit["sources"],
+        "docs": hit["docs"],
+    }
+
+def answer_cache_node(state):
+    if not ANSWER_CACHE_ENABLED:
+        return {"cache_hit": False}
+
+    rewritten = state.get("question_rewritten") or state["question"]
+    vector = get_embeddings().embed_query(rewritten)
+    hit = get_answer_cache().lookup(vector, get_index_fingerprint(state.get("collections")))
+    return _hit_result(hit) if hit else {"cache_hit": False}
+
+async def aanswer_cache_node(state):
+    if not ANSWER_CACHE_ENABLED:
+        return {"cache_hit": False}
+
+    rewritten = state.get("question_rewritten") or state["question"]
+    vector = await get_embeddings().aembed_query(rewritten)
+    hit = await asyncio.to_thread(get_answer_cache().lookup, vector, get_index_fingerprint(state.get("collections")))
+    return _hit_result(hit) if hit else {"cache_hit": False}
+
+def cache_answer_node(state):
+    if not ANSWER_CACHE_ENABLED or state.get("cache_hit") or not state.get("answer"):
+        return {}
+
+    rewritten = state.get("question_rewritten") or state["question"]
+    get_answer_cache().store(
+        rewritten,
+        get_embeddings().embed_query(rewritten),
+        get_index_fingerprint(state.get("collections")),
+        answer=state["answer"],
+        sources=state.get("sources") or [],
+        docs=state.get("docs") or [],
+    )
+    return {}
+
+async def acache_answer_node(state):
+    if not ANSWER_CACHE_ENABLED or state.get("cache_hit") or not state.get("answer"):
+        return {}
+
+    rewritten = state.get("question_rewritten") or state["question"]
+    vector = await get_embeddings().aembed_query(rewritten)
+    await asyncio.to_thread(
+        get_answer_cache().store,
+        rewritten,
+        vector,
+        get_index_fingerprint(state.get("collections")),
+        answer=state["answer"],
+        sources=state.get("sources") or [],
+        docs=state.get("docs") or [],
+    )
+    return {}
@@ -1,10 +1,10 @@
 from __future__ import annotations
-from ..resources import get_follow_llm
+from ..resources import get_chat_model
 from ..prompts.detect_followup import DETECT_FOLLOWUP_PROMPT
+from ..followup_classifier import get_followup_classifier, record_decision, LABELS
+from ..config import FOLLOWUP_FASTPATH_ENABLED, FOLLOWUP_FASTPATH_CONFIDENCE
 
-def detect_followup_node(state):
-    llm = get_follow_llm()
-
+def _build_prompt(state):
     history = ""
     if state.get("history"):
         history = "\n".join(
@@ -12,15 +12,44 @@ def detect_followup_node(state):
             for t in state["history"]
         )
 
-    prompt = DETECT_FOLLOWUP_PROMPT.format(
+    return DETECT_FOLLOWUP_PROMPT.format(
         history=history, 
         question=state["question"]
     )
 
-    out = llm.invoke(prompt)
-    label = getattr(out, "content", "").strip().lower()
-
+def _label_result(label):
     if label == "smalltalk":
         return {"skip_rag": True, "followup": False}
 
     return {"skip_rag": False, "followup": (label == "followup")}
+
+def _fast_path(state):
+    """Etiqueta del clasificador local si puede decidir sin el LLM, si no None."""
+    if not FOLLOWUP_FASTPATH_ENABLED:
+        return None
+    label = get_followup_classifier().fast_label(
+        state["question"], bool(state.get("history")), FOLLOWUP_FASTPATH_CONFIDENCE
+    )
+    if label is None:
+        return None
+    record_decision(label, "fastpath")
+    return label
+
+def _parse_label(out):
+    label = getattr(out, "content", "").strip().lower()
+    record_decision(label if label in LABELS else "standalone", "llm")
+    return label
+
+def detect_followup_node(state):
+    label = _fast_path(state)
+    if label is None:
+        llm = get_chat_model("followup")
+        label = _parse_label(llm.invoke(_build_prompt(state)))
+    return _label_result(label)
+
+async def adetect_followup_node(state):
+    label = _fast_path(state)
+    if label is None:
+        llm = get_chat_model("followup")
+        label = _parse_label(await llm.ainvoke(_build_prompt(state)))
+    return _label_result(label)
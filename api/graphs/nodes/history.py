@@ -1,18 +1,23 @@
 from __future__ import annotations
-from api.db.history import save_turn, load_history, get_summary, save_answer_meta
+import asyncio
+from api.db.history import load_history_with_summary
+from api.db.writer import get_turn_writer
+from ..background import get_task_queue
+from ..config import BACKGROUND_WAIT_SECONDS
 
 def load_history_node(state):
     session_id = state["session_id"]
-    hist = load_history(session_id, last_n=8)
-    summary = get_summary(session_id)
+    # el turno anterior puede seguir escribiéndose/resumiéndose en segundo plano
+    get_turn_writer().wait_session(session_id, BACKGROUND_WAIT_SECONDS)
+    get_task_queue().wait_idle(session_id, BACKGROUND_WAIT_SECONDS)
+    hist, summary = load_history_with_summary(session_id, last_n=8)
     return {"history": hist, "history_summary": summary or ""}
 
-def save_history_node(state):
-    sid = state["session_id"]
-    turn = save_turn(sid, "user", state["question"])
-    save_turn(sid, "assistant", state.get("answer", ""), turn=turn)
+async def aload_history_node(state):
+    # SQLite es bloqueante: se delega a un hilo para no frenar el event loop
+    return await asyncio.to_thread(load_history_node, state)
 
-    sources = state.get("sources") or []
+def _enqueue_turn(state):
     contexts = []
     for d in (state.get("docs") or []):
         try:
@@ -20,7 +25,22 @@ def save_history_node(state):
         except Exception:
             pass
 
-    if sources or contexts:
-        save_answer_meta(sid, turn, sources, contexts)
+    return get_turn_writer().save(
+        state["session_id"],
+        state["question"],
+        state.get("answer", ""),
+        state.get("sources") or [],
+        contexts,
+    )
+
+def save_history_node(state):
+    future = _enqueue_turn(state)
+    if get_turn_writer().mode == "sync":
+        future.result()
+    return {}
 
-    return {}
\ No newline at end of file
+async def asave_history_node(state):
+    future = _enqueue_turn(state)
+    if get_turn_writer().mode == "sync":
+        await asyncio.wrap_future(future)
+    return {}
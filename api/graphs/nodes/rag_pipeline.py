@@ -1,76 +1,113 @@
 from __future__ import annotations
-from ..resources import get_vectorstore, get_llm
-from ..config import TOP_K, MAX_CONTEXT_CHARS
+from ..resources import get_chat_model, get_embeddings, get_index_bundles
+from ..config import COMPRESSION_ENABLED
+from ..prompt_budget import pack_prompt, count_tokens
+from ..compression import compress_docs, record_compression
+from ..retrieval import retrieve_docs, aretrieve_docs, build_sources, speculative_hit
 from api.graphs.prompts.rag_answer import (
     RAG_ANSWER_SYSTEM_PROMPT,
     RAG_ANSWER_USER_PROMPT,
 )
 
-def _format_prompt(question, rewritten, docs, history_summary):
-    context_blocks = []
-    for i, d in enumerate(docs, 1):
-        content = d.page_content.strip()
-        if len(content) > MAX_CONTEXT_CHARS:
-            content = content[:MAX_CONTEXT_CHARS] + "\n[...]"
-
-        m = d.metadata or {}
-        header = f"(Fuente {i} | pág {m.get('page')} | cap {m.get('chapter')})"
-        context_blocks.append(f"{header}\n{content}")
-
-    context = "\n\n".join(context_blocks)
-    history_block = (
-        f"\n[Resumen de historial]\n{history_summary}\n"
-        if history_summary else ""
+def _build_prompt(state, docs):
+    """
+    Prompt dentro del presupuesto de tokens. Devuelve (prompt, docs que
+    entraron, tokens por sección); las fuentes citadas son solo esas.
+    """
+    return pack_prompt(
+        RAG_ANSWER_SYSTEM_PROMPT,
+        RAG_ANSWER_USER_PROMPT,
+        {
+            "question": state["question"],
+            "rewritten": state.get("question_rewritten") or state["question"],
+        },
+        docs or [],
+        history_summary=state.get("history_summary"),
+        history=state.get("history"),
     )
 
-    return (
-        RAG_ANSWER_SYSTEM_PROMPT
-        + "\n\n"
-        + RAG_ANSWER_USER_PROMPT.format(
-            question=question,
-            rewritten=rewritten,
-            history_block=history_block,
-            context=context
+def _sentence_indexes(state):
+    bundles = get_index_bundles(state.get("collections"))
+    return {name: b.sentences for name, b in bundles.items() if b.sentences is not None}
+
+def _pack(state, docs, query_vector=None, sentence_indexes=None):
+    """Comprime los chunks (si está activo) y arma el prompt con lo que entra."""
+    compression = None
+    if COMPRESSION_ENABLED and docs:
+        rewritten = state.get("question_rewritten") or state["question"]
+        compressed = compress_docs(rewritten, docs, query_vector, sentence_indexes)
+        compression = record_compression(
+            sum(count_tokens(d.page_content) for d in docs),
+            sum(count_tokens(d.page_content) for d in compressed),
         )
-    )
+        docs = compressed
 
-def rag_pipeline_node(state):
-    vs = get_vectorstore()
-    retriever = vs.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"k": TOP_K, "score_threshold": 0.25},
-    )
+    prompt, used, usage = _build_prompt(state, docs)
+    return {
+        "docs": used,
+        "sources": build_sources(used),
+        "prompt": prompt,
+        "prompt_tokens": usage,
+        "compression": compression,
+    }
+
+def _packed(state, docs):
+    indexes = _sentence_indexes(state) if COMPRESSION_ENABLED and docs else {}
+    # el vector de la consulta ya está en el cache de embeddings por la recuperación
+    query_vector = get_embeddings().embed_query(state.get("question_rewritten") or state["question"]) if indexes else None
+    return _pack(state, docs, query_vector, indexes)
+
+async def _apacked(state, docs):
+    indexes = _sentence_indexes(state) if COMPRESSION_ENABLED and docs else {}
+    query_vector = await get_embeddings().aembed_query(state.get("question_rewritten") or state["question"]) if indexes else None
+    return _pack(state, docs, query_vector, indexes)
 
+def _retrieve(state):
     rewritten = state.get("question_rewritten") or state["question"]
-    docs = retriever.invoke(rewritten)
+    docs = speculative_hit(state, rewritten)
+    return docs if docs is not None else retrieve_docs(rewritten, state.get("collections"))
 
-    if not docs:
-        docs = vs.similarity_search(rewritten, k=2)
+async def _aretrieve(state):
+    rewritten = state.get("question_rewritten") or state["question"]
+    docs = speculative_hit(state, rewritten)
+    return docs if docs is not None else await aretrieve_docs(rewritten, state.get("collections"))
 
-    prompt = _format_prompt(
-        question=state["question"],
-        rewritten=rewritten,
-        docs=docs or [],
-        history_summary=state.get("history_summary"),
-    )
+def speculative_retrieve_node(state):
+    """Recupera con la pregunta original, en paralelo a la detección de follow-up."""
+    return {"speculative_query": state["question"], "speculative_docs": retrieve_docs(state["question"], state.get("collections"))}
 
-    llm = get_llm()
-    out = llm.invoke(prompt)
-    answer = getattr(out, "content", str(out))
-
-    sources = []
-    for d in docs or []:
-        m = d.metadata or {}
-        sources.append({
-            "id": m.get("id"),
-            "page": m.get("page"),
-            "chapter": m.get("chapter"),
-            "section": m.get("section"),
-            "subsection": m.get("subsection"),
-        })
+async def aspeculative_retrieve_node(state):
+    docs = await aretrieve_docs(state["question"], state.get("collections"))
+    return {"speculative_query": state["question"], "speculative_docs": docs}
 
-    return {
-        "answer": answer,
-        "sources": sources,
-        "docs": docs,
-    }
+def retrieve_node(state):
+    return _packed(state, _retrieve(state))
+
+async def aretrieve_node(state):
+    return await _apacked(state, await _aretrieve(state))
+
+def rag_pipeline_node(state):
+    result = _packed(state, _retrieve(state))
+
+    llm = get_chat_model("answer")
+    out = llm.invoke(result["prompt"])
+    result["answer"] = getattr(out, "content", str(out))
+    return result
+
+async def arag_pipeline_node(state):
+    result = await _apacked(state, await _aretrieve(state))
+
+    llm = get_chat_model("answer")
+    out = await llm.ainvoke(result["prompt"])
+    result["answer"] = getattr(out, "content", str(out))
+    return result
+
+async def astream_rag_answer(state):
+    """Genera la respuesta token a token con el prompt que armó retrieve_node."""
+    prompt = state.get("prompt") or _build_prompt(state, state.get("docs"))[0]
+    llm = get_chat_model("answer")
+    # fuera del grafo no hay langgraph_node: el nodo de las métricas va explícito
+    async for chunk in llm.astream(prompt, config={"metadata": {"node": "rag_stream"}}):
+        token = getattr(chunk, "content", "")
+        if token:
+            yield token
@@ -1,13 +1,9 @@
 from __future__ import annotations
-from ..resources import get_llm
+from ..resources import get_chat_model
 from ..prompts.rewrite_query import REWRITE_QUERY_PROMPT
 
 
-def rewrite_query_node(state):
-    if not state.get("followup"):
-        return {"question_rewritten": state["question"], "history_used": False}
-
-    llm = get_llm()
+def _build_prompt(state):
     history_text = ""
     if state.get("history_summary"):
         history_text += f"[Resumen]\n{state['history_summary']}\n\n"
@@ -17,15 +13,31 @@ def rewrite_query_node(state):
             for t in state["history"]
         )
 
-    prompt = REWRITE_QUERY_PROMPT.format(
+    return REWRITE_QUERY_PROMPT.format(
         history_text=history_text,
         question=state["question"]
     )
 
-    out = llm.invoke(prompt)
+def _parse_rewrite(state, out):
     rewritten = getattr(out, "content", "").strip()
 
     return {
         "question_rewritten": rewritten,
         "history_used": rewritten != state["question"]
     }
+
+def rewrite_query_node(state):
+    if not state.get("followup"):
+        return {"question_rewritten": state["question"], "history_used": False}
+
+    llm = get_chat_model("rewrite")
+    out = llm.invoke(_build_prompt(state))
+    return _parse_rewrite(state, out)
+
+async def arewrite_query_node(state):
+    if not state.get("followup"):
+        return {"question_rewritten": state["question"], "history_used": False}
+
+    llm = get_chat_model("rewrite")
+    out = await llm.ainvoke(_build_prompt(state))
+    return _parse_rewrite(state, out)
@@ -1,13 +1,12 @@
 from __future__ import annotations
 from ..prompts.smalltalk import SMALLTALK_PROMPT
-from ..resources import get_llm
+from ..resources import get_chat_model
 
-def smalltalk_node(state):
-    llm = get_llm(temp=0.7)
-    text = state["question"]
-    prompt = SMALLTALK_PROMPT.format(text=text)
-    out = llm.invoke(prompt)
+def _smalltalk_llm():
+    # mismo modelo que las respuestas, con algo más de variedad
+    return get_chat_model("answer").bind(temperature=0.7)
 
+def _build_result(state, out):
     return {
         "skip_rag": True,
         "followup": False,
@@ -16,3 +15,23 @@ def smalltalk_node(state):
         "sources": [],
         "history_used": False
     }
+
+def smalltalk_node(state):
+    llm = _smalltalk_llm()
+    prompt = SMALLTALK_PROMPT.format(text=state["question"])
+    out = llm.invoke(prompt)
+    return _build_result(state, out)
+
+async def asmalltalk_node(state):
+    llm = _smalltalk_llm()
+    prompt = SMALLTALK_PROMPT.format(text=state["question"])
+    out = await llm.ainvoke(prompt)
+    return _build_result(state, out)
+
+async def astream_smalltalk_answer(state):
+    llm = _smalltalk_llm()
+    prompt = SMALLTALK_PROMPT.format(text=state["question"])
+    async for chunk in llm.astream(prompt, config={"metadata": {"node": "smalltalk_stream"}}):
+        token = getattr(chunk, "content", "")
+        if token:
+            yield token
@@ -1,31 +1,41 @@
 from __future__ import annotations
-from ..resources import get_llm
+from ..resources import get_chat_model
+from ..background import get_task_queue
 from api.db.history import upsert_summary
 from api.graphs.prompts.summarize_history import SUMMARIZE_HISTORY_PROMPT
-from ..config import MAX_CONTEXT_CHARS
+from ..config import SUMMARIZE_HISTORY_TOKENS
+from ..prompt_budget import count_tokens
 
-def summarize_history_node(state):
-    sid = state["session_id"]
-
-    total_chars = (
-        sum(len(x["message"]) for x in state.get("history", []))
-        + len(state.get("answer", ""))
+def _build_prompt(state):
+    total_tokens = (
+        sum(count_tokens(x["message"]) for x in state.get("history", []))
+        + count_tokens(state.get("answer", ""))
     )
 
-    if total_chars < MAX_CONTEXT_CHARS:
-        return {}
+    if total_tokens < SUMMARIZE_HISTORY_TOKENS:
+        return None
 
     raw = "\n".join(
         (("U: " + t["message"]) if t["role"] == "user" else ("A: " + t["message"]))
         for t in state.get("history", [])
     )
+    return SUMMARIZE_HISTORY_PROMPT.format(conversation=raw)
 
-    llm = get_llm()
-    prompt = SUMMARIZE_HISTORY_PROMPT.format(conversation=raw)
-    out = llm.invoke(prompt)
+def summarize_session(session_id, prompt):
+    llm = get_chat_model("summarize")
+    # corre en la cola de fondo, fuera del grafo
+    out = llm.invoke(prompt, config={"metadata": {"node": "summarize_history"}})
 
     summary = getattr(out, "content", "").strip()
     if summary:
-        upsert_summary(sid, summary)
+        upsert_summary(session_id, summary)
+
+def summarize_history_node(state):
+    """Encola el resumen; el resultado lo toma load_history en el turno siguiente."""
+    prompt = _build_prompt(state)
+    if prompt is not None:
+        get_task_queue().submit_summary(state["session_id"], summarize_session, state["session_id"], prompt)
+    return {}
 
-    return {"history_summary": summary}
+async def asummarize_history_node(state):
+    return summarize_history_node(state)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import re
+import threading
+from functools import lru_cache
+from .compression import strip_metadata_header
+from .providers import build_tokenizer, provider_spec
+from .config import (
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKEN_BUDGETS,
+    HISTORY_SUMMARY_MAX_TOKENS,
+    RECENT_TURNS_MAX_TOKENS,
+    MAX_CHUNK_TOKENS,
+    MIN_CHUNK_TOKENS,
+)
+
+SECTIONS = ("system", "question", "summary", "recent_turns", "context")
+TRUNCATION_MARK = "\n[...]"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_USAGE_LOCK = threading.Lock()
+_USAGE = {"prompts": 0, "tokens": dict.fromkeys(SECTIONS + ("total",), 0),
+          "chunks_truncated": 0, "chunks_dropped": 0}
+
+@lru_cache(maxsize=None)
+def _answer_model():
+    # se resuelve en el primer uso, después de que la app cargó el .env
+    return provider_spec("answer")["model"]
+
+@lru_cache(maxsize=None)
+def get_encoding(model=None):
+    # el backend del rol answer decide: tiktoken para OpenAI, aproximado para local
+    return build_tokenizer("answer", **({"model": model} if model else {}))
+
+def count_tokens(text, model=None):
+    return len(get_encoding(model).encode(text, disallowed_special=())) if text else 0
+
+def token_budget(model=None):
+    return PROMPT_TOKEN_BUDGETS.get(model or _answer_model(), PROMPT_TOKEN_BUDGET)
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    """
+    Recorta text a max_tokens cortando en fin de oración. Si ni la primera
+    oración entra, se corta por tokens. Devuelve (texto, recortado).
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text, False
+    limit = max_tokens - count_tokens(TRUNCATION_MARK, model)
+    if limit <= 0:
+        return "", True
+
+    kept, used = [], 0
+    for sentence in _SENTENCE_END.split(text):
+        # +1 por el espacio que las vuelve a unir
+        cost = count_tokens(sentence, model) + 1
+        if used + cost > limit:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return " ".join(kept) + TRUNCATION_MARK, True
+
+    encoding = get_encoding(model)
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:limit]) + TRUNCATION_MARK, True
+
+def _turn(t):
+    return ("U: " if t["role"] == "user" else "A: ") + t["message"]
+
+def _recent_turns(history, max_tokens, model):
+    """Los turnos más recientes que entran completos en max_tokens, en orden cronológico."""
+    selected, used = [], 0
+    for t in reversed(history or []):
+        line = _turn(t)
+        cost = count_tokens(line, model) + 1
+        if used + cost > max_tokens:
+            break
+        selected.append(line)
+        used += cost
+    return selected[::-1]
+
+def _record(usage):
+    with _USAGE_LOCK:
+        _USAGE["prompts"] += 1
+        for section in SECTIONS + ("total",):
+            _USAGE["tokens"][section] += usage[section]
+        _USAGE["chunks_truncated"] += usage["chunks_truncated"]
+        _USAGE["chunks_dropped"] += usage["chunks_dropped"]
+
+def pack_prompt(system, template, fields, docs, history_summary=None, history=None, model=None):
+    """
+    Arma el prompt de respuesta dentro del presupuesto de tokens del modelo.
+
+    Por prioridad: system prompt, pregunta y plantilla (siempre), resumen del
+    historial (hasta HISTORY_SUMMARY_MAX_TOKENS), últimos turnos (hasta
+    RECENT_TURNS_MAX_TOKENS) y los chunks en el orden del ranking con lo que
+    queda. Un chunk que no entra completo se corta en fin de oración; los
+    siguientes se descartan.
+
+    template recibe fields más {history_block} y {context}. Devuelve
+    (prompt, docs incluidos, tokens por sección).
+    """
+    budget = token_budget(model)
+    base = system + "\n\n" + template.format(**fields, history_block="", context="")
+    fixed = count_tokens(base, model)
+    remaining = budget - fixed
+
+    summary, _ = truncate_to_tokens(history_summary or "", max(0, min(HISTORY_SUMMARY_MAX_TOKENS, remaining)), model)
+    history_block = f"\n[Resumen de historial]\n{summary}\n" if summary else ""
+    remaining -= count_tokens(history_block, model)
+
+    turns = _recent_turns(history, max(0, min(RECENT_TURNS_MAX_TOKENS, remaining)), model)
+    turns_block = "\n[Últimos turnos]\n" + "\n".join(turns) + "\n" if turns else ""
+    remaining -= count_tokens(turns_block, model)
+
+    blocks, included, truncated = [], [], 0
+    for d in docs:
+        m = d.metadata or {}
+        header = f"(Fuente {len(blocks) + 1} | pág {m.get('page')} | cap {m.get('chapter')})\n"
+        available = min(MAX_CHUNK_TOKENS, remaining - count_tokens(header, model) - 1)
+        if available < MIN_CHUNK_TOKENS:
+            break
+        content, cut = truncate_to_tokens(strip_metadata_header(d.page_content), available, model)
+        block = header + content
+        blocks.append(block)
+        included.append(d)
+        truncated += cut
+        remaining -= count_tokens(block, model) + 1
+
+    context = "\n\n".join(blocks)
+    prompt = system + "\n\n" + template.format(**fields, history_block=history_block + turns_block, context=context)
+
+    usage = {
+        "system": count_tokens(system, model),
+        "question": fixed - count_tokens(system, model),
+        "summary": count_tokens(history_block, model),
+        "recent_turns": count_tokens(turns_block, model),
+        "context": count_tokens(context, model),
+        "total": count_tokens(prompt, model),
+        "budget": budget,
+        "chunks_included": len(included),
+        "chunks_truncated": truncated,
+        "chunks_dropped": len(docs) - len(included),
+    }
+    _record(usage)
+    return prompt, included, usage
+
+def prompt_stats():
+    with _USAGE_LOCK:
+        n = _USAGE["prompts"]
+        return {
+            "prompts": n,
+            "avg_tokens": {s: round(v / n, 1) if n else 0.0 for s, v in _USAGE["tokens"].items()},
+            "chunks_truncated": _USAGE["chunks_truncated"],
+            "chunks_dropped": _USAGE["chunks_dropped"],
+            "budget": token_budget(),
+        }
@@ -0,0 +1,98 @@
+# Ejemplos semilla para entrenar el clasificador local de detect_followup.
+# (mensaje, hay_historial, etiqueta)
+FOLLOWUP_EXAMPLES = [
+    ("hola", False, "smalltalk"),
+    ("hola!", True, "smalltalk"),
+    ("buenas tardes", False, "smalltalk"),
+    ("buen día, cómo estás?", False, "smalltalk"),
+    ("qué tal?", True, "smalltalk"),
+    ("gracias", True, "smalltalk"),
+    ("muchas gracias!", True, "smalltalk"),
+    ("genial, gracias", True, "smalltalk"),
+    ("ok, gracias", True, "smalltalk"),
+    ("gracias, quedó claro", True, "smalltalk"),
+    ("chau", True, "smalltalk"),
+    ("adiós, hasta luego", True, "smalltalk"),
+    ("hi there", False, "smalltalk"),
+    ("hello", False, "smalltalk"),
+    ("thanks a lot", True, "smalltalk"),
+    ("thank you", True, "smalltalk"),
+    ("bye", True, "smalltalk"),
+    ("¿cómo andás?", False, "smalltalk"),
+    ("todo bien?", False, "smalltalk"),
+    ("¿cómo te llamás?", False, "smalltalk"),
+    ("¿sos un bot?", True, "smalltalk"),
+    ("¿qué sabés hacer?", False, "smalltalk"),
+    ("contame un chiste", True, "smalltalk"),
+    ("what's your name?", False, "smalltalk"),
+    ("¿Qué es el modelo de regresión lineal simple?", False, "standalone"),
+    ("¿Qué es el método bootstrap y para qué sirve?", True, "standalone"),
+    ("¿En qué se diferencian LDA y QDA?", True, "standalone"),
+    ("¿Cómo funciona la validación cruzada k-fold?", False, "standalone"),
+    ("Explicame qué es el R² ajustado", True, "standalone"),
+    ("¿Qué supuestos tiene la regresión logística?", True, "standalone"),
+    ("Definí multicolinealidad", False, "standalone"),
+    ("¿Cuál es la ecuación de la regresión ridge?", True, "standalone"),
+    ("¿Qué es un término de interacción en un modelo lineal?", True, "standalone"),
+    ("¿Cómo se estima beta uno por mínimos cuadrados?", False, "standalone"),
+    ("What is the bias-variance trade-off?", False, "standalone"),
+    ("How does k-nearest neighbors classify a point?", True, "standalone"),
+    ("What is the difference between lasso and ridge regression?", True, "standalone"),
+    ("Explain the naive Bayes classifier", False, "standalone"),
+    ("¿Qué mide el error estándar de un coeficiente?", True, "standalone"),
+    ("¿Qué es LDA?", True, "standalone"),
+    ("What is PCA?", True, "standalone"),
+    ("qué es el lasso", False, "standalone"),
+    ("What are splines?", True, "standalone"),
+    ("¿Qué son los residuos?", True, "standalone"),
+    ("¿Y eso por qué pasa?", True, "followup"),
+    ("explicame mejor", True, "followup"),
+    ("¿y un ejemplo?", True, "followup"),
+    ("dame otro ejemplo", True, "followup"),
+    ("contame más", True, "followup"),
+    ("sí", True, "followup"),
+    ("dale", True, "followup"),
+    ("ok, mostrame", True, "followup"),
+    ("continuá", True, "followup"),
+    ("perfecto, seguí", True, "followup"),
+    ("¿y cómo se interpreta?", True, "followup"),
+    ("¿y en el caso de QDA?", True, "followup"),
+    ("¿por qué?", True, "followup"),
+    ("¿y qué pasa si no se cumple?", True, "followup"),
+    ("¿eso aplica también a la logística?", True, "followup"),
+    ("¿cómo se calcula eso?", True, "followup"),
+    ("más detalle sobre lo anterior", True, "followup"),
+    ("what about QDA?", True, "followup"),
+    ("tell me more", True, "followup"),
+    ("why is that?", True, "followup"),
+    ("can you give an example of it?", True, "followup"),
+    ("yes please", True, "followup"),
+    ("and how is it computed?", True, "followup"),
+]
+
+# Ejemplos que NO se usan para entrenar: con ellos se mide si las decisiones
+# del fast path (confianza >= FOLLOWUP_FASTPATH_CONFIDENCE) son confiables.
+FOLLOWUP_HOLDOUT = [
+    ("¿cómo estás?", False, "smalltalk"),
+    ("qué tal?", False, "smalltalk"),
+    ("¿quién sos?", False, "smalltalk"),
+    ("¿qué podés hacer?", False, "smalltalk"),
+    ("cuéntame un chiste", False, "smalltalk"),
+    ("buenas noches", True, "smalltalk"),
+    ("gracias, muy claro", True, "smalltalk"),
+    ("who are you?", False, "smalltalk"),
+    ("What is QDA?", True, "standalone"),
+    ("¿Qué es QDA?", True, "standalone"),
+    ("¿Qué es la regresión polinómica?", False, "standalone"),
+    ("¿Cómo se interpreta el p-valor de un coeficiente?", True, "standalone"),
+    ("Explicame el método de k-medias", True, "standalone"),
+    ("What is cross-validation used for?", False, "standalone"),
+    ("¿Qué diferencia hay entre sesgo y varianza?", True, "standalone"),
+    ("¿y eso cómo se calcula?", True, "followup"),
+    ("dame un ejemplo", True, "followup"),
+    ("¿por qué pasa eso?", True, "followup"),
+    ("seguí", True, "followup"),
+    ("¿y con ridge?", True, "followup"),
+    ("more details please", True, "followup"),
+    ("what about lasso?", True, "followup"),
+]
@@ -0,0 +1,154 @@
+"""
+Registro de backends de modelos. Cada rol (answer, followup, rewrite,
+summarize, embed, evaluate) se resuelve a un backend según MODEL_PROVIDERS en
+config.py, con overrides por entorno:
+
+    MODEL_PROVIDER=local                                   todos los roles sin red
+    MODEL_PROVIDER_FOLLOWUP=openai_compatible:qwen2.5:3b   un rol, con modelo
+
+Backends incluidos: "openai", "openai_compatible" (servidores locales con la
+API de OpenAI) y "local" (local_models.py). Se agregan otros con
+register_backend.
+
+Cada backend elige también cómo se cuentan los tokens (build_tokenizer):
+tiktoken para OpenAI y un tokenizador aproximado para "local", de modo que
+el grafo y el build del índice corren sin descargar nada.
+"""
+from __future__ import annotations
+import os
+import threading
+from functools import lru_cache
+import tiktoken
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from .config import MODEL_PROVIDERS, OPENAI_COMPATIBLE_BASE_URL, LOCAL_EMBEDDING_DIMS
+from .local_models import ApproxTokenizer, CannedChatModel, HashingEmbeddings
+from api.monitoring.metrics import llm_callbacks
+
+ROLES = ("answer", "followup", "rewrite", "summarize", "embed", "evaluate")
+
+_BACKENDS = {}
+
+class UnknownBackend(ValueError):
+    pass
+
+def register_backend(name, chat=None, embeddings=None, tokenizer=None):
+    """
+    chat(spec) devuelve un BaseChatModel, embeddings(spec) un Embeddings y
+    tokenizer(spec) un objeto con encode/encode_batch/decode como
+    tiktoken.Encoding; spec es el dict del rol (backend, model y parámetros
+    extra). Sin tokenizer se usa tiktoken, con el aproximado como respaldo.
+    """
+    _BACKENDS[name] = {"chat": chat, "embeddings": embeddings, "tokenizer": tokenizer}
+
+def _env_override(role):
+    value = os.getenv(f"MODEL_PROVIDER_{role.upper()}") or os.getenv("MODEL_PROVIDER")
+    if not value:
+        return {}
+    backend, _, model = value.partition(":")
+    return {"backend": backend, "model": model} if model else {"backend": backend}
+
+def provider_spec(role):
+    """Configuración efectiva del rol: MODEL_PROVIDERS más los overrides del entorno."""
+    if role not in ROLES:
+        raise ValueError(f"Rol de modelo desconocido: {role} (válidos: {', '.join(ROLES)})")
+    spec = {**MODEL_PROVIDERS[role], **_env_override(role)}
+    if spec["backend"] not in _BACKENDS:
+        raise UnknownBackend(f"Backend desconocido para {role}: {spec['backend']} (disponibles: {', '.join(_BACKENDS)})")
+    return spec
+
+def model_id(spec):
+    """
+    Identifica el modelo en caches, fingerprints del índice y métricas. Los de
+    OpenAI conservan el nombre solo, para no invalidar lo ya guardado.
+    """
+    return spec["model"] if spec["backend"] == "openai" else f"{spec['backend']}:{spec['model']}"
+
+def embedding_model_id(model=None):
+    """model_id del rol embed, opcionalmente con otro modelo del mismo backend (--model de los scripts)."""
+    spec = provider_spec("embed")
+    return model_id({**spec, "model": model or spec["model"]})
+
+def _factory(spec, kind, role):
+    factory = _BACKENDS[spec["backend"]][kind]
+    if factory is None:
+        raise UnknownBackend(f"El backend {spec['backend']} no provee {kind} (rol {role}).")
+    return factory
+
+def build_chat_model(role, **overrides):
+    """Chat model del rol, con las métricas de api/monitoring ya conectadas."""
+    spec = {**provider_spec(role), **overrides}
+    return _factory(spec, "chat", role)(spec)
+
+def build_embeddings(role="embed", **overrides):
+    spec = {**provider_spec(role), **overrides}
+    return _factory(spec, "embeddings", role)(spec)
+
+def build_tokenizer(role, **overrides):
+    """Tokenizador para contar los tokens que ve el modelo del rol; se comparte por backend y modelo."""
+    spec = {**provider_spec(role), **overrides}
+    return _tokenizer(spec["backend"], spec["model"])
+
+@lru_cache(maxsize=None)
+def _tokenizer(backend, model):
+    factory = _BACKENDS[backend]["tokenizer"] or _tiktoken_tokenizer
+    return factory({"backend": backend, "model": model})
+
+_TIKTOKEN_WARNED = threading.Event()
+
+def _tiktoken_tokenizer(spec):
+    try:
+        try:
+            return tiktoken.encoding_for_model(spec["model"])
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # sin red tiktoken no puede bajar el BPE (salvo que esté en TIKTOKEN_CACHE_DIR)
+        if not _TIKTOKEN_WARNED.is_set():
+            _TIKTOKEN_WARNED.set()
+            print(f"[pid {os.getpid()}] tiktoken no disponible ({type(e).__name__}: {e}); se cuentan tokens de forma aproximada.", flush=True)
+        return ApproxTokenizer()
+
+def _require_api_key():
+    if not os.getenv("OPENAI_API_KEY"):
+        raise RuntimeError("Falta OPENAI_API_KEY en el entorno.")
+
+def _openai_kwargs(spec):
+    kwargs = {"max_retries": spec.get("max_retries", 2)}
+    if spec["backend"] == "openai_compatible":
+        kwargs["base_url"] = spec.get("base_url") or os.getenv("OPENAI_COMPATIBLE_BASE_URL", OPENAI_COMPATIBLE_BASE_URL)
+        # la mayoría de los servidores locales no valida la clave, pero el cliente exige una
+        kwargs["api_key"] = os.getenv(spec.get("api_key_env", "OPENAI_COMPATIBLE_API_KEY")) or "not-needed"
+    else:
+        _require_api_key()
+    return kwargs
+
+def _openai_chat(spec):
+    model_kwargs = {"response_format": {"type": "json_object"}} if spec.get("json_mode") else {}
+    return ChatOpenAI(
+        model=spec["model"],
+        temperature=spec.get("temperature", 0),
+        model_kwargs=model_kwargs,
+        callbacks=llm_callbacks(),
+        stream_usage=True,
+        **_openai_kwargs(spec),
+    )
+
+def _openai_embeddings(spec):
+    kwargs = _openai_kwargs(spec)
+    if spec["backend"] == "openai_compatible":
+        # los servidores locales esperan texto, no los ids de tiktoken que manda el cliente por defecto
+        kwargs["check_embedding_ctx_length"] = False
+    return OpenAIEmbeddings(model=spec["model"], **kwargs)
+
+def _local_chat(spec):
+    return CannedChatModel(model_name=model_id(spec), callbacks=llm_callbacks())
+
+def _local_embeddings(spec):
+    return HashingEmbeddings(dims=spec.get("dims", LOCAL_EMBEDDING_DIMS))
+
+def _local_tokenizer(spec):
+    return ApproxTokenizer()
+
+register_backend("openai", chat=_openai_chat, embeddings=_openai_embeddings)
+register_backend("openai_compatible", chat=_openai_chat, embeddings=_openai_embeddings)
+register_backend("local", chat=_local_chat, embeddings=_local_embeddings, tokenizer=_local_tokenizer)
@@ -0,0 +1,70 @@
+"""
+Manejo de rate limits compartido por los procesos que llaman en paralelo a
+los proveedores de modelos (embeddings del índice, evaluación con RAGAS).
+"""
+from __future__ import annotations
+import asyncio
+import openai
+
+
+def is_rate_limit_error(e):
+    return isinstance(e, openai.RateLimitError) or getattr(e, "status_code", None) == 429
+
+def rate_limit_cause(e):
+    """
+    El rate limit dentro de la cadena de excepciones (__cause__/__context__),
+    o None. Librerías como ragas o tenacity envuelven el error del cliente,
+    que es el que trae el Retry-After.
+    """
+    while e is not None:
+        if is_rate_limit_error(e):
+            return e
+        e = e.__cause__ or e.__context__
+    return None
+
+def retry_after(e):
+    """Segundos del header Retry-After del error, si el cliente los expone."""
+    response = getattr(e, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Semáforo con límite variable (AIMD): ante un rate limit se reduce a la
+    mitad y se recupera de a uno tras varias respuestas exitosas seguidas.
+    """
+
+    def __init__(self, max_concurrency, recover_after=5):
+        self.max = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.recover_after = recover_after
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def on_success(self):
+        async with self._cond:
+            self._successes += 1
+            if self._successes >= self.recover_after and self.limit < self.max:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    async def on_rate_limit(self):
+        async with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
@@ -1,48 +1,136 @@
 from __future__ import annotations
+import hashlib
 import os
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from .config import FAISS_DIR, EMBEDDING_MODEL, LLM_MODEL, FOLLOWUP_MODEL
+import time
+from .config import (
+    FAISS_DIR,
+    ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS,
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH,
+    FAISS_NPROBE, FAISS_EF_SEARCH,
+    COLLECTIONS_DIR, COLLECTIONS_MEMORY_BUDGET_MB,
+    COMPRESSION_ENABLED,
+)
+from .answer_cache import SemanticAnswerCache
+from .embedding_cache import CachedEmbeddings
+from .faiss_index import apply_search_params, enable_reconstruct
+from .index_store import load_index_store, index_format, process_rss_mb
+from .bm25 import BM25Index, BM25_FILE
+from .compression import SentenceIndex, SENTENCES_FILE
+from .index_manager import IndexBundle
+from .collection_registry import CollectionRegistry, DEFAULT_COLLECTION
+from .providers import build_chat_model, build_embeddings, provider_spec, model_id
 
-_VECTORSTORE = None
+_COLLECTIONS = None
+_ANSWER_CACHE = None
 _EMBEDDINGS = None
-_LLM = None
-_FOLLOW_LLM = None
-
-def _require_api_key():
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("Falta OPENAI_API_KEY en el entorno.")
+_CHAT_MODELS = {}
 
 def get_embeddings():
     global _EMBEDDINGS
     if _EMBEDDINGS is None:
-        _require_api_key()
-        _EMBEDDINGS = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+        _EMBEDDINGS = CachedEmbeddings(
+            build_embeddings("embed"),
+            model=model_id(provider_spec("embed")),
+            max_items=EMBEDDING_CACHE_SIZE,
+            store_path=EMBEDDING_CACHE_PATH,
+        )
     return _EMBEDDINGS
 
-def get_vectorstore():
-    global _VECTORSTORE
-    if _VECTORSTORE is None:
-        embeddings = get_embeddings()
-        if not FAISS_DIR.exists():
-            raise FileNotFoundError(f"No existe el directorio del índice: {FAISS_DIR}")
-        _VECTORSTORE = FAISS.load_local(
-            str(FAISS_DIR),
-            embeddings,
-            allow_dangerous_deserialization=True,
+def _compute_index_fingerprint(index_dir):
+    h = hashlib.sha1(f"{model_id(provider_spec('embed'))}|{model_id(provider_spec('answer'))}".encode())
+    for f in sorted(p for p in index_dir.iterdir() if p.is_file()):
+        st = f.stat()
+        h.update(f"{f.name}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+def _index_disk_mb(path):
+    # con mmap, lo que la colección ocupa en page cache está acotado por sus archivos
+    return round(sum(f.stat().st_size for f in path.iterdir() if f.is_file()) / 2**20, 2)
+
+def _load_index_bundle(collection, version, path):
+    embeddings = get_embeddings()
+    if not path.exists():
+        raise FileNotFoundError(f"No existe el directorio del índice: {path}")
+    fingerprint = _compute_index_fingerprint(path)
+    rss_before = process_rss_mb()
+    started = time.perf_counter()
+    vectorstore = load_index_store(path, embeddings)
+    # nprobe / efSearch no se persisten con el índice: se aplican al cargar
+    apply_search_params(vectorstore.index, FAISS_NPROBE, FAISS_EF_SEARCH)
+    # el re-ranking MMR lee los vectores guardados en el índice
+    enable_reconstruct(vectorstore.index)
+    bm25_path = path / BM25_FILE
+    bm25 = BM25Index.load(bm25_path) if bm25_path.exists() else None
+    sentences_path = path / SENTENCES_FILE
+    if COMPRESSION_ENABLED and not sentences_path.exists():
+        # sin vectores la compresión se degradaría en silencio a scoring léxico
+        raise RuntimeError(
+            f"COMPRESSION_ENABLED está activo pero el índice {collection}@{version} no tiene {SENTENCES_FILE}: "
+            "reconstruirlo con --sentence-vectors o apagar la compresión."
         )
-    return _VECTORSTORE
-
-def get_llm(temp: float = 0.0):
-    global _LLM
-    if _LLM is None:
-        _require_api_key()
-        _LLM = ChatOpenAI(model=LLM_MODEL, temperature=temp)
-    return _LLM
-
-def get_follow_llm():
-    global _FOLLOW_LLM
-    if _FOLLOW_LLM is None:
-        _require_api_key()
-        _FOLLOW_LLM = ChatOpenAI(model=FOLLOWUP_MODEL, temperature=0)
-    return _FOLLOW_LLM
+    sentences = SentenceIndex.load(sentences_path) if sentences_path.exists() else None
+    stats = {
+        "format": index_format(path),
+        "vectors": vectorstore.index.ntotal,
+        "sentence_vectors": 0 if sentences is None else len(sentences.vectors),
+        "disk_mb": _index_disk_mb(path),
+        "load_seconds": round(time.perf_counter() - started, 4),
+        "rss_mb": process_rss_mb(),
+        "rss_delta_mb": None if rss_before is None else round(process_rss_mb() - rss_before, 1),
+    }
+    print(
+        f"[pid {os.getpid()}] Índice FAISS {collection}@{version} cargado ({stats['format']}, "
+        f"{stats['vectors']} vectores) en {stats['load_seconds']}s, "
+        f"RSS {stats['rss_mb']} MB (+{stats['rss_delta_mb']} MB)",
+        flush=True,
+    )
+    return IndexBundle(version, path, vectorstore, bm25, fingerprint, stats, sentences)
+
+def get_collection_registry():
+    global _COLLECTIONS
+    if _COLLECTIONS is None:
+        _COLLECTIONS = CollectionRegistry(
+            FAISS_DIR,
+            COLLECTIONS_DIR,
+            _load_index_bundle,
+            memory_budget_mb=COLLECTIONS_MEMORY_BUDGET_MB,
+        )
+    return _COLLECTIONS
+
+def get_index_bundles(collections=None):
+    """{colección: IndexBundle} en uso para las colecciones pedidas (por defecto "default")."""
+    registry = get_collection_registry()
+    return registry.active(registry.resolve(collections))
+
+def get_vectorstore(collection=DEFAULT_COLLECTION):
+    return get_index_bundles([collection])[collection].vectorstore
+
+def get_vectorstore_stats():
+    """Colecciones cargadas con su versión, formato, tiempo de carga y memoria."""
+    return get_collection_registry().stats()
+
+def get_index_fingerprint(collections=None):
+    """Identifica los índices en uso; cambia cada vez que alguno se reconstruye."""
+    bundles = get_index_bundles(collections)
+    if list(bundles) == [DEFAULT_COLLECTION]:
+        return bundles[DEFAULT_COLLECTION].fingerprint
+    key = "|".join(f"{name}:{b.fingerprint}" for name, b in sorted(bundles.items()))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def get_answer_cache():
+    global _ANSWER_CACHE
+    if _ANSWER_CACHE is None:
+        _ANSWER_CACHE = SemanticAnswerCache(
+            ANSWER_CACHE_PATH,
+            threshold=ANSWER_CACHE_THRESHOLD,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        )
+    return _ANSWER_CACHE
+
+def get_chat_model(role):
+    """Chat model del rol (answer, followup, rewrite, summarize) según providers.py."""
+    model = _CHAT_MODELS.get(role)
+    if model is None:
+        model = _CHAT_MODELS[role] = build_chat_model(role)
+    return model
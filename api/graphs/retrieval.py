@@ -0,0 +1,218 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from api.monitoring.metrics import timed_retrieval, record_retrieval
+from .resources import get_index_bundles, get_embeddings
+from .index_store import docstore_positions
+from .config import (
+    TOP_K, SCORE_THRESHOLD,
+    HYBRID_RETRIEVAL, DENSE_CANDIDATES, LEXICAL_CANDIDATES, RRF_K, DENSE_WEIGHT, LEXICAL_WEIGHT,
+    MMR_ENABLED, MMR_LAMBDA, MMR_FETCH_K,
+)
+
+_MMR_LOCK = threading.Lock()
+_MMR_STATS = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0}
+_SHARD_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shard")
+
+def _candidate_count():
+    return max(TOP_K, MMR_FETCH_K) if MMR_ENABLED else TOP_K
+
+def _dense_k():
+    return max(DENSE_CANDIDATES, _candidate_count()) if HYBRID_RETRIEVAL else _candidate_count()
+
+def _doc_id(doc):
+    return doc.id or (doc.metadata or {}).get("id")
+
+def _tag(collection, doc):
+    doc.metadata = {**(doc.metadata or {}), "collection": collection}
+    return doc
+
+def _search_shard(collection, bundle, query):
+    """Candidatos de una colección: densos (doc, score) y léxicos (id, score)."""
+    dense = bundle.vectorstore.similarity_search_with_relevance_scores(query, k=_dense_k())
+    lexical = bundle.bm25.search(query, LEXICAL_CANDIDATES) if HYBRID_RETRIEVAL and bundle.bm25 is not None else []
+    return collection, bundle, dense, lexical
+
+async def _asearch_shard(collection, bundle, query):
+    dense = await bundle.vectorstore.asimilarity_search_with_relevance_scores(query, k=_dense_k())
+    lexical = bundle.bm25.search(query, LEXICAL_CANDIDATES) if HYBRID_RETRIEVAL and bundle.bm25 is not None else []
+    return collection, bundle, dense, lexical
+
+def _merge(shards):
+    """
+    Une los resultados de todas las colecciones en una sola lista densa y una
+    léxica. Las claves son (colección, id) porque los ids de chunk se repiten
+    entre libros.
+
+    Solo los scores densos (coseno) son comparables entre colecciones. BM25
+    depende del IDF y del largo promedio de cada índice, así que una colección
+    chica inflaría sus scores: la lista léxica intercala por posición dentro de
+    cada colección y, a igual posición, desempata con el score relativo al
+    mejor de su colección.
+    """
+    dense, lexical, bundles = [], [], {}
+    for collection, bundle, d, lx in shards:
+        bundles[collection] = bundle
+        dense += [((collection, _doc_id(doc)), _tag(collection, doc), score) for doc, score in d]
+        top = max((score for _, score in lx), default=0.0)
+        lexical += [
+            (rank, score / top if top > 0 else 0.0, (collection, doc_id), score)
+            for rank, (doc_id, score) in enumerate(lx)
+        ]
+    dense.sort(key=lambda c: c[2], reverse=True)
+    lexical.sort(key=lambda c: (c[0], -c[1]))
+    return bundles, dense[:_dense_k()], [(key, score) for _, _, key, score in lexical[:LEXICAL_CANDIDATES]]
+
+def _fuse(bundles, dense, lexical):
+    """
+    Reciprocal rank fusion de los candidatos densos y léxicos. Son elegibles
+    los densos que superan SCORE_THRESHOLD y cualquier coincidencia léxica; el
+    ranking usa la posición en cada lista. Devuelve (clave, doc, score) ordenados.
+    """
+    fused, eligible, by_key = {}, set(), {}
+    for rank, (key, doc, score) in enumerate(dense):
+        by_key[key] = doc
+        fused[key] = fused.get(key, 0.0) + DENSE_WEIGHT / (RRF_K + rank + 1)
+        if score >= SCORE_THRESHOLD:
+            eligible.add(key)
+    for rank, (key, _) in enumerate(lexical):
+        fused[key] = fused.get(key, 0.0) + LEXICAL_WEIGHT / (RRF_K + rank + 1)
+        eligible.add(key)
+
+    ranked = []
+    for key in sorted(eligible, key=lambda k: fused[k], reverse=True)[:_candidate_count()]:
+        collection, doc_id = key
+        doc = by_key.get(key) or bundles[collection].vectorstore.docstore.search(doc_id)
+        if not isinstance(doc, str):
+            ranked.append((key, _tag(collection, doc), fused[key]))
+    return ranked
+
+def _rank(bundles, dense, lexical):
+    if lexical or (HYBRID_RETRIEVAL and any(b.bm25 is not None for b in bundles.values())):
+        return _fuse(bundles, dense, lexical)
+    return [c for c in dense if c[2] >= SCORE_THRESHOLD][:_candidate_count()]
+
+def mmr_select(vectors, relevance, k, lambda_mult):
+    """
+    Maximal Marginal Relevance vectorizado: en cada paso elige el candidato
+    que maximiza lambda·relevancia − (1−lambda)·máxima similitud coseno con
+    los ya elegidos. Devuelve los índices elegidos en orden.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    sim = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    max_sim = sim[selected[0]].copy()
+    for _ in range(min(k, len(vectors)) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        scores[selected] = -np.inf
+        j = int(np.argmax(scores))
+        selected.append(j)
+        np.maximum(max_sim, sim[j], out=max_sim)
+    return selected
+
+def _stored_vectors(bundles, ranked):
+    """Vectores de los candidatos leídos de cada índice FAISS; None si alguno no está."""
+    vectors = np.zeros((len(ranked), 0), dtype="float32")
+    by_collection = {}
+    for i, ((collection, doc_id), _, _) in enumerate(ranked):
+        by_collection.setdefault(collection, []).append((i, doc_id))
+    for collection, items in by_collection.items():
+        vs = bundles[collection].vectorstore
+        positions = docstore_positions(vs, [doc_id for _, doc_id in items])
+        if any(pos is None for pos in positions):
+            return None
+        found = vs.index.reconstruct_batch(np.array(positions, dtype="int64"))
+        if vectors.shape[1] == 0:
+            vectors = np.zeros((len(ranked), found.shape[1]), dtype="float32")
+        vectors[[i for i, _ in items]] = found
+    return vectors
+
+def _diversify(bundles, ranked):
+    """
+    Re-rankea los candidatos con MMR usando los vectores ya guardados en FAISS
+    (no se vuelve a embeber nada). La relevancia es el score de la etapa
+    anterior (coseno o RRF) relativo al mejor candidato.
+    """
+    if not MMR_ENABLED or len(ranked) <= TOP_K:
+        return [doc for _, doc, _ in ranked[:TOP_K]]
+
+    started = time.perf_counter()
+    vectors = _stored_vectors(bundles, ranked)
+    if vectors is None:
+        return [doc for _, doc, _ in ranked[:TOP_K]]
+
+    scores = np.array([s for _, _, s in ranked], dtype="float32")
+    top = float(scores.max())
+    relevance = scores / top if top > 0 else np.ones_like(scores)
+
+    chosen = mmr_select(vectors, relevance, TOP_K, MMR_LAMBDA)
+    elapsed = (time.perf_counter() - started) * 1000
+    with _MMR_LOCK:
+        _MMR_STATS["calls"] += 1
+        _MMR_STATS["total_ms"] += elapsed
+        _MMR_STATS["max_ms"] = max(_MMR_STATS["max_ms"], elapsed)
+    return [ranked[i][1] for i in chosen]
+
+def retrieval_stats():
+    with _MMR_LOCK:
+        calls = _MMR_STATS["calls"]
+        return {
+            "mmr_enabled": MMR_ENABLED,
+            "mmr_calls": calls,
+            "mmr_avg_ms": round(_MMR_STATS["total_ms"] / calls, 3) if calls else 0.0,
+            "mmr_max_ms": round(_MMR_STATS["max_ms"], 3),
+        }
+
+def _select(shards):
+    bundles, dense, lexical = _merge(shards)
+    docs = _diversify(bundles, _rank(bundles, dense, lexical))
+    # sin nada sobre el umbral se usan los mejores densos (fallback)
+    fallback = not docs
+    if fallback:
+        docs = [doc for _, doc, _ in dense[:2]]
+    record_retrieval(len(docs), fallback)
+    return docs
+
+def retrieve_docs(query, collections=None):
+    with timed_retrieval():
+        bundles = get_index_bundles(collections)
+        if len(bundles) == 1:
+            shards = [_search_shard(name, b, query) for name, b in bundles.items()]
+        else:
+            # la consulta se embebe una vez (queda en el cache) y cada colección se
+            # busca en paralelo; el merge es global por score
+            get_embeddings().embed_query(query)
+            shards = list(_SHARD_POOL.map(lambda item: _search_shard(*item, query), bundles.items()))
+        return _select(shards)
+
+async def aretrieve_docs(query, collections=None):
+    with timed_retrieval():
+        bundles = await asyncio.to_thread(get_index_bundles, collections)
+        if len(bundles) > 1:
+            await get_embeddings().aembed_query(query)
+        shards = await asyncio.gather(*(_asearch_shard(name, b, query) for name, b in bundles.items()))
+        return _select(shards)
+
+def speculative_hit(state, query):
+    """Docs de la recuperación especulativa si se hicieron sobre la misma consulta."""
+    if state.get("speculative_query") == query and state.get("speculative_docs") is not None:
+        return state["speculative_docs"]
+    return None
+
+def build_sources(docs):
+    sources = []
+    for d in docs or []:
+        m = d.metadata or {}
+        sources.append({
+            "id": m.get("id"),
+            "page": m.get("page"),
+            "chapter": m.get("chapter"),
+            "section": m.get("section"),
+            "subsection": m.get("subsection"),
+            "collection": m.get("collection"),
+        })
+    return sources
@@ -5,6 +5,7 @@ from langchain_core.documents import Document
 class RAGState(TypedDict, total=False):
     session_id: str
     question: str
+    collections: List[str]
     question_rewritten: str
     followup: bool
     skip_rag: bool
@@ -12,6 +13,11 @@ class RAGState(TypedDict, total=False):
     history_summary: Optional[str]
     docs: List[Document]
     prompt: str
+    prompt_tokens: Dict[str, int]
+    compression: Optional[Dict]
     answer: str
     sources: List[Dict]
     history_used: bool
+    cache_hit: bool
+    speculative_query: str
+    speculative_docs: List[Document]
@@ -0,0 +1,24 @@
+from __future__ import annotations
+from .nodes.rag_pipeline import astream_rag_answer
+from .nodes.smalltalk import astream_smalltalk_answer
+from .nodes.history import asave_history_node
+from .nodes.summarize_history import asummarize_history_node
+from .nodes.answer_cache import acache_answer_node
+
+async def _replay_cached(state):
+    yield state["answer"]
+
+def astream_answer(state):
+    """Elige el generador de tokens según lo que decidió el grafo de preparación."""
+    if state.get("cache_hit"):
+        return _replay_cached(state)
+    if state.get("skip_rag"):
+        return astream_smalltalk_answer(state)
+    return astream_rag_answer(state)
+
+async def apersist_turn(state):
+    """Guarda el turno y resume el historial una vez cerrado el stream."""
+    if not state.get("skip_rag"):
+        await acache_answer_node(state)
+    await asave_history_node(state)
+    await asummarize_history_node(state)
@@ -0,0 +1,30 @@
+from __future__ import annotations
+import re
+import unicodedata
+
+# letras de cualquier alfabeto (β, λ...) y dígitos; los subíndices ya
+# llegan como dígitos después de NFKD (β₁ → β1)
+_WORD = re.compile(r"[^\W_]+")
+
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes asi aun cada como con contra cual cuales cuando
+de del desde donde dos el ella ellas ellos en entre era es esa esas ese eso esos esta estan estas este
+esto estos fue fueron ha hay la las le les lo los mas me mi muy no nos o otra otro para pero por porque
+que se sea segun ser si sin sobre son su sus tambien tan te tiene tienen todo todos tu un una unas uno
+unos y ya
+about an and are as at be been but by can do does for from has have how if in into is it its not of on
+or such than that the their them then there these they this those to was were what when where which who
+why will with
+""".split())
+
+def strip_accents(text):
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+def tokenize(text):
+    """
+    Tokens para búsqueda léxica en español/inglés: minúsculas, sin tildes,
+    sin stopwords. Las siglas y términos técnicos (qda, bootstrap, β1) se
+    conservan tal cual.
+    """
+    return [t for t in _WORD.findall(strip_accents(text.lower())) if t not in STOPWORDS]
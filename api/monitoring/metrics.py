@@ -0,0 +1,196 @@
+"""
+Métricas Prometheus de la API (GET /metrics).
+
+Todo se registra con contadores e histogramas de prometheus_client, que
+cuestan del orden de un microsegundo por observación: no hay locks propios,
+colas ni I/O en el camino de cada request.
+
+Con varios procesos (uvicorn --workers / gunicorn) definir
+PROMETHEUS_MULTIPROC_DIR apuntando a un directorio vacío para que /metrics
+agregue los valores de todos los workers.
+"""
+from __future__ import annotations
+import functools
+import os
+import time
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+# de 5 ms a 30 s: cubre desde la búsqueda FAISS hasta una respuesta larga del LLM
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+NODE_SECONDS = Histogram(
+    "rag_graph_node_seconds", "Duración de cada nodo del grafo", ["node"], buckets=LATENCY_BUCKETS,
+)
+NODE_ERRORS = Counter(
+    "rag_graph_node_errors_total", "Nodos del grafo que terminaron con excepción", ["node"],
+)
+LLM_REQUESTS = Counter(
+    "rag_llm_requests_total", "Llamadas al LLM", ["model", "node", "status"],
+)
+LLM_SECONDS = Histogram(
+    "rag_llm_seconds", "Latencia de las llamadas al LLM", ["model", "node"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total", "Tokens de las llamadas al LLM", ["model", "node", "kind"],
+)
+RETRIEVAL_SECONDS = Histogram(
+    "rag_retrieval_seconds", "Duración de la recuperación (búsqueda densa + BM25 + fusión + MMR)",
+    buckets=LATENCY_BUCKETS,
+)
+RETRIEVAL_DOCS = Histogram(
+    "rag_retrieval_docs", "Documentos devueltos por la recuperación", buckets=(0, 1, 2, 3, 4, 6, 8, 12, 20),
+)
+RETRIEVAL_REQUESTS = Counter("rag_retrieval_requests_total", "Búsquedas realizadas")
+RETRIEVAL_FALLBACKS = Counter(
+    "rag_retrieval_fallback_total", "Búsquedas sin resultados sobre el umbral que usaron el fallback denso",
+)
+DB_SECONDS = Histogram(
+    "rag_db_seconds", "Duración de las operaciones SQLite del historial", ["op"], buckets=DB_BUCKETS,
+)
+
+def timed_node(func, afunc):
+    """Envuelve las versiones sync y async de un nodo con su histograma de latencia."""
+    # load_history_node → load_history
+    label = func.__name__.removesuffix("_node")
+    seconds = NODE_SECONDS.labels(label)
+    errors = NODE_ERRORS.labels(label)
+
+    @functools.wraps(func)
+    def sync(state):
+        started = time.perf_counter()
+        try:
+            return func(state)
+        except BaseException:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    @functools.wraps(afunc)
+    async def async_(state):
+        started = time.perf_counter()
+        try:
+            return await afunc(state)
+        except BaseException:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    return sync, async_
+
+@contextmanager
+def timed_retrieval():
+    """Mide una recuperación; el llamador informa los docs con record_retrieval."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - started)
+
+def record_retrieval(n_docs, fallback):
+    RETRIEVAL_REQUESTS.inc()
+    RETRIEVAL_DOCS.observe(n_docs)
+    if fallback:
+        RETRIEVAL_FALLBACKS.inc()
+
+def timed_db(op):
+    """Decorador para funciones de api/db: observa su duración en rag_db_seconds{op}."""
+    seconds = DB_SECONDS.labels(op)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+@contextmanager
+def timed_db_block(op):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_SECONDS.labels(op).observe(time.perf_counter() - started)
+
+def _usage(response):
+    """(prompt, completion) tokens de un LLMResult, de usage_metadata o de llm_output."""
+    for generations in response.generations:
+        for g in generations:
+            usage = getattr(getattr(g, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Callback de LangChain para los modelos de chat: cuenta llamadas, latencia
+    y tokens por modelo y por nodo del grafo. El nodo sale de la metadata que
+    LangGraph propaga (langgraph_node) o de metadata={"node": ...} en llamadas
+    fuera del grafo (streaming, resúmenes en segundo plano).
+    """
+
+    # se ejecuta en el mismo hilo/event loop, sin pasar por un executor
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, invocation_params=None, **kwargs):
+        metadata = metadata or {}
+        params = invocation_params or {}
+        model = params.get("model") or params.get("model_name") or (serialized or {}).get("kwargs", {}).get("model_name", "unknown")
+        node = metadata.get("node") or metadata.get("langgraph_node") or "unknown"
+        self._runs[run_id] = (model, node, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        model, node, started = run
+        LLM_SECONDS.labels(model, node).observe(time.perf_counter() - started)
+        LLM_REQUESTS.labels(model, node, "ok").inc()
+        prompt_tokens, completion_tokens = _usage(response)
+        if prompt_tokens:
+            LLM_TOKENS.labels(model, node, "prompt").inc(prompt_tokens)
+        if completion_tokens:
+            LLM_TOKENS.labels(model, node, "completion").inc(completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        model, node, started = run
+        LLM_SECONDS.labels(model, node).observe(time.perf_counter() - started)
+        LLM_REQUESTS.labels(model, node, "error").inc()
+
+_LLM_CALLBACK = LLMMetricsCallback()
+
+def llm_callbacks():
+    """Handlers para pasar como callbacks= al construir los modelos de chat."""
+    return [_LLM_CALLBACK]
+
+def render_metrics():
+    """(cuerpo, content type) en el formato de texto de Prometheus."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,14 +1,27 @@
 import argparse
+import hashlib
 import json
+from datetime import datetime
 from pathlib import Path
-from tqdm import tqdm
+import numpy as np
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_core.documents import Document
+from api.graphs.config import FAISS_DIR, EMBEDDING_CACHE_PATH, INDEX_KEEP_VERSIONS, COLLECTIONS_DIR, SENTENCE_VECTOR_DIMS, COMPRESSION_ENABLED
+from api.graphs.embedding_cache import CachedEmbeddings
+from api.graphs.providers import build_embeddings, build_tokenizer, embedding_model_id, provider_spec
+from api.graphs.faiss_index import INDEX_TYPES, create_index, supports_delete, load_build_meta, save_build_meta
+from api.graphs.index_store import INDEX_FILE, load_index_store, save_index_store
+from api.graphs.index_manager import resolve_current, new_version_dir, publish_version, prune_versions
+from api.graphs.bm25 import BM25Index, BM25_FILE
+from api.graphs.compression import SentenceIndex, SENTENCES_FILE
+from api.scripts.concurrent_embedder import ConcurrentEmbedder
 
 load_dotenv()
 
+API_DIR = Path(__file__).resolve().parents[1]
+
 def enrich_text_for_embedding(item):
     chapter = item.get("chapter") or "N/A"
     section = item.get("section") or "N/A"
@@ -23,63 +36,263 @@ def enrich_text_for_embedding(item):
     )
     return f"{meta}{item.get('text','').strip()}"
 
-def load_chunks(json_path, min_chars=30):
-    with open(json_path, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
-
-    docs = [
-        Document(
-            page_content=enrich_text_for_embedding(item),
-            metadata={
-                "id": item["id"],
-                "page": item.get("page"),
-                "chapter": item.get("chapter"),
-                "section": item.get("section"),
-                "subsection": item.get("subsection"),
-            }
-        )
-        for item in raw_data
-        if item.get("text") and len(item["text"].strip()) > min_chars
+def iter_chunk_items(path):
+    """Chunks de un .json (lista) o de un .jsonl (uno por línea, sin cargar todo el archivo)."""
+    with open(path, "r", encoding="utf-8") as f:
+        if str(path).endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+def chunk_to_document(item, min_chars=30):
+    """Document listo para embeber, o None si el chunk es demasiado corto."""
+    if not item.get("text") or len(item["text"].strip()) <= min_chars:
+        return None
+    text = enrich_text_for_embedding(item)
+    return Document(
+        page_content=text,
+        metadata={
+            "id": item["id"],
+            "page": item.get("page"),
+            "chapter": item.get("chapter"),
+            "section": item.get("section"),
+            "subsection": item.get("subsection"),
+            "content_hash": content_hash(text),
+        }
+    )
+
+def load_chunks(path, min_chars=30):
+    docs = (chunk_to_document(item, min_chars) for item in iter_chunk_items(path))
+    return [d for d in docs if d is not None]
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_documents(docs, embeddings, embedder, batch_size, progress=True):
+    """Toma del cache lo ya embebido y manda el resto al embedder concurrente, en orden."""
+    return embed_texts([d.page_content for d in docs], embeddings, embedder, batch_size, progress)
+
+def embed_texts(texts, embeddings, embedder, batch_size, progress=True):
+    vectors = embeddings.get_cached(texts)
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        fresh = embedder.embed([texts[i] for i in missing], batch_size, on_batch=embeddings.put, progress=progress)
+        for i, v in zip(missing, fresh):
+            vectors[i] = v
+    return vectors
+
+def build_full(docs, embeddings, embedder, batch_size, index_type="flat", index_params=None):
+    """
+    Embebe todos los chunks y arma el índice del tipo pedido. Los índices IVF
+    se entrenan con los mismos vectores antes de agregarlos.
+    Devuelve (vectorstore, conteos, parámetros usados del índice).
+    """
+    vectors = embed_documents(docs, embeddings, embedder, batch_size)
+    matrix = np.array(vectors, dtype="float32")
+    index, used_params = create_index(index_type, matrix.shape[1], matrix, index_params or {})
+    vectorstore = FAISS(embeddings, index, InMemoryDocstore(), {})
+    vectorstore.add_embeddings(
+        [(d.page_content, v) for d, v in zip(docs, vectors)],
+        metadatas=[d.metadata for d in docs],
+        ids=[d.metadata["id"] for d in docs],
+    )
+    return vectorstore, {"kept": 0, "added": len(docs), "deleted": 0}, used_params
+
+def plan_incremental(vectorstore, docs):
+    """
+    Compara el índice existente contra los chunks nuevos por id y content_hash.
+    Devuelve (ids a eliminar, docs a agregar) o None si el índice no es
+    compatible (fue construido sin ids de chunk o sin hashes).
+    """
+    existing = {}
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        doc = vectorstore.docstore.search(doc_id)
+        stored_hash = getattr(doc, "metadata", {}).get("content_hash")
+        if not stored_hash or doc.metadata.get("id") != doc_id:
+            return None
+        existing[doc_id] = stored_hash
+
+    new = {d.metadata["id"]: d for d in docs}
+    to_delete = [
+        doc_id for doc_id, h in existing.items()
+        if doc_id not in new or new[doc_id].metadata["content_hash"] != h
+    ]
+    to_add = [
+        d for doc_id, d in new.items()
+        if existing.get(doc_id) != d.metadata["content_hash"]
     ]
+    return to_delete, to_add
 
-    return docs
+def build_incremental(vectorstore, docs, embeddings, embedder, batch_size, index_type="flat"):
+    plan = plan_incremental(vectorstore, docs)
+    if plan is None:
+        return None
+    to_delete, to_add = plan
+    if to_delete and not supports_delete(index_type):
+        # sin borrado seguro en el índice: se reconstruye completo (los vectores salen del cache)
+        return None
+
+    if to_delete:
+        vectorstore.delete(to_delete)
+    if to_add:
+        vectors = embed_documents(to_add, embeddings, embedder, batch_size)
+        vectorstore.add_embeddings(
+            [(d.page_content, v) for d, v in zip(to_add, vectors)],
+            metadatas=[d.metadata for d in to_add],
+            ids=[d.metadata["id"] for d in to_add],
+        )
+
+    kept = len(vectorstore.index_to_docstore_id) - len(to_add)
+    return vectorstore, {"kept": kept, "added": len(to_add), "deleted": len(to_delete)}
+
+def build_sentence_index(vectorstore, embeddings, embedder, batch_size):
+    items = (
+        (doc_id, vectorstore.docstore.search(doc_id).page_content)
+        for doc_id in vectorstore.index_to_docstore_id.values()
+    )
+    return SentenceIndex.build(
+        items,
+        lambda texts: embed_texts(texts, embeddings, embedder, batch_size, progress=False),
+        SENTENCE_VECTOR_DIMS,
+    )
 
 def main():
     parser = argparse.ArgumentParser(description="Construye índice FAISS con embeddings OpenAI")
-    parser.add_argument("--input", type=str, default="data/processed/clean_chunks.json")
-    parser.add_argument("--output", type=str, default="vector_store")
-    parser.add_argument("--model", type=str, default="text-embedding-3-large")
+    parser.add_argument("--input", type=str, default=str(API_DIR / "data" / "processed" / "clean_chunks.json"))
+    parser.add_argument("--output", type=str, default=str(FAISS_DIR),
+                        help="raíz del índice: cada build crea versions/<versión> y actualiza CURRENT")
+    parser.add_argument("--collection", type=str, default="",
+                        help="nombre de la colección: el índice va a api/collections/<nombre> (ignora --output)")
+    parser.add_argument("--model", type=str, default="",
+                        help="modelo de embeddings (por defecto el del rol embed en MODEL_PROVIDERS)")
     parser.add_argument("--batch-size", type=int, default=100)
     parser.add_argument("--min-chars", type=int, default=40)
-    parser.add_argument("--force", action="store_true", help="sobrescribir si ya existe el índice")
+    parser.add_argument("--force", action="store_true", help="publicar una versión completa nueva aunque ya exista un índice")
+    parser.add_argument("--incremental", action="store_true",
+                        help="actualiza el índice existente: solo embebe chunks nuevos o modificados y elimina los que ya no están")
+    parser.add_argument("--concurrency", type=int, default=4, help="batches de embeddings en vuelo en simultáneo")
+    parser.add_argument("--tpm", type=int, default=1_000_000, help="presupuesto de tokens por minuto (0 = sin límite)")
+    parser.add_argument("--embedding-cache", type=str, default=str(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else "",
+                        help="SQLite con embeddings ya calculados (vacío para desactivar)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="flat (exacto), hnsw, ivf_flat o ivf_pq (aproximados, para corpus grandes)")
+    parser.add_argument("--nlist", type=int, default=0, help="listas IVF (0 = ~4·sqrt(N))")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="vecinos por nodo en HNSW")
+    parser.add_argument("--ef-construction", type=int, default=200, help="efConstruction de HNSW")
+    parser.add_argument("--pq-m", type=int, default=64, help="subcuantizadores de IVF-PQ (debe dividir la dimensión)")
+    parser.add_argument("--pq-bits", type=int, default=8, help="bits por código de IVF-PQ")
+    parser.add_argument("--keep-versions", type=int, default=INDEX_KEEP_VERSIONS,
+                        help="versiones anteriores a conservar en disco (0 = todas)")
+    # embeber cada oración cuesta del orden de 10x los chunks: solo si la compresión lo va a usar
+    parser.add_argument("--sentence-vectors", action=argparse.BooleanOptionalAction, default=COMPRESSION_ENABLED,
+                        help="embeber las oraciones para la compresión de chunks (por defecto, COMPRESSION_ENABLED)")
     args = parser.parse_args()
+    args.model = args.model or provider_spec("embed")["model"]
 
     input_path = Path(args.input).resolve()
     output_dir = Path(args.output).resolve()
+    if args.collection and args.collection != "default":
+        output_dir = (COLLECTIONS_DIR / args.collection).resolve()
 
     if not input_path.exists():
         raise FileNotFoundError(f"No se encontró el archivo: {input_path}")
 
-    if output_dir.exists() and not args.force:
-        print(f"El índice ya existe en: {output_dir}")
-        print("Usa --force para sobrescribir.")
+    current_version, current_dir = resolve_current(output_dir)
+    published = (current_dir / INDEX_FILE).exists()
+    if published and not (args.force or args.incremental):
+        print(f"El índice ya existe en: {current_dir} (versión {current_version})")
+        print("Usa --force para publicar una versión nueva o --incremental para actualizarlo.")
         return
 
     docs = load_chunks(input_path, args.min_chars)
-    embeddings = OpenAIEmbeddings(model=args.model)
+    # los reintentos por rate limit los maneja ConcurrentEmbedder con backoff adaptativo
+    embeddings = CachedEmbeddings(
+        build_embeddings("embed", model=args.model, max_retries=0),
+        model=embedding_model_id(args.model),
+        max_items=args.batch_size,
+        store_path=Path(args.embedding_cache) if args.embedding_cache else None,
+    )
+    embedder = ConcurrentEmbedder(
+        embeddings.underlying,
+        tokenizer=build_tokenizer("embed", model=args.model),
+        concurrency=args.concurrency,
+        tokens_per_minute=args.tpm,
+    )
+
+    index_params = {
+        "nlist": args.nlist,
+        "hnsw_m": args.hnsw_m,
+        "ef_construction": args.ef_construction,
+        "pq_m": args.pq_m,
+        "pq_bits": args.pq_bits,
+    }
 
-    vectorstore = None
-    for i in tqdm(range(0, len(docs), args.batch_size), desc="Procesando batches"):
-        batch = docs[i:i + args.batch_size]
-        if vectorstore is None:
-            vectorstore = FAISS.from_documents(batch, embeddings)
+    result = None
+    mode = "full"
+    if args.incremental and published:
+        meta = load_build_meta(current_dir)
+        if meta.get("embedding_model") != embedding_model_id(args.model):
+            print("El índice existente no registra el mismo modelo de embeddings: se reconstruye completo.")
+        elif meta.get("index_type", "flat") != args.index_type:
+            print(f"El índice existente es {meta.get('index_type', 'flat')} y se pidió {args.index_type}: se reconstruye completo.")
         else:
-            vectorstore.add_documents(batch)
+            vectorstore = load_index_store(current_dir, embeddings, in_memory=True)
+            result = build_incremental(vectorstore, docs, embeddings, embedder, args.batch_size, args.index_type)
+            if result is None:
+                print("El índice existente no admite la actualización (sin ids/hashes por chunk o sin borrado): se reconstruye completo.")
+            else:
+                mode = "incremental"
+                vectorstore, counts = result
+                result = (vectorstore, counts, meta.get("index_params", {}))
+
+    if result is None:
+        result = build_full(docs, embeddings, embedder, args.batch_size, args.index_type, index_params)
+    vectorstore, counts, used_params = result
 
-    output_dir.mkdir(parents=True, exist_ok=True)
-    vectorstore.save_local(output_dir)
+    # cada build es una versión nueva: la API sigue sirviendo la anterior hasta
+    # que se publica CURRENT y la recarga en caliente
+    version, version_dir = new_version_dir(output_dir)
+    save_index_store(vectorstore, version_dir)
+    # el índice léxico se rehace completo: no requiere embeddings y queda alineado con el docstore
+    bm25 = BM25Index.from_vectorstore(vectorstore)
+    bm25.save(version_dir / BM25_FILE)
+    sentences = None
+    if args.sentence_vectors:
+        # vectores por oración para la compresión de chunks; vía cache, solo se pagan las oraciones nuevas
+        sentences = build_sentence_index(vectorstore, embeddings, embedder, args.batch_size)
+        sentences.save(version_dir / SENTENCES_FILE)
+    save_build_meta(version_dir, {
+        "version": version,
+        "based_on": current_version if mode == "incremental" else None,
+        "embedding_model": embedding_model_id(args.model),
+        "chunks": len(vectorstore.index_to_docstore_id),
+        "index_type": args.index_type,
+        "index_params": used_params,
+        "dim": vectorstore.index.d,
+        "metric": "l2",
+        "bm25_terms": len(bm25.vocab),
+        "sentence_vectors": 0 if sentences is None else len(sentences.vectors),
+        "mode": mode,
+        "built_at": datetime.utcnow().isoformat(),
+    })
 
-    print(f"\nÍndice FAISS guardado en: {output_dir}")
+    publish_version(output_dir, version)
+    pruned = prune_versions(output_dir, args.keep_versions)
+
+    cache = embeddings.stats()
+    print(f"\nÍndice FAISS guardado en: {version_dir} (modo {mode}, índice {args.index_type})")
+    print(f"Versión publicada: {version}" + (f" | versiones eliminadas: {', '.join(pruned)}" if pruned else ""))
+    print(
+        f"Vectores reutilizados del índice: {counts['kept']} | "
+        f"agregados: {counts['added']} | eliminados: {counts['deleted']}"
+    )
+    print(
+        f"Embeddings reutilizados del cache: {cache['hits'] + cache['disk_hits']} | "
+        f"calculados vía API: {cache['misses']}"
+    )
+    print(embedder.summary())
 
 if __name__ == "__main__":
     main()
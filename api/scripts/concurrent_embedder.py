@@ -0,0 +1,126 @@
+from __future__ import annotations
+import asyncio
+import random
+import time
+from tqdm import tqdm
+from api.graphs.rate_limits import AdaptiveLimiter, is_rate_limit_error, retry_after
+
+
+class TokenBudget:
+    """Token bucket de tokens por minuto; acquire() espera hasta tener saldo."""
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        if not self.capacity:
+            return
+        # un batch más grande que el bucket se deja pasar con el bucket lleno
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) * 60 / self.capacity)
+
+
+class ConcurrentEmbedder:
+    """
+    Embebe batches con hasta `concurrency` requests en vuelo, respetando un
+    presupuesto de tokens por minuto (contados con el tokenizer del backend,
+    ver providers.build_tokenizer) y reintentando
+    con backoff exponencial ante rate limits. El resultado respeta el orden
+    de entrada, sin importar en qué orden terminen los batches.
+    """
+
+    def __init__(self, embeddings, tokenizer, concurrency=4, tokens_per_minute=0,
+                 max_retries=8, base_delay=1.0, max_delay=60.0):
+        self.embeddings = embeddings
+        self.concurrency = concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.encoding = tokenizer
+        self.stats = {"chunks": 0, "tokens": 0, "rate_limited": 0, "seconds": 0.0}
+        self._budget = None
+
+    def count_tokens(self, texts):
+        return sum(len(ids) for ids in self.encoding.encode_batch(texts, disallowed_special=()))
+
+    async def _embed_batch(self, texts, limiter, budget):
+        tokens = self.count_tokens(texts)
+        for attempt in range(self.max_retries + 1):
+            await budget.acquire(tokens)
+            async with limiter:
+                try:
+                    vectors = await self.embeddings.aembed_documents(texts)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    error = e
+                else:
+                    await limiter.on_success()
+                    self.stats["chunks"] += len(texts)
+                    self.stats["tokens"] += tokens
+                    return vectors
+
+            self.stats["rate_limited"] += 1
+            await limiter.on_rate_limit()
+            delay = retry_after(error) or min(self.max_delay, self.base_delay * 2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 4))
+
+    def _new_budget(self):
+        # el saldo se arrastra entre llamadas: ingest embebe de a ventanas y
+        # no debe empezar cada una con el bucket lleno
+        budget = TokenBudget(self.tokens_per_minute)
+        if self._budget is not None:
+            budget.tokens, budget.updated = self._budget.tokens, self._budget.updated
+        self._budget = budget
+        return budget
+
+    async def aembed(self, texts, batch_size, on_batch=None, progress=True):
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        limiter = AdaptiveLimiter(self.concurrency)
+        budget = self._new_budget()
+        results = [None] * len(batches)
+        progress = tqdm(total=len(batches), desc="Procesando batches", disable=not progress)
+
+        async def run(idx, batch):
+            results[idx] = await self._embed_batch(batch, limiter, budget)
+            if on_batch:
+                on_batch(batch, results[idx])
+            progress.update(1)
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(run(i, b) for i, b in enumerate(batches)))
+        finally:
+            progress.close()
+            self.stats["seconds"] += time.perf_counter() - start
+
+        return [v for batch in results for v in batch]
+
+    def embed(self, texts, batch_size, on_batch=None, progress=True):
+        if not texts:
+            return []
+        return asyncio.run(self.aembed(texts, batch_size, on_batch, progress))
+
+    def summary(self):
+        secs = self.stats["seconds"] or 1e-9
+        return (
+            f"Embebidos vía API: {self.stats['chunks']} chunks / {self.stats['tokens']} tokens "
+            f"en {self.stats['seconds']:.1f}s "
+            f"({self.stats['chunks'] / secs:.1f} chunks/s, {self.stats['tokens'] / secs:.0f} tokens/s, "
+            f"rate limits: {self.stats['rate_limited']})"
+        )
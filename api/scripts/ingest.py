@@ -0,0 +1,465 @@
+"""
+Ingesta en streaming: PDF → limpieza → chunks → filtro → embeddings → índice.
+
+Cada etapa corre en su propio hilo y se comunica con la siguiente por una
+cola acotada, así que el pipeline (PDF → chunks → embeddings) trabaja con
+memoria acotada: los chunks y sus vectores se van escribiendo al directorio
+de trabajo (JSONL y float32 crudos). El armado final del índice no es
+streaming: FAISS, BM25 y el índice de oraciones se construyen en memoria y
+crecen con el tamaño del corpus. Si la ejecución se interrumpe, la próxima
+retoma desde el último chunk confirmado.
+
+    python -m api.scripts.ingest --input_pdf api/data/raw/libro.pdf
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import resource
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import fitz
+import numpy as np
+from tqdm import tqdm
+from dotenv import load_dotenv
+from api.graphs.config import FAISS_DIR, EMBEDDING_CACHE_PATH, INDEX_KEEP_VERSIONS, COLLECTIONS_DIR, SENTENCE_VECTOR_DIMS, COMPRESSION_ENABLED
+from api.graphs.embedding_cache import CachedEmbeddings
+from api.graphs.providers import build_embeddings, build_tokenizer, embedding_model_id, provider_spec
+from api.graphs.faiss_index import create_index, save_build_meta
+from api.graphs.index_store import INDEX_FILE, save_index_parts
+from api.graphs.index_manager import resolve_current, new_version_dir, publish_version, prune_versions
+from api.graphs.bm25 import BM25Index, BM25_FILE
+from api.graphs.compression import SentenceIndex, SENTENCES_FILE
+from api.scripts.concurrent_embedder import ConcurrentEmbedder
+from api.scripts.preprocess import page_chunks
+from api.scripts.build_vectorstore import chunk_to_document, embed_documents, embed_texts, iter_chunk_items
+
+load_dotenv()
+
+API_DIR = Path(__file__).resolve().parents[1]
+
+# los índices IVF necesitan entrenarse con todos los vectores antes de agregarlos
+STREAM_INDEX_TYPES = ("flat", "hnsw")
+
+MANIFEST_FILE = "ingest.json"
+CHECKPOINT_FILE = "checkpoint.json"
+CHUNKS_FILE = "chunks.jsonl"
+REMOVED_FILE = "removed.jsonl"
+VECTORS_FILE = "vectors.f32"
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+def prefetch(iterable, maxsize):
+    """
+    Consume `iterable` en un hilo aparte y entrega sus elementos a través de
+    una cola de a lo sumo `maxsize`: la etapa anterior se frena cuando la
+    siguiente no da abasto. Los errores se re-lanzan del lado del consumidor.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close:
+                close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_position(chunk_id):
+    """(página, número de chunk) a partir de un id page_<p>_chunk_<i>."""
+    _, page, _, index = chunk_id.split("_")
+    return int(page), int(index)
+
+class IngestCheckpoint:
+    """
+    Directorio de trabajo de una ingesta. chunks.jsonl (formato de
+    preprocess.py) y vectors.f32 están alineados fila a fila; checkpoint.json
+    registra hasta qué byte de cada archivo está confirmado y el último chunk
+    procesado. Lo que quede escrito después de ese punto se descarta al retomar.
+    """
+
+    def __init__(self, work_dir):
+        self.dir = work_dir
+        self.manifest = {}
+        self.state = {"chunks_bytes": 0, "removed_bytes": 0, "vectors": 0, "removed": 0, "cursor": None}
+
+    def _read_json(self, name):
+        path = self.dir / name
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_json(self, name, data):
+        tmp = self.dir / (name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.dir / name)
+
+    def open(self, manifest, restart=False):
+        """
+        Prepara el directorio y devuelve True si se retoma una ingesta previa.
+        Una ingesta ya publicada o con otros parámetros empieza de cero.
+        """
+        previous = self._read_json(MANIFEST_FILE)
+        resumable = (
+            previous is not None
+            and not restart
+            and not previous.get("published")
+            and {k: v for k, v in previous.items() if k != "dim"} == manifest
+        )
+        if previous is not None and not resumable:
+            if not restart and not previous.get("published"):
+                print("La ingesta anterior usó otros parámetros o documento: se empieza de cero.")
+            shutil.rmtree(self.dir)
+
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if not resumable:
+            self.manifest = dict(manifest)
+            self._write_json(MANIFEST_FILE, self.manifest)
+            self._write_json(CHECKPOINT_FILE, self.state)
+            for name in (CHUNKS_FILE, REMOVED_FILE, VECTORS_FILE):
+                (self.dir / name).write_bytes(b"")
+            return False
+
+        self.manifest = previous
+        self.state = self._read_json(CHECKPOINT_FILE) or self.state
+        # se descarta lo escrito después del último checkpoint
+        os.truncate(self.dir / CHUNKS_FILE, self.state["chunks_bytes"])
+        os.truncate(self.dir / REMOVED_FILE, self.state["removed_bytes"])
+        os.truncate(self.dir / VECTORS_FILE, self.state["vectors"] * self.dim * 4 if self.dim else 0)
+        return self.state["cursor"] is not None
+
+    @property
+    def dim(self):
+        return self.manifest.get("dim")
+
+    def set_dim(self, dim):
+        self.manifest["dim"] = dim
+        self._write_json(MANIFEST_FILE, self.manifest)
+
+    def iter_vectors(self, block_rows=4096):
+        """Vectores confirmados, de a bloques, sin cargar el archivo completo."""
+        with open(self.dir / VECTORS_FILE, "rb") as f:
+            remaining = self.state["vectors"]
+            while remaining:
+                rows = min(block_rows, remaining)
+                yield np.frombuffer(f.read(rows * self.dim * 4), dtype="float32").reshape(rows, self.dim)
+                remaining -= rows
+
+    def iter_chunks(self):
+        return iter_chunk_items(self.dir / CHUNKS_FILE)
+
+    def commit(self, kept, vectors, removed, cursor):
+        """
+        Agrega una ventana procesada. Primero se escriben y sincronizan los
+        datos; el checkpoint se actualiza al final, así que un corte en el medio
+        deja la ventana sin confirmar y se rehace al retomar.
+        """
+        with open(self.dir / VECTORS_FILE, "ab") as f:
+            f.write(np.asarray(vectors, dtype="float32").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        sizes = {}
+        for name, items in ((CHUNKS_FILE, kept), (REMOVED_FILE, removed)):
+            with open(self.dir / name, "a", encoding="utf-8") as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                sizes[name] = f.tell()
+
+        self.state = {
+            "chunks_bytes": sizes[CHUNKS_FILE],
+            "removed_bytes": sizes[REMOVED_FILE],
+            "vectors": self.state["vectors"] + len(kept),
+            "removed": self.state["removed"] + len(removed),
+            "cursor": cursor,
+        }
+        self._write_json(CHECKPOINT_FILE, self.state)
+
+    def mark_published(self, version):
+        self.manifest["published"] = version
+        self._write_json(MANIFEST_FILE, self.manifest)
+        # los vectores ya están en el índice publicado; chunks.jsonl queda como salida intermedia
+        (self.dir / VECTORS_FILE).unlink(missing_ok=True)
+
+def iter_pages(input_pdf, first_page, progress):
+    """(número de página 0-based, texto) de a una página; la portada se omite."""
+    with fitz.open(input_pdf) as doc:
+        for page_num in range(max(first_page, 1), len(doc)):
+            yield page_num, doc[page_num].get_text("text")
+            progress.update(1)
+
+def iter_chunks(pages, toc, cursor, args):
+    """
+    (chunk, Document o None) por cada chunk de cada página, en orden.
+    Document es None para los que filtra is_semantically_useful. Al retomar
+    se saltean los chunks hasta el cursor inclusive.
+    """
+    for page_num, raw_text in pages:
+        for chunk, useful in page_chunks(toc, page_num, raw_text, args.max_tokens, args.overlap, args.min_chars):
+            if cursor and chunk_position(chunk["id"]) <= tuple(cursor):
+                continue
+            if not useful:
+                yield chunk, None
+                continue
+            doc = chunk_to_document(chunk, args.min_chunk_chars)
+            # los demasiado cortos se descartan, igual que en build_vectorstore
+            if doc is not None:
+                yield chunk, doc
+
+def iter_windows(chunks, size):
+    """Agrupa los chunks en ventanas con hasta `size` chunks a embeber."""
+    window, pending = [], 0
+    for chunk, doc in chunks:
+        window.append((chunk, doc))
+        pending += doc is not None
+        if pending >= size:
+            yield window
+            window, pending = [], 0
+    if window:
+        yield window
+
+def iter_embedded(windows, embeddings, embedder, batch_size):
+    """(ventana, vectores de sus chunks útiles), en el mismo orden."""
+    for window in windows:
+        docs = [doc for _, doc in window if doc is not None]
+        vectors = embed_documents(docs, embeddings, embedder, batch_size, progress=False) if docs else []
+        yield window, vectors
+
+def build_version(checkpoint, index, output_dir, args, embeddings, embedder):
+    """Arma la versión nueva desde el directorio de trabajo y la publica."""
+    current_version, _ = resolve_current(output_dir)
+    version, version_dir = new_version_dir(output_dir)
+
+    def docs():
+        for item in checkpoint.iter_chunks():
+            yield chunk_to_document(item, args.min_chunk_chars)
+
+    rows = ((pos, d.metadata["id"], d.page_content, d.metadata) for pos, d in enumerate(docs()))
+    save_index_parts(index, rows, version_dir)
+    ids = [d.metadata["id"] for d in docs()]
+    bm25 = BM25Index.build((d.page_content for d in docs()), ids)
+    bm25.save(version_dir / BM25_FILE)
+    sentences = None
+    if args.sentence_vectors:
+        sentences = SentenceIndex.build(
+            ((d.metadata["id"], d.page_content) for d in docs()),
+            lambda texts: embed_texts(texts, embeddings, embedder, args.batch_size, progress=False),
+            SENTENCE_VECTOR_DIMS,
+        )
+        sentences.save(version_dir / SENTENCES_FILE)
+    save_build_meta(version_dir, {
+        "version": version,
+        "based_on": None,
+        "embedding_model": embedding_model_id(args.model),
+        "chunks": len(ids),
+        "index_type": args.index_type,
+        "index_params": checkpoint.manifest["index_params"],
+        "dim": index.d,
+        "metric": "l2",
+        "bm25_terms": len(bm25.vocab),
+        "sentence_vectors": 0 if sentences is None else len(sentences.vectors),
+        "mode": "ingest",
+        "source": str(args.input_pdf),
+        "built_at": datetime.utcnow().isoformat(),
+    })
+
+    publish_version(output_dir, version)
+    pruned = prune_versions(output_dir, args.keep_versions)
+    checkpoint.mark_published(version)
+    return version, version_dir, pruned, current_version
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta en streaming de un PDF al índice FAISS, con checkpoint y reanudación")
+    parser.add_argument("--input_pdf", type=str, default=str(API_DIR / "data" / "raw" / "PDF-GenAI-Challenge.pdf"))
+    parser.add_argument("--output", type=str, default=str(FAISS_DIR),
+                        help="raíz del índice: se crea versions/<versión> y se actualiza CURRENT")
+    parser.add_argument("--collection", type=str, default="",
+                        help="nombre de la colección: el índice va a api/collections/<nombre> (ignora --output)")
+    parser.add_argument("--work-dir", type=str, default="",
+                        help="directorio de checkpoint (por defecto api/data/ingest/<colección>)")
+    parser.add_argument("--restart", action="store_true", help="descarta el checkpoint y empieza de cero")
+    parser.add_argument("--force", action="store_true", help="publicar una versión nueva aunque ya exista un índice")
+    parser.add_argument("--max_tokens", type=int, default=800, help="Número máximo de tokens por chunk.")
+    parser.add_argument("--overlap", type=int, default=160, help="Número de tokens de solapamiento entre chunks.")
+    parser.add_argument("--min_chars", type=int, default=50, help="Número mínimo de caracteres para considerar un párrafo.")
+    parser.add_argument("--min-chunk-chars", type=int, default=40, help="chunks más cortos no se indexan")
+    parser.add_argument("--model", type=str, default="",
+                        help="modelo de embeddings (por defecto el del rol embed en MODEL_PROVIDERS)")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4, help="batches de embeddings en vuelo en simultáneo")
+    parser.add_argument("--tpm", type=int, default=1_000_000, help="presupuesto de tokens por minuto (0 = sin límite)")
+    parser.add_argument("--queue-size", type=int, default=4, help="ventanas en espera entre etapas")
+    parser.add_argument("--embedding-cache", type=str, default=str(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else "",
+                        help="SQLite con embeddings ya calculados (vacío para desactivar)")
+    parser.add_argument("--index-type", choices=STREAM_INDEX_TYPES, default="flat",
+                        help="flat o hnsw (los IVF requieren todos los vectores para entrenar: usar build_vectorstore)")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="vecinos por nodo en HNSW")
+    parser.add_argument("--ef-construction", type=int, default=200, help="efConstruction de HNSW")
+    parser.add_argument("--keep-versions", type=int, default=INDEX_KEEP_VERSIONS,
+                        help="versiones anteriores a conservar en disco (0 = todas)")
+    # embeber cada oración cuesta del orden de 10x los chunks: solo si la compresión lo va a usar
+    parser.add_argument("--sentence-vectors", action=argparse.BooleanOptionalAction, default=COMPRESSION_ENABLED,
+                        help="embeber las oraciones para la compresión de chunks (por defecto, COMPRESSION_ENABLED)")
+    args = parser.parse_args()
+    args.model = args.model or provider_spec("embed")["model"]
+
+    input_pdf = Path(args.input_pdf).resolve()
+    if not input_pdf.exists():
+        raise FileNotFoundError(f"No se encontró el archivo: {input_pdf}")
+    collection = args.collection or "default"
+    output_dir = Path(args.output).resolve()
+    if collection != "default":
+        output_dir = (COLLECTIONS_DIR / collection).resolve()
+    work_dir = Path(args.work_dir).resolve() if args.work_dir else API_DIR / "data" / "ingest" / collection
+
+    current_version, current_dir = resolve_current(output_dir)
+    if (current_dir / INDEX_FILE).exists() and not args.force:
+        print(f"El índice ya existe en: {current_dir} (versión {current_version})")
+        print("Usa --force para publicar una versión nueva.")
+        return
+
+    index_params = {"hnsw_m": args.hnsw_m, "ef_construction": args.ef_construction}
+    checkpoint = IngestCheckpoint(work_dir)
+    resumed = checkpoint.open({
+        "input_pdf": str(input_pdf),
+        "input_sha256": file_sha256(input_pdf),
+        "max_tokens": args.max_tokens,
+        "overlap": args.overlap,
+        "min_chars": args.min_chars,
+        "min_chunk_chars": args.min_chunk_chars,
+        "embedding_model": embedding_model_id(args.model),
+        "index_type": args.index_type,
+        "index_params": index_params if args.index_type == "hnsw" else {},
+    }, restart=args.restart)
+
+    embeddings = CachedEmbeddings(
+        build_embeddings("embed", model=args.model, max_retries=0),
+        model=embedding_model_id(args.model),
+        max_items=args.batch_size,
+        store_path=Path(args.embedding_cache) if args.embedding_cache else None,
+    )
+    embedder = ConcurrentEmbedder(
+        embeddings.underlying,
+        tokenizer=build_tokenizer("embed", model=args.model),
+        concurrency=args.concurrency,
+        tokens_per_minute=args.tpm,
+    )
+
+    # al retomar, el índice se reconstruye con los vectores ya confirmados
+    index = None
+    if checkpoint.dim:
+        index, _ = create_index(args.index_type, checkpoint.dim, None, index_params)
+        for block in checkpoint.iter_vectors():
+            index.add(block)
+
+    cursor = checkpoint.state["cursor"]
+    if resumed:
+        print(f"Retomando la ingesta desde el chunk page_{cursor[0]}_chunk_{cursor[1]} "
+              f"({checkpoint.state['vectors']} chunks ya confirmados)")
+
+    with fitz.open(input_pdf) as doc:
+        toc = doc.get_toc()
+        page_count = len(doc)
+    first_page = cursor[0] - 1 if cursor else 1
+    progress = tqdm(total=page_count - 1, initial=max(first_page - 1, 0), desc="Páginas")
+
+    # cada etapa en su hilo, con colas acotadas entre ellas
+    window_size = args.batch_size * args.concurrency
+    pages = prefetch(iter_pages(input_pdf, first_page, progress), args.queue_size * 4)
+    chunks = prefetch(iter_chunks(pages, toc, cursor, args), window_size)
+    windows = prefetch(iter_windows(chunks, window_size), args.queue_size)
+    embedded = prefetch(iter_embedded(windows, embeddings, embedder, args.batch_size), args.queue_size)
+
+    started = time.perf_counter()
+    try:
+        for window, vectors in embedded:
+            if vectors:
+                if index is None:
+                    checkpoint.set_dim(len(vectors[0]))
+                    index, _ = create_index(args.index_type, checkpoint.dim, None, index_params)
+                index.add(np.asarray(vectors, dtype="float32"))
+            kept = [chunk for chunk, doc in window if doc is not None]
+            removed = [chunk for chunk, doc in window if doc is None]
+            checkpoint.commit(kept, vectors, removed, list(chunk_position(window[-1][0]["id"])))
+    except KeyboardInterrupt:
+        progress.close()
+        print(f"\nIngesta interrumpida: {checkpoint.state['vectors']} chunks confirmados en {work_dir}. "
+              "Volvé a ejecutar el mismo comando para retomar.")
+        return
+    finally:
+        embedded.close()
+    progress.close()
+
+    if index is None:
+        print("No se generaron chunks útiles: no se publica ninguna versión.")
+        return
+
+    version, version_dir, pruned, _ = build_version(checkpoint, index, output_dir, args, embeddings, embedder)
+    elapsed = time.perf_counter() - started
+    cache = embeddings.stats()
+
+    print(f"\nÍndice FAISS guardado en: {version_dir} (modo ingest, índice {args.index_type})")
+    print(f"Versión publicada: {version}" + (f" | versiones eliminadas: {', '.join(pruned)}" if pruned else ""))
+    print(
+        f"Chunks indexados: {checkpoint.state['vectors']} | eliminados por el filtro: {checkpoint.state['removed']} "
+        f"| {elapsed:.1f}s | memoria pico: {peak_rss_mb()} MB"
+    )
+    print(
+        f"Embeddings reutilizados del cache: {cache['hits'] + cache['disk_hits']} | "
+        f"calculados vía API: {cache['misses']}"
+    )
+    print(embedder.summary())
+
+if __name__ == "__main__":
+    main()
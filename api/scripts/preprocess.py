@@ -1,22 +1,30 @@
 import fitz
 import json
+import os
 import re
+import time
 import argparse
 import string
+from concurrent.futures import ProcessPoolExecutor
 from unicodedata import normalize
 
+_HYPHENATION = re.compile(r"(\w)-\s+(\w)")
+_WHITESPACE = re.compile(r"\s+")
+_PARAGRAPH_BREAK = re.compile(r"\n{2,}|(?<=[.!?])\s+(?=[A-Z])")
+_PUNCTUATION = frozenset(string.punctuation)
+
 def clean_text(text):
     if not text:
         return ""
     text = normalize("NFKC", text)
-    text = re.sub(r"(?<!\n)\n(?!\n)", " ", text)
-    text = re.sub(r"\n+", "\n", text)
-    text = re.sub(r"(\w)-\s+(\w)", r"\1\2", text)
-    text = re.sub(r"\s+", " ", text)
+    # unir palabras cortadas con guión y colapsar espacios/saltos de línea;
+    # el resultado es el mismo que normalizar antes los saltos por separado
+    text = _HYPHENATION.sub(r"\1\2", text)
+    text = _WHITESPACE.sub(" ", text)
     return text.strip()
 
 def split_into_paragraphs(text, min_chars):
-    paragraphs = re.split(r"\n{2,}|(?<=[.!?])\s+(?=[A-Z])", text)
+    paragraphs = _PARAGRAPH_BREAK.split(text)
     return [p.strip() for p in paragraphs if len(p.strip()) > min_chars]
 
 def chunk_paragraphs(paragraphs, max_tokens, overlap):
@@ -68,9 +76,9 @@ def is_semantically_useful(text, min_unique_ratio = 0.25, min_alpha_ratio = 0.5,
         return False
 
     unique_ratio = len(set(tokens)) / len(tokens)
-    alpha_ratio = sum(c.isalpha() for c in text) / len(text)
-    num_ratio = sum(c.isdigit() for c in text) / len(text)
-    symbol_ratio = sum(c in string.punctuation for c in text) / len(text)
+    alpha_ratio = sum(map(str.isalpha, text)) / len(text)
+    num_ratio = sum(map(str.isdigit, text)) / len(text)
+    symbol_ratio = sum(map(_PUNCTUATION.__contains__, text)) / len(text)
 
     if unique_ratio < min_unique_ratio:
         return False
@@ -81,46 +89,102 @@ def is_semantically_useful(text, min_unique_ratio = 0.25, min_alpha_ratio = 0.5,
 
     return True
 
-def process_pdf(input_pdf, output_file, max_tokens, overlap, min_chars):
+def page_chunks(toc, page_num, raw_text, max_tokens, overlap, min_chars):
+    """
+    Chunks de una página (índice 0-based) como pares (chunk, útil).
+    Vacío si la página es muy corta o cae fuera de un capítulo indexable.
+    """
+    clean = clean_text(raw_text)
+    if len(clean) < min_chars:
+        return []
+
+    chapter, section, subsection = get_hierarchy_for_page(toc, page_num + 1)
+    if not chapter or chapter.lower() in ["contents", "index"]:
+        return []
+
+    paragraphs = split_into_paragraphs(clean, min_chars)
+    chunks = chunk_paragraphs(paragraphs, max_tokens, overlap)
+
+    result = []
+    for i, ch in enumerate(chunks):
+        chunk = {
+            "id": f"page_{page_num+1}_chunk_{i+1}",
+            "page": page_num + 1,
+            "chapter": chapter,
+            "section": section,
+            "subsection": subsection,
+            "text": ch
+        }
+        result.append((chunk, is_semantically_useful(ch)))
+    return result
+
+def process_pages(input_pdf, start, end, max_tokens, overlap, min_chars):
+    """
+    Procesa las páginas [start, end) y devuelve (útiles, eliminados).
+    Abre el documento por su cuenta para poder correr en otro proceso.
+    """
     doc = fitz.open(input_pdf)
     toc = doc.get_toc()
-    output = []
-
-    for page_num in range(1, len(doc)):
-        page = doc[page_num]
-        raw_text = page.get_text("text")
-        clean = clean_text(raw_text)
-        if len(clean) < min_chars:
-            continue
-
-        chapter, section, subsection = get_hierarchy_for_page(toc, page_num + 1)
-        if not chapter or chapter.lower() in ["contents", "index"]:
-            continue
-
-        paragraphs = split_into_paragraphs(clean, min_chars)
-        chunks = chunk_paragraphs(paragraphs, max_tokens, overlap)
-
-        for i, ch in enumerate(chunks):
-            output.append({
-                "id": f"page_{page_num+1}_chunk_{i+1}",
-                "page": page_num + 1,
-                "chapter": chapter,
-                "section": section,
-                "subsection": subsection,
-                "text": ch
-            })
-
-    filtered_output = [c for c in output if is_semantically_useful(c["text"])]
-    removed_output = [c for c in output if not is_semantically_useful(c["text"])]
-
-    print(f"Chunks totales: {len(output)} | Útiles: {len(filtered_output)} | Eliminados: {len(removed_output)}")
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(filtered_output, f, ensure_ascii=False, indent=2)
-
-    removed_file = output_file.replace(".json", "_removed.json")
-    with open(removed_file, "w", encoding="utf-8") as f:
-        json.dump(removed_output, f, ensure_ascii=False, indent=2)
+    kept, removed = [], []
+
+    for page_num in range(start, end):
+        raw_text = doc[page_num].get_text("text")
+        for chunk, useful in page_chunks(toc, page_num, raw_text, max_tokens, overlap, min_chars):
+            (kept if useful else removed).append(chunk)
+
+    doc.close()
+    return kept, removed
+
+def page_ranges(first, last, parts):
+    """Divide [first, last) en a lo sumo `parts` rangos contiguos de tamaño parecido."""
+    total = last - first
+    parts = max(1, min(parts, total))
+    bounds = [first + total * i // parts for i in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def write_chunks(path, chunks):
+    """JSON indentado o, si la ruta termina en .jsonl, un chunk por línea."""
+    with open(path, "w", encoding="utf-8") as f:
+        if str(path).endswith(".jsonl"):
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        else:
+            json.dump(chunks, f, ensure_ascii=False, indent=2)
+
+def process_pdf(input_pdf, output_file, max_tokens, overlap, min_chars, workers=1):
+    started = time.perf_counter()
+    with fitz.open(input_pdf) as doc:
+        page_count = len(doc)
+
+    # la primera página (portada) se omite, como siempre
+    if workers <= 1:
+        results = [process_pages(input_pdf, 1, page_count, max_tokens, overlap, min_chars)]
+    else:
+        # varios rangos por worker para repartir bien las páginas más pesadas;
+        # map() devuelve los resultados en orden, así que la salida es la misma que en serie
+        ranges = page_ranges(1, page_count, workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                process_pages,
+                [input_pdf] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+                [max_tokens] * len(ranges),
+                [overlap] * len(ranges),
+                [min_chars] * len(ranges),
+            ))
+
+    filtered_output = [c for kept, _ in results for c in kept]
+    removed_output = [c for _, removed in results for c in removed]
+    elapsed = time.perf_counter() - started
+
+    print(f"Chunks totales: {len(filtered_output) + len(removed_output)} | Útiles: {len(filtered_output)} | Eliminados: {len(removed_output)}")
+    print(f"{page_count - 1} páginas procesadas en {elapsed:.1f}s con {max(workers, 1)} worker(s)")
+
+    write_chunks(output_file, filtered_output)
+    stem, ext = os.path.splitext(output_file)
+    removed_file = f"{stem}_removed{ext}"
+    write_chunks(removed_file, removed_output)
 
     print(f"PDF procesado: {len(filtered_output)} chunks útiles guardados en {output_file}")
     print(f"Chunks eliminados guardados en {removed_file}")
@@ -128,10 +192,11 @@ def process_pdf(input_pdf, output_file, max_tokens, overlap, min_chars):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Procesa un PDF y genera chunks limpios para RAG.")
     parser.add_argument("--input_pdf", type=str, default="data/raw/PDF-GenAI-Challenge.pdf", help="Ruta del PDF de entrada.")
-    parser.add_argument("--output_json", type=str, default="data/processed/clean_chunks.json", help="Ruta del archivo JSON de salida.")
+    parser.add_argument("--output_json", type=str, default="data/processed/clean_chunks.json", help="Ruta del archivo JSON de salida (.jsonl para un chunk por línea).")
     parser.add_argument("--max_tokens", type=int, default=800, help="Número máximo de tokens por chunk.")
     parser.add_argument("--overlap", type=int, default=160, help="Número de tokens de solapamiento entre chunks.")
     parser.add_argument("--min_chars", type=int, default=50, help="Número mínimo de caracteres para considerar un párrafo.")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos entre los que se reparten las páginas (1 = en serie).")
 
     args = parser.parse_args()
 
@@ -141,4 +206,5 @@ if __name__ == "__main__":
         max_tokens=args.max_tokens,
         overlap=args.overlap,
         min_chars=args.min_chars,
+        workers=args.workers,
     )
\ No newline at end of file
@@ -0,0 +1,68 @@
+import pytest
+from api.graphs.config import FOLLOWUP_FASTPATH_CONFIDENCE
+from api.graphs.followup_classifier import FollowupClassifier
+from api.graphs.prompts.followup_examples import FOLLOWUP_EXAMPLES, FOLLOWUP_HOLDOUT
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return FollowupClassifier()
+
+
+def _fast_path(classifier, question, has_history):
+    return classifier.fast_label(question, has_history, FOLLOWUP_FASTPATH_CONFIDENCE)
+
+
+@pytest.mark.parametrize("question", [
+    "¿cómo estás?",
+    "qué tal?",
+    "¿quién sos?",
+    "¿qué podés hacer?",
+    "cuéntame un chiste",
+])
+def test_smalltalk_without_history_is_not_standalone(classifier, question):
+    # si el fast path decide, tiene que ser smalltalk; si no, lo resuelve el LLM
+    assert _fast_path(classifier, question, False) in ("smalltalk", None)
+
+
+@pytest.mark.parametrize("question", ["What is QDA?", "¿Qué es QDA?"])
+def test_new_question_with_history_is_not_followup(classifier, question):
+    assert _fast_path(classifier, question, True) in ("standalone", None)
+
+
+@pytest.mark.parametrize("question", [
+    "how does it compare to ridge?",
+    "¿cuáles son las desventajas?",
+    "cuál es la diferencia con LDA",
+    "¿se puede usar con variables categóricas?",
+])
+def test_history_questions_go_to_llm(classifier, question):
+    # con historial el modelo no decide: un follow-up tomado como standalone
+    # se recuperaría sin reescribir
+    assert _fast_path(classifier, question, True) is None
+
+
+@pytest.mark.parametrize("question, label", [
+    ("gracias", "smalltalk"),
+    ("hola!", "smalltalk"),
+    ("dale", "followup"),
+    ("sí, por favor", "followup"),
+])
+def test_history_rules_still_decide(classifier, question, label):
+    assert _fast_path(classifier, question, True) == label
+
+
+def test_no_followup_without_history(classifier):
+    for question in ("sí", "dale", "¿y un ejemplo?", "explicame mejor"):
+        assert classifier.predict(question, False)[0] != "followup"
+
+
+def test_holdout_fastpath_is_reliable(classifier):
+    report = classifier.evaluate(FOLLOWUP_HOLDOUT, threshold=FOLLOWUP_FASTPATH_CONFIDENCE)
+    assert report["fastpath_accuracy"] == 1.0
+    assert report["accuracy"] >= 0.9
+
+
+def test_holdout_is_not_in_training_set():
+    seen = {(q, h) for q, h, _ in FOLLOWUP_EXAMPLES}
+    assert not any((q, h) in seen for q, h, _ in FOLLOWUP_HOLDOUT)
@@ -0,0 +1,130 @@
+import threading
+import pytest
+from api.graphs.collection_registry import CollectionRegistry
+from api.graphs.index_manager import IndexBundle, IndexManager, publish_version
+
+
+def _bundle(version="v1", path=None, disk_mb=10.0):
+    return IndexBundle(version, path, object(), object(), f"fp-{version}", {"disk_mb": disk_mb})
+
+
+class _Loader:
+    def __init__(self, disk_mb=10.0):
+        self.disk_mb = disk_mb
+        self.calls = []
+
+    def __call__(self, *args):
+        version, path = args[-2:]
+        self.calls.append(args)
+        return _bundle(version, path, self.disk_mb)
+
+
+def test_retired_bundle_closes_after_last_release():
+    bundle = _bundle()
+    bundle.acquire()
+    bundle.acquire()
+    bundle.retire()
+    assert not bundle.closed
+
+    bundle.release()
+    assert not bundle.closed
+    assert bundle.vectorstore is not None and bundle.bm25 is not None
+
+    bundle.release()
+    assert bundle.closed
+    # quien la tenía sin fijar (LangServe, registry.active()) la sigue pudiendo usar
+    assert bundle.vectorstore is not None and bundle.bm25 is not None
+
+
+def test_retire_without_refs_closes_immediately():
+    bundle = _bundle()
+    bundle.retire()
+    assert bundle.closed
+
+
+@pytest.fixture
+def index_root(tmp_path):
+    root = tmp_path / "default"
+    root.mkdir()
+    publish_version(root, "v1")
+    return root
+
+
+def test_reload_keeps_pinned_version(index_root):
+    manager = IndexManager(index_root, _Loader())
+    old = manager.acquire()
+    publish_version(index_root, "v2")
+
+    assert manager.reload()
+    assert manager.version() == "v2"
+    assert old.version == "v1" and not old.closed
+
+    old.release()
+    assert old.closed
+
+
+def test_acquire_survives_concurrent_unload(index_root):
+    manager = IndexManager(index_root, _Loader())
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            while not stop.is_set():
+                bundle = manager.acquire()
+                assert bundle is not None and not bundle.closed
+                bundle.release()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for _ in range(200):
+        manager.unload()
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+
+
+@pytest.fixture
+def registry(tmp_path):
+    collections_dir = tmp_path / "collections"
+    for name in ("a", "b"):
+        root = collections_dir / name
+        root.mkdir(parents=True)
+        publish_version(root, "v1")
+    loader = _Loader(disk_mb=10.0)
+    registry = CollectionRegistry(tmp_path / "default", collections_dir, loader, memory_budget_mb=15)
+    registry.loader_calls = loader.calls
+    return registry
+
+
+def test_eviction_keeps_pinned_bundle_alive(registry):
+    pinned = registry.acquire(["a"])
+    bundle_a = pinned["a"]
+
+    other = registry.acquire(["b"])
+    assert registry.loaded() == ["b"]
+    assert registry.evictions == 1
+    # "a" se descargó del registry pero el request que la fijó la sigue usando
+    assert not bundle_a.closed
+    assert bundle_a.vectorstore is not None
+
+    registry.release(pinned)
+    assert bundle_a.closed
+    registry.release(other)
+
+    again = registry.acquire(["a"])
+    assert again["a"] is not bundle_a
+    assert [call[0] for call in registry.loader_calls] == ["a", "b", "a"]
+    registry.release(again)
+
+
+def test_collections_of_the_same_request_are_not_evicted(registry):
+    with registry.pinned(["a", "b"]) as bundles:
+        assert set(registry.loaded()) == {"a", "b"}
+        assert registry.evictions == 0
+        assert registry.active(["a", "b"]) == bundles
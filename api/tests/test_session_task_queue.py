@@ -0,0 +1,52 @@
+import threading
+import pytest
+from api.graphs.background import SessionTaskQueue
+
+
+@pytest.fixture
+def tasks():
+    q = SessionTaskQueue(max_workers=2)
+    yield q
+    q.shutdown()
+
+
+def test_only_latest_pending_summary_runs(tasks):
+    started, release = threading.Event(), threading.Event()
+    ran = []
+
+    def summarize(n):
+        if n == 0:
+            started.set()
+            release.wait(5)
+        ran.append(n)
+
+    tasks.submit_summary("s", summarize, 0)
+    assert started.wait(5)
+    for n in (1, 2, 3):
+        tasks.submit_summary("s", summarize, n)
+    release.set()
+
+    assert tasks.wait_idle("s", timeout=5)
+    assert ran == [0, 3]
+    assert tasks.pending() == 0
+
+
+def test_sessions_run_in_parallel(tasks):
+    barrier = threading.Barrier(2, timeout=5)
+    tasks.submit_summary("a", barrier.wait)
+    tasks.submit_summary("b", barrier.wait)
+
+    assert tasks.wait_idle("a", timeout=5) and tasks.wait_idle("b", timeout=5)
+    assert not barrier.broken
+
+
+def test_failing_summary_does_not_block_the_session(tasks):
+    ran = threading.Event()
+
+    def boom():
+        raise RuntimeError("falla el resumen")
+
+    tasks.submit_summary("s", boom)
+    assert tasks.wait_idle("s", timeout=5)
+    tasks.submit_summary("s", ran.set)
+    assert ran.wait(5)
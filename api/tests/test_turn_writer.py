@@ -0,0 +1,74 @@
+import threading
+import pytest
+from api.db import writer
+from api.db.history import ConnectionPool, migrate
+from api.db.writer import TurnWriter
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pool = ConnectionPool(tmp_path / "chat_history.sqlite")
+    migrate(pool)
+    monkeypatch.setattr(writer, "get_pool", lambda: pool)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def turn_writer(pool):
+    w = TurnWriter(batch_size=8, flush_interval=0.01)
+    yield w
+    w.shutdown(timeout=5)
+
+
+def _rows(pool, session_id):
+    with pool.connection() as con:
+        return con.execute(
+            "SELECT turn, role, message FROM chat_history WHERE session_id = ? ORDER BY id",
+            (session_id,),
+        ).fetchall()
+
+
+def test_turns_keep_per_session_order(pool, turn_writer):
+    futures = {s: [] for s in ("a", "b", "c")}
+    for i in range(20):
+        for s in futures:
+            futures[s].append(turn_writer.save(s, f"{s}-q{i}", f"{s}-r{i}", [], []))
+
+    assert turn_writer.flush(timeout=5)
+    for s, fs in futures.items():
+        assert [f.result(timeout=5) for f in fs] == list(range(20))
+        rows = _rows(pool, s)
+        assert [m for _, role, m in rows if role == "user"] == [f"{s}-q{i}" for i in range(20)]
+        assert [t for t, role, _ in rows if role == "assistant"] == list(range(20))
+
+
+def test_concurrent_saves_never_share_a_turn(pool, turn_writer):
+    def worker(n):
+        for i in range(10):
+            turn_writer.save("shared", f"q{n}-{i}", f"r{n}-{i}", [], [])
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert turn_writer.wait_session("shared", timeout=5)
+    turns = [t for t, role, _ in _rows(pool, "shared") if role == "user"]
+    assert turns == list(range(40))
+
+
+def test_bad_turn_only_fails_its_own_future(pool, turn_writer):
+    ok_before = turn_writer.save("s", "q0", "r0", [], [])
+    # sources no serializable: falla el json.dumps después de insertar las filas del turno
+    bad = turn_writer.save("s", "q1", "r1", [object()], [])
+    ok_after = turn_writer.save("s", "q2", "r2", [], [])
+
+    assert turn_writer.flush(timeout=5)
+    assert ok_before.result(timeout=5) == 0
+    with pytest.raises(TypeError):
+        bad.result(timeout=5)
+    assert ok_after.result(timeout=5) == 1
+    assert [m for _, role, m in _rows(pool, "s") if role == "user"] == ["q0", "q2"]
+    assert turn_writer.stats()["pending"] == 0